@@ -0,0 +1,563 @@
+# -- coding: utf-8 --
+"""端到端HTTP基准测试：登录、全部页面和接口的吞吐与延迟，以及事件循环响应性检查
+
+用法: python bench/bench_http.py [--mode asgi|uvicorn] [--concurrency 1 8 32] [--seconds 3]
+                                [--only api logs] [--output results.json] [--baseline old.json]
+
+在临时目录中复制一份应用（不影响当前目录的数据和配置）并写入模拟日志，然后：
+- asgi模式（默认）：在本进程中导入run:app，按ASGI协议直接调用，不经过网络；
+  客户端与应用共用一个事件循环，延迟中包含客户端自身的少量开销
+- uvicorn模式：用uvicorn启动副本，每个并发客户端使用一个HTTP/1.1长连接
+
+每个接口在各并发数下持续请求seconds秒，统计每秒请求数和p50/p95/p99延迟。
+响应性检查：慢接口（登录、日志搜索、进程列表等）在并发压力下时，按固定间隔请求一个轻量接口，
+延迟从计划发送的时刻算起（事件循环被阻塞期间没能发出的请求也计入），p99超过空载p99加--lag-over-idle
+毫秒、或超过--max-lag毫秒即不通过（例如请求处理中出现阻塞事件循环的调用）。
+测量前先校验每个接口的响应：状态码不小于400、JSON响应中success为false、需要登录的接口被重定向到登录页
+都算作错误结果，吞吐数字不能掩盖接口已经出错。
+结果写入JSON；指定--baseline时与之前的结果对比，p50变慢超过--tolerance倍视为回归。
+有检查不通过、错误结果或回归时退出码为1，可直接用于CI。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote
+
+from bench_login import ROOT, prepare_app, wait_ready, free_port, percentile
+
+USERNAME = "ilovefirefly"
+PASSWORD = "ilovefirefly"
+# 关闭登录限流，否则登录接口测到的只是429
+UNLIMITED_AUTH = {"login_burst": 1e9, "login_per_minute": 1e9}
+
+class Endpoint(NamedTuple):
+    name: str
+    group: str
+    method: str
+    path: str
+    body: Optional[Dict[str, Any]] = None
+    auth: bool = True
+    # 路由模板（带路径参数的接口），用于检查哪些路由没有覆盖
+    route: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.method} {self.route or self.path.split('?', 1)[0]}"
+
+ENDPOINTS = [
+    Endpoint("login", "auth", "POST", "/auth/login", {"username": USERNAME, "password": PASSWORD}, auth=False),
+
+    # 根路径总是重定向到登录页
+    Endpoint("page-root", "pages", "GET", "/", auth=False),
+    Endpoint("page-login", "pages", "GET", "/login", auth=False),
+    Endpoint("page-dashboard", "pages", "GET", "/dashboard"),
+    Endpoint("page-settings", "pages", "GET", "/settings"),
+    Endpoint("page-start", "pages", "GET", "/start"),
+    Endpoint("page-logs", "pages", "GET", "/logs"),
+    Endpoint("page-processes", "pages", "GET", "/processes"),
+    Endpoint("page-run", "pages", "GET", "/run"),
+    Endpoint("page-error", "pages", "GET", "/error?error=bench"),
+
+    Endpoint("config", "api", "GET", "/api/config"),
+    Endpoint("config-update", "api", "POST", "/api/config/update", {"path": "ui.bench_marker", "value": 1}),
+    Endpoint("complete-setup", "api", "POST", "/api/config/complete-setup", {}),
+    # 新旧密码相同，每次请求做一次校验和一次哈希
+    Endpoint("update-password", "api", "POST", "/api/update-password",
+             {"current_password": PASSWORD, "new_password": PASSWORD}),
+    Endpoint("update-background", "api", "POST", "/api/update-background",
+             {"type": "rings", "color": "#ffffff", "background_color": "#000000", "speed": 1.0}),
+    Endpoint("recent-logs", "logs", "GET", "/api/recent-logs"),
+    Endpoint("logs", "logs", "GET", "/api/logs"),
+    Endpoint("logs-search", "logs", "GET", "/api/logs?date_range=all&search=timeout"),
+    Endpoint("logs-search-cjk", "logs", "GET", "/api/logs?date_range=all&search=%E5%A4%84%E7%90%86%E6%B6%88%E6%81%AF"),
+    Endpoint("logs-error", "logs", "GET", "/api/logs?date_range=all&type=error&page=5"),
+    Endpoint("logs-archives", "logs", "GET", "/api/logs/archives"),
+    Endpoint("services", "api", "GET", "/api/services"),
+    Endpoint("service-stats", "api", "GET", "/api/services/bot/stats", route="/api/services/{name}/stats"),
+    Endpoint("system-resources", "api", "GET", "/api/system-resources"),
+    Endpoint("metrics-history", "api", "GET", "/api/metrics/history"),
+    Endpoint("processes", "api", "GET", "/api/processes"),
+    Endpoint("processes-top50", "api", "GET", "/api/processes?limit=50&sort=cpu"),
+    Endpoint("processes-query", "api", "GET",
+             "/api/processes?sort=name&order=asc&q=*p*&offset=20&limit=20&fields=pid,name,user,cmdline,memory_mb"),
+    Endpoint("process-tree", "api", "GET", "/api/process-tree"),
+    Endpoint("process-tree-expanded", "api", "GET", "/api/process-tree?depth=64&sort=cpu"),
+    # 先注册，搜索和解析接口才有可匹配的命令
+    Endpoint("commands-register", "commands", "POST", "/api/commands",
+             {"file": "bench", "commands": [{"name": "bench-ping", "cmd": "/bench ping", "type": "bench"}]}),
+    Endpoint("commands", "commands", "GET", "/api/commands"),
+    Endpoint("commands-search", "commands", "GET", "/api/commands?q=bench"),
+    Endpoint("commands-types", "commands", "GET", "/api/commands/types"),
+    Endpoint("commands-resolve", "commands", "GET", "/api/commands/resolve?text=/bench%20ping%201"),
+    Endpoint("metrics", "api", "GET", "/metrics"),
+    Endpoint("debug-routes", "api", "GET", "/api/debug/routes"),
+    Endpoint("debug-loop", "api", "GET", "/api/debug/loop"),
+    Endpoint("debug-memory", "api", "GET", "/api/debug/memory"),
+    Endpoint("debug-memory-suspects", "api", "GET", "/api/debug/memory/suspects"),
+]
+
+# 有意不测的路由及原因
+SKIPPED = {
+    "GET /api/logs/stream": "SSE长连接，没有单次请求的耗时",
+    "WS /api/ws": "WebSocket",
+    "POST /api/toggle-bot": "会启动或停止机器人进程",
+    "POST /api/reconnect-protocol": "会重启协议端进程",
+    "POST /api/services/{name}": "会启动或停止服务进程",
+    "POST /auth/logout": "会注销测试使用的会话",
+    "POST /auth/change-password": "会修改测试使用的密码",
+    "GET /api/debug/profile": "每次请求持续采样数秒",
+    "POST /api/debug/memory/start": "开启内存跟踪会拖慢其余所有接口",
+    "POST /api/debug/memory/stop": "改变内存跟踪状态",
+    "POST /api/debug/memory/snapshots": "需要先开启内存跟踪",
+    "DELETE /api/debug/memory/snapshots/{name}": "需要先保存快照",
+    "GET /api/debug/memory/top": "需要先开启内存跟踪",
+    "GET /api/debug/memory/diff": "需要先保存快照",
+}
+
+# 响应性检查：对这些慢接口施加压力，同时每隔PROBE_INTERVAL秒请求一次PROBE
+LOAD_ENDPOINTS = ("login", "update-password", "logs-search", "logs-search-cjk", "processes-top50",
+                  "metrics-history", "config-update", "page-dashboard")
+PROBE = "system-resources"
+PROBE_INTERVAL = 0.01
+# 亚毫秒级的接口抖动比例大，p50至少慢这么多（毫秒）才算回归
+MIN_REGRESSION_MS = 1.0
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+class AsgiConnection:
+    """按ASGI协议直接调用应用"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> Response:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": unquote(path), "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "",
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+            "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+        }
+        done = asyncio.Event()
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        status = 0
+        response_headers: Dict[str, str] = {}
+        chunks: List[bytes] = []
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            # 请求体已读完，响应结束后才报告断开
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for key, value in message.get("headers", []):
+                    response_headers[key.decode("latin-1").lower()] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        # 相当于一次网络往返的让出：处理过程中不挂起的接口也不会让并发客户端独占事件循环
+        await asyncio.sleep(0)
+        await self.app(scope, receive, send)
+        done.set()
+        return status, response_headers, b"".join(chunks)
+
+    async def close(self):
+        pass
+
+class HttpConnection:
+    """HTTP/1.1长连接，服务器关闭连接后自动重连"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> Response:
+        try:
+            return await self._request(method, path, body, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 长连接可能已被服务器关闭，重连后重试一次
+            await self.close()
+            return await self._request(method, path, body, headers)
+
+    async def _request(self, method: str, path: str, body: bytes, headers: Optional[Dict[str, str]]) -> Response:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{self.port}", f"Content-Length: {len(body)}"]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+        response_headers = {}
+        for line in header_lines:
+            key, _, value = line.partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        if response_headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            payload = b"".join(chunk[:-2] for chunk in chunks)
+        else:
+            payload = await self.reader.readexactly(int(response_headers.get("content-length", 0)))
+        if response_headers.get("connection") == "close":
+            await self.close()
+        return int(status_line.split()[1]), response_headers, payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+Connect = Callable[[], Awaitable[Any]]
+
+class Client:
+    """带登录会话的请求发送器"""
+
+    def __init__(self, connect: Connect):
+        self.connect = connect
+        self.cookie = ""
+
+    async def login(self):
+        connection = await self.connect()
+        try:
+            status, headers, payload = await connection.request(*self.prepare(ENDPOINTS[0]))
+        finally:
+            await connection.close()
+        if status != 200 or "set-cookie" not in headers:
+            raise RuntimeError(f"登录失败: {status} {payload[:200]!r}")
+        self.cookie = headers["set-cookie"].split(";", 1)[0]
+
+    def prepare(self, endpoint: Endpoint) -> Tuple[str, str, bytes, Dict[str, str]]:
+        headers = {}
+        body = b""
+        if endpoint.body is not None:
+            body = json.dumps(endpoint.body).encode()
+            headers["Content-Type"] = "application/json"
+        if endpoint.auth and self.cookie:
+            headers["Cookie"] = self.cookie
+        return endpoint.method, endpoint.path, body, headers
+
+def validate(endpoint: Endpoint, response: Response) -> Optional[str]:
+    """检查响应内容是否正确，返回问题描述"""
+    status, headers, payload = response
+    if status >= 400:
+        return f"状态码{status}: {payload[:200]!r}"
+    if endpoint.auth and "/login" in headers.get("location", ""):
+        return "会话失效，被重定向到登录页"
+    if headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return f"JSON无法解析: {payload[:200]!r}"
+        if isinstance(data, dict) and data.get("success") is False:
+            return f"接口返回失败: {data.get('message')}"
+    return None
+
+async def check_endpoint(client: Client, endpoint: Endpoint) -> Optional[str]:
+    connection = await client.connect()
+    try:
+        return validate(endpoint, await connection.request(*client.prepare(endpoint)))
+    finally:
+        await connection.close()
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies, default=0.0), 3),
+    }
+
+async def run_load(client: Client, endpoint: Endpoint, concurrency: int, seconds: float,
+                   stop: Optional[asyncio.Event] = None) -> Dict[str, Any]:
+    """concurrency个客户端持续请求seconds秒（或直到stop被设置），返回延迟统计（毫秒）"""
+    request = client.prepare(endpoint)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    deadline = time.perf_counter() + seconds
+
+    def running() -> bool:
+        return (stop.is_set() is False) if stop is not None else time.perf_counter() < deadline
+
+    async def worker():
+        connection = await client.connect()
+        try:
+            while running():
+                start = time.perf_counter()
+                try:
+                    status, _, _ = await connection.request(*request)
+                except (OSError, asyncio.IncompleteReadError):
+                    statuses["error"] += 1
+                    await connection.close()
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] += 1
+        finally:
+            await connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["errors"] = sum(n for status, n in statuses.items() if status == "error" or status >= 400)
+    result["statuses"] = {str(status): n for status, n in sorted(statuses.items(), key=str)}
+    return result
+
+async def probe_latency(client: Client, endpoint: Endpoint, seconds: float) -> Dict[str, Any]:
+    """按固定间隔串行请求，延迟从计划发送的时刻算起：事件循环在两次请求之间被阻塞时，
+    下一个请求的延迟包含阻塞的时间，而不是等阻塞结束后才开始计时"""
+    request = client.prepare(endpoint)
+    connection = await client.connect()
+    latencies: List[float] = []
+    started = time.perf_counter()
+    scheduled = started
+    try:
+        while not latencies or time.perf_counter() - started < seconds:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await connection.request(*request)
+            finished = time.perf_counter()
+            latencies.append((finished - scheduled) * 1000)
+            # 落后于计划时从当前时刻重新计划，不累积积压
+            scheduled = max(scheduled + PROBE_INTERVAL, finished)
+    finally:
+        await connection.close()
+    return summarize(latencies, time.perf_counter() - started)
+
+async def check_responsiveness(client: Client, endpoints: Dict[str, Endpoint], args) -> List[Dict[str, Any]]:
+    """慢接口在压力下时轻量接口的延迟"""
+    probe = endpoints[PROBE]
+    baseline = await probe_latency(client, probe, args.seconds)
+    limit = min(args.max_lag, baseline["p99"] + args.lag_over_idle)
+    print(f"\n响应性检查：每{PROBE_INTERVAL * 1000:.0f}ms请求一次{probe.path}，慢接口各{args.load_concurrency}并发，"
+          f"p99上限{limit:.2f}ms")
+    print(f"{'压力来源':<20} {'p50':>9} {'p99':>9} {'max':>9}   结果")
+    print(f"{'(空载)':<20} {baseline['p50']:>7.2f}ms {baseline['p99']:>7.2f}ms {baseline['max']:>7.2f}ms")
+    results = []
+    for name in LOAD_ENDPOINTS:
+        if name not in endpoints:
+            continue
+        stop = asyncio.Event()
+        load = asyncio.create_task(run_load(client, endpoints[name], args.load_concurrency, 0, stop))
+        await asyncio.sleep(0.2)
+        measured = await probe_latency(client, probe, args.seconds)
+        stop.set()
+        pressure = await load
+        ok = measured["p99"] <= limit
+        print(f"{name:<20} {measured['p50']:>7.2f}ms {measured['p99']:>7.2f}ms {measured['max']:>7.2f}ms   "
+              f"{'通过' if ok else '不通过'}  (压力 {pressure['rps']:.0f} req/s)")
+        results.append({"load": name, "concurrency": args.load_concurrency, "probe": measured,
+                        "load_result": pressure, "baseline_p99": baseline["p99"], "limit": limit, "ok": ok})
+    return results
+
+def coverage(routes: List[str]) -> List[str]:
+    """应用中既没有测试也没有列入SKIPPED的路由"""
+    covered = {endpoint.key for endpoint in ENDPOINTS} | set(SKIPPED)
+    return sorted(route for route in routes if route not in covered)
+
+def app_routes(app) -> List[str]:
+    routes = []
+    for route in app.routes:
+        path = getattr(route, "path", "")
+        if path.startswith(("/static", "/assets", "/docs", "/redoc", "/openapi")):
+            continue
+        methods = getattr(route, "methods", None)
+        if methods:
+            routes += [f"{method} {path}" for method in sorted(methods) if method != "HEAD"]
+        elif route.__class__.__name__ == "WebSocketRoute":
+            routes.append(f"WS {path}")
+    return routes
+
+# 写入模拟的机器人日志，日志接口查询的是有内容的文件
+def seed_logs(workdir: str, lines: int):
+    log_dir = os.path.join(workdir, "data", "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    rng = random.Random(42)
+    now = time.time()
+    actions = ["处理消息", "发送回复", "加载插件", "连接服务器", "调用接口"]
+    words = ["request", "timeout", "user", "group", "message", "cache"]
+    with open(os.path.join(log_dir, "app.log"), "w", encoding="utf-8") as f:
+        for i in range(lines):
+            t = now - (lines - i) * 3600 / max(lines, 1)
+            level = rng.choice(["INFO"] * 16 + ["WARNING"] * 3 + ["ERROR"])
+            f.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + f",{int(t * 1000) % 1000:03d} - "
+                    f"{rng.choice(['bot', 'api', 'plugin.weather'])} - {level} - {rng.choice(actions)} "
+                    f"用户{rng.randint(100000, 999999)} {rng.choice(words)} seq={i}\n")
+
+def selected(args) -> List[Endpoint]:
+    if not args.only:
+        return ENDPOINTS
+    return [e for e in ENDPOINTS if any(token == e.group or token in e.name for token in args.only)]
+
+async def run_suite(args, connect: Connect, routes: List[str]) -> Dict[str, Any]:
+    client = Client(connect)
+    await client.login()
+    endpoints = selected(args)
+    results = []
+    invalid = {}
+    print(f"{'接口':<20} {'并发':>4} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'错误':>6}")
+    for endpoint in endpoints:
+        problem = await check_endpoint(client, endpoint)
+        if problem is not None:
+            invalid[endpoint.name] = problem
+            print(f"{endpoint.name:<20} 响应错误: {problem}")
+            continue
+        # 预热：建立日志索引、首次采样进程表、渲染页面缓存等
+        await run_load(client, endpoint, 1, args.warmup)
+        for concurrency in args.concurrency:
+            result = await run_load(client, endpoint, concurrency, args.seconds)
+            print(f"{endpoint.name:<20} {concurrency:>4} {result['rps']:>9.1f} {result['p50']:>7.2f}ms "
+                  f"{result['p95']:>7.2f}ms {result['p99']:>7.2f}ms {result['errors']:>6}")
+            results.append({"name": endpoint.name, "group": endpoint.group, "method": endpoint.method,
+                            "path": endpoint.path, "concurrency": concurrency, **result})
+    responsiveness = []
+    if not args.no_responsiveness:
+        responsiveness = await check_responsiveness(client, {e.name: e for e in ENDPOINTS}, args)
+    uncovered = coverage(routes)
+    if uncovered:
+        print("\n未覆盖的路由（请加入ENDPOINTS或SKIPPED）: " + ", ".join(uncovered))
+    return {"endpoints": results, "invalid": invalid, "responsiveness": responsiveness, "uncovered": uncovered}
+
+async def run_asgi(args, workdir: str) -> Dict[str, Any]:
+    # 导入副本中的应用，数据目录随之指向副本
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import run
+    app = run.app
+
+    async def connect():
+        return AsgiConnection(app)
+
+    async with app.router.lifespan_context(app):
+        return await run_suite(args, connect, app_routes(app))
+
+async def run_uvicorn(args, workdir: str) -> Dict[str, Any]:
+    port = args.port or free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "run:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    async def connect():
+        return HttpConnection(port)
+
+    try:
+        await wait_ready(port)
+        # 路由列表来自OpenAPI文档，不含WebSocket和未列入文档的路由
+        _, _, payload = await HttpConnection(port).request("GET", "/openapi.json")
+        routes = [f"{method.upper()} {path}" for path, spec in json.loads(payload).get("paths", {}).items()
+                  for method in spec]
+        return await run_suite(args, connect, routes)
+    finally:
+        server.terminate()
+        server.wait()
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def compare(results: Dict[str, Any], path: str, tolerance: float) -> List[str]:
+    """与之前的结果对比p50，返回回归的接口"""
+    with open(path, "r", encoding="utf-8") as f:
+        old = {(r["name"], r["concurrency"]): r for r in json.load(f).get("endpoints", [])}
+    regressions = []
+    print(f"\n与{path}对比（p50变慢超过{tolerance}倍视为回归）")
+    for result in results["endpoints"]:
+        before = old.get((result["name"], result["concurrency"]))
+        if before is None or not before["p50"]:
+            continue
+        ratio = result["p50"] / before["p50"]
+        if ratio > tolerance and result["p50"] - before["p50"] >= MIN_REGRESSION_MS:
+            regressions.append(f"{result['name']}@{result['concurrency']}")
+            print(f"  回归 {result['name']:<20} 并发{result['concurrency']:<4} "
+                  f"p50 {before['p50']:.2f}ms -> {result['p50']:.2f}ms ({ratio:.2f}x)")
+    if not regressions:
+        print("  没有回归")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端HTTP基准测试")
+    parser.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi", help="进程内ASGI调用或uvicorn")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="各轮的并发数")
+    parser.add_argument("--seconds", type=float, default=3.0, help="每个接口每轮的测量时长")
+    parser.add_argument("--warmup", type=float, default=0.5, help="每个接口测量前的预热时长")
+    parser.add_argument("--only", nargs="*", help="只测指定分组(auth/pages/api/logs/commands)或名称包含该词的接口")
+    parser.add_argument("--log-lines", type=int, default=50000, help="写入的模拟日志行数")
+    parser.add_argument("--load-concurrency", type=int, default=8, help="响应性检查中慢接口的并发数")
+    parser.add_argument("--max-lag", type=float, default=100.0, help="响应性检查允许的轻量接口p99上限（毫秒）")
+    parser.add_argument("--lag-over-idle", type=float, default=50.0,
+                        help="响应性检查允许轻量接口p99比空载时高出多少（毫秒）")
+    parser.add_argument("--no-responsiveness", action="store_true", help="跳过响应性检查")
+    parser.add_argument("--output", default="bench_http_results.json", help="结果JSON文件")
+    parser.add_argument("--baseline", help="与之前的结果JSON对比")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="p50变慢多少倍视为回归")
+    parser.add_argument("--port", type=int, default=0, help="uvicorn模式的端口，默认随机")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = tempfile.mkdtemp(prefix="firefly-bench-")
+    try:
+        prepare_app(workdir, UNLIMITED_AUTH)
+        seed_logs(workdir, args.log_lines)
+        runner = run_asgi if args.mode == "asgi" else run_uvicorn
+        results = asyncio.run(runner(args, workdir))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "mode": args.mode,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {key: getattr(args, key) for key in ("concurrency", "seconds", "log_lines",
+                                                         "load_concurrency", "max_lag", "lag_over_idle")},
+        **results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入{output}")
+
+    if results["invalid"]:
+        print("响应错误: " + ", ".join(results["invalid"]))
+    failed = [r["load"] for r in results["responsiveness"] if not r["ok"]]
+    if failed:
+        print("响应性检查不通过: " + ", ".join(failed))
+    regressions = compare(report, baseline, args.tolerance) if baseline else []
+    sys.exit(1 if results["invalid"] or failed or regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# -- coding: utf-8 --
+"""登录风暴压测：密集的错误登录期间，页面请求的延迟是否保持平稳
+
+用法: python bench/bench_login.py [--seconds 5] [--storm 50] [--rate 200] [--port 8765]
+
+在临时目录中复制一份应用并用uvicorn启动（不影响当前目录的数据和配置），分三个阶段测量
+/api/system-resources和/dashboard的延迟：
+- 基线：没有登录请求
+- 风暴（限流开启）：storm个并发客户端以合计rate次/秒提交错误密码，同一IP被令牌桶拒绝
+- 风暴（限流关闭）：同上，但登录请求都会进入bcrypt线程池，只受线程池和排队上限约束
+"""
+import os
+import sys
+import json
+import time
+import yaml
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COPY_ITEMS = ("run.py", "routes", "templates", "static", "config.yaml", ".env")
+
+# 在临时目录中准备应用副本
+def prepare_app(workdir: str, auth: Dict[str, float]):
+    for name in COPY_ITEMS:
+        src = os.path.join(ROOT, name)
+        dst = os.path.join(workdir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, ignore=shutil.ignore_patterns("__pycache__"))
+        elif os.path.exists(src):
+            shutil.copy(src, dst)
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    config.setdefault("server", {})["auth"] = auth
+    config["server"]["is_new"] = False
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.dump(config, f, allow_unicode=True)
+
+async def request(port: int, method: str, path: str, body: bytes = b"",
+                  headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """发送一个HTTP/1.1请求（Connection: close），返回状态码、响应头和正文"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{port}", "Connection: close",
+             f"Content-Length: {len(body)}"]
+    lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, payload = data.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    response_headers = {}
+    for line in header_lines:
+        key, _, value = line.partition(":")
+        response_headers[key.strip().lower()] = value.strip()
+    return int(status_line.split()[1]), response_headers, payload
+
+def login_body(username: str, password: str) -> Tuple[bytes, Dict[str, str]]:
+    return (json.dumps({"username": username, "password": password}).encode(),
+            {"Content-Type": "application/json"})
+
+async def login(port: int) -> str:
+    body, headers = login_body("ilovefirefly", "ilovefirefly")
+    status, response_headers, payload = await request(port, "POST", "/auth/login", body, headers)
+    if status != 200:
+        raise RuntimeError(f"登录失败: {status} {payload[:200]!r}")
+    cookie = response_headers["set-cookie"].split(";", 1)[0]
+    return cookie
+
+async def measure_pages(port: int, cookie: str, seconds: float) -> List[float]:
+    """串行请求页面和接口，返回每次请求的耗时（毫秒）"""
+    latencies = []
+    paths = ("/api/system-resources", "/dashboard")
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        status, _, _ = await request(port, "GET", paths[i % len(paths)], headers={"Cookie": cookie})
+        latencies.append((time.perf_counter() - start) * 1000)
+        if status != 200:
+            raise RuntimeError(f"页面请求失败: {status}")
+        i += 1
+    return latencies
+
+async def storm(port: int, clients: int, rate: float, stop: asyncio.Event) -> Counter:
+    """并发提交错误密码，统计响应状态码"""
+    statuses: Counter = Counter()
+    body, headers = login_body("ilovefirefly", "wrong-password")
+    interval = clients / rate if rate > 0 else 0
+
+    async def worker():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                status, _, _ = await request(port, "POST", "/auth/login", body, headers)
+                statuses[status] += 1
+            except OSError:
+                statuses["error"] += 1
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - start)))
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return statuses
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+def report(name: str, latencies: List[float], statuses: Optional[Counter] = None):
+    line = (f"{name:<22} 请求数={len(latencies):<5} p50={percentile(latencies, 50):7.2f}ms "
+            f"p95={percentile(latencies, 95):7.2f}ms p99={percentile(latencies, 99):7.2f}ms "
+            f"max={max(latencies, default=0):7.2f}ms")
+    if statuses is not None:
+        line += "  登录响应: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items(), key=str))
+    print(line)
+
+async def wait_ready(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            await request(port, "GET", "/login")
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("服务器启动超时")
+
+async def run_phase(args, name: str, auth: Dict[str, float], with_storm: bool):
+    workdir = tempfile.mkdtemp(prefix="firefly-bench-")
+    prepare_app(workdir, auth)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "run:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await wait_ready(args.port)
+        cookie = await login(args.port)
+        await measure_pages(args.port, cookie, 0.5)  # 预热
+        statuses = None
+        if with_storm:
+            stop = asyncio.Event()
+            storm_task = asyncio.create_task(storm(args.port, args.storm, args.rate, stop))
+            await asyncio.sleep(0.5)
+            latencies = await measure_pages(args.port, cookie, args.seconds)
+            stop.set()
+            statuses = await storm_task
+        else:
+            latencies = await measure_pages(args.port, cookie, args.seconds)
+        report(name, latencies, statuses)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def main():
+    parser = argparse.ArgumentParser(description="登录风暴压测")
+    parser.add_argument("--seconds", type=float, default=5.0, help="每个阶段的测量时长")
+    parser.add_argument("--storm", type=int, default=50, help="并发登录客户端数")
+    parser.add_argument("--rate", type=float, default=200, help="合计每秒登录次数，0表示不限")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+
+    limited = {"login_burst": 5, "login_per_minute": 6}
+    unlimited = {"login_burst": 1e9, "login_per_minute": 1e9}
+    asyncio.run(run_phase(args, "基线", limited, False))
+    asyncio.run(run_phase(args, "风暴(限流开启)", limited, True))
+    asyncio.run(run_phase(args, "风暴(限流关闭)", unlimited, True))
+
+if __name__ == "__main__":
+    main()
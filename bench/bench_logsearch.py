@@ -0,0 +1,115 @@
+# -- coding: utf-8 --
+"""日志搜索基准测试：对比逐行子串扫描与倒排索引查询
+
+用法: python bench/bench_logsearch.py [--lines 1000000] [--rounds 5]
+
+在临时目录中生成模拟的机器人日志（中文为主，夹带英文和数字），测量：
+- 首次建立索引（含倒排索引）的耗时和索引文件大小，以及重启后加载索引的耗时
+- 各类查询的耗时：单词、中文短语、多词AND、带级别/来源过滤，以及对照的逐行扫描
+- 追加新日志后增量更新索引并查询的耗时
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routes.logindex import LogStore
+
+SOURCES = ["bot", "api", "plugin.weather", "plugin.music", "数据库"]
+ACTIONS = ["处理消息", "发送回复", "加载插件", "连接服务器", "读取配置", "调用接口", "写入缓存"]
+RESULTS = ["成功", "失败", "超时", "重试中"]
+WORDS = ["request", "timeout", "user", "group", "message", "cache", "reply", "event"]
+
+# 生成一行模拟日志
+def make_line(rng: random.Random, t: float, i: int) -> str:
+    level = rng.choice(["INFO"] * 16 + ["WARNING"] * 3 + ["ERROR"])
+    message = (f"{rng.choice(ACTIONS)}{rng.choice(RESULTS)} 群{rng.randint(10000, 99999)} "
+               f"用户{rng.randint(100000, 999999)} {rng.choice(WORDS)} {rng.choice(WORDS)} seq={i}")
+    lt = time.localtime(t)
+    return (time.strftime("%Y-%m-%d %H:%M:%S", lt) + f",{int(t * 1000) % 1000:03d} - "
+            f"{rng.choice(SOURCES)} - {level} - {message}\n")
+
+def write_lines(path: str, rng: random.Random, start: float, first: int, count: int):
+    with open(path, "a", encoding="utf-8") as f:
+        for i in range(first, first + count):
+            f.write(make_line(rng, start + i * 0.05, i))
+
+# 重复执行取中位数（毫秒）
+def timed(fn: Callable[[], object], rounds: int) -> float:
+    samples: List[float] = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+# 旧实现：逐行读取并做子串匹配
+def scan(path: str, needle: str) -> int:
+    needle = needle.lower()
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if needle in line.decode("utf-8", "replace").lower():
+                count += 1
+    return count
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path))
+
+def main():
+    parser = argparse.ArgumentParser(description="日志搜索基准测试")
+    parser.add_argument("--lines", type=int, default=1000000, help="日志行数")
+    parser.add_argument("--rounds", type=int, default=5, help="每个查询的重复次数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="firefly-logsearch-")
+    try:
+        rng = random.Random(42)
+        path = os.path.join(workdir, "app.log")
+        start = time.time() - args.lines * 0.05
+        write_lines(path, rng, start, 0, args.lines)
+        print(f"日志: {args.lines}行, {os.path.getsize(path) / 1048576:.1f} MB")
+
+        store = LogStore(log_dir=workdir)
+        t = time.perf_counter()
+        store.query(page_size=1)
+        print(f"首次建立索引: {time.perf_counter() - t:.1f} s, "
+              f"索引大小 {dir_size(store.index_dir) / 1048576:.1f} MB")
+        t = time.perf_counter()
+        LogStore(log_dir=workdir).query(page_size=1)
+        print(f"重启后加载索引: {(time.perf_counter() - t) * 1000:.0f} ms")
+
+        queries = [
+            ("单词", dict(search="timeout")),
+            ("中文短语", dict(search="处理消息")),
+            ("多词AND", dict(search="处理消息 失败 timeout")),
+            ("引号短语", dict(search='"user reply"')),
+            ("过滤+搜索", dict(search="超时", levels=["error"], source="数据库")),
+            ("精确编号", dict(search="seq=123457")),
+        ]
+        print(f"\n{'查询':<12} {'命中':>8} {'索引 ms':>10} {'翻页(第50页) ms':>16}")
+        for name, params in queries:
+            total = store.query(**params)["pagination"]["total_items"]
+            first = timed(lambda: store.query(**params), args.rounds)
+            deep = timed(lambda: store.query(page=50, **params), args.rounds)
+            print(f"{name:<12} {total:>8} {first:>10.2f} {deep:>16.2f}")
+
+        t = time.perf_counter()
+        hits = scan(path, "处理消息")
+        print(f"\n对照：逐行子串扫描\"处理消息\" {hits}行, {(time.perf_counter() - t) * 1000:.0f} ms")
+
+        write_lines(path, rng, start, args.lines, 1000)
+        t = time.perf_counter()
+        store.query(search="处理消息")
+        print(f"追加1000行后增量更新并查询: {(time.perf_counter() - t) * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -- coding: utf-8 --
+"""页面吞吐压测：对比开启和关闭页面缓存时各页面的每秒请求数
+
+用法: python bench/bench_pages.py [--seconds 5] [--connections 8] [--port 0]
+
+在临时目录中复制一份应用并用uvicorn启动，分别以server.page_cache.enabled为false和true
+各运行一轮。每个页面用connections个长连接并发请求seconds秒，统计每秒请求数和延迟。
+"""
+import os
+import sys
+import time
+import yaml
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Tuple
+
+from bench_login import prepare_app, login, wait_ready, free_port, percentile
+
+PAGES = ("/dashboard", "/settings", "/logs", "/processes", "/run")
+
+# 在副本的配置中设置页面缓存开关
+def set_page_cache(workdir: str, enabled: bool):
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    config.setdefault("server", {})["page_cache"] = {"enabled": enabled}
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.dump(config, f, allow_unicode=True)
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """读取一个带Content-Length的HTTP/1.1响应"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    length = 0
+    for line in lines[1:]:
+        key, _, value = line.partition(":")
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    return int(lines[0].split()[1]), body
+
+async def hammer(port: int, path: str, cookie: str, connections: int, seconds: float) -> List[float]:
+    """多个长连接并发请求同一页面，返回每次请求的耗时（毫秒）"""
+    latencies: List[float] = []
+    deadline = time.perf_counter() + seconds
+    request = (f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nCookie: {cookie}\r\n"
+               f"Accept-Encoding: gzip, br\r\n\r\n").encode()
+
+    async def worker():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                writer.write(request)
+                status, _ = await read_response(reader)
+                if status != 200:
+                    raise RuntimeError(f"{path}请求失败: {status}")
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    return latencies
+
+async def run_round(args, enabled: bool) -> Dict[str, Tuple[float, float, float]]:
+    workdir = tempfile.mkdtemp(prefix="firefly-bench-")
+    prepare_app(workdir, {})
+    set_page_cache(workdir, enabled)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "run:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    results = {}
+    try:
+        await wait_ready(args.port)
+        cookie = await login(args.port)
+        for path in PAGES:
+            await hammer(args.port, path, cookie, args.connections, 0.5)  # 预热
+            latencies = await hammer(args.port, path, cookie, args.connections, args.seconds)
+            results[path] = (len(latencies) / args.seconds, percentile(latencies, 50), percentile(latencies, 99))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="页面吞吐压测")
+    parser.add_argument("--seconds", type=float, default=5.0, help="每个页面的测量时长")
+    parser.add_argument("--connections", type=int, default=8, help="并发长连接数")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+
+    before = asyncio.run(run_round(args, False))
+    after = asyncio.run(run_round(args, True))
+    print(f"{'页面':<12} {'无缓存 req/s':>14} {'p50':>8} {'p99':>8}   {'缓存 req/s':>12} {'p50':>8} {'p99':>8}  提升")
+    for path in PAGES:
+        b, a = before[path], after[path]
+        print(f"{path:<12} {b[0]:>14.0f} {b[1]:>6.2f}ms {b[2]:>6.2f}ms   {a[0]:>12.0f} {a[1]:>6.2f}ms "
+              f"{a[2]:>6.2f}ms  {a[0] / b[0]:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -- coding: utf-8 --
+"""进程表基准测试：对比旧的逐请求全量扫描与增量进程表
+
+用法: python bench/bench_processes.py [--sizes 1000 5000 20000] [--rounds 5] [--real]
+
+使用模拟进程对象在1k/5k/20k进程规模下测量：
+- 旧实现：每次请求重新遍历进程、两次CPU采样、全量排序（另外固定等待1秒）
+- 新实现：后台增量刷新的耗时，以及查询前N个进程的耗时
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routes.monitor import ProcessTable
+
+CpuTimes = namedtuple("CpuTimes", ["user", "system"])
+MemInfo = namedtuple("MemInfo", ["rss", "vms"])
+
+class FakeProcess:
+    """模拟psutil.Process的最小接口"""
+
+    def __init__(self, pid: int, host: "FakeHost"):
+        self.pid = pid
+        self._host = host
+        self.info = {}
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+    def create_time(self):
+        return self._host.created[self.pid]
+
+    def name(self):
+        return self._host.names[self.pid]
+
+    def ppid(self):
+        return 1
+
+    def username(self):
+        return "bench"
+
+    def cmdline(self):
+        return [self._host.names[self.pid]]
+
+    def cpu_times(self):
+        return CpuTimes(self._host.cpu[self.pid], 0.0)
+
+    def memory_info(self):
+        return MemInfo(self._host.rss[self.pid], 0)
+
+    def cpu_percent(self, interval=None):
+        return 0.0
+
+class FakeHost:
+    """模拟主机进程集合，每轮有少量进程退出和新建"""
+
+    def __init__(self, size: int, churn: float = 0.01):
+        self.churn = churn
+        self.next_pid = 1
+        self.names, self.cpu, self.rss, self.created = {}, {}, {}, {}
+        for _ in range(size):
+            self._spawn()
+
+    def _spawn(self):
+        pid = self.next_pid
+        self.next_pid += 1
+        self.names[pid] = f"proc-{pid}"
+        self.created[pid] = time.time()
+        self.cpu[pid] = 0.0
+        self.rss[pid] = random.randint(1, 2048) * 1024 * 1024
+
+    def step(self):
+        dead = random.sample(list(self.names), int(len(self.names) * self.churn))
+        for pid in dead:
+            del self.names[pid], self.cpu[pid], self.rss[pid], self.created[pid]
+            self._spawn()
+        for pid in self.cpu:
+            self.cpu[pid] += random.random() * 0.01
+
+    def pids(self):
+        return list(self.names)
+
+    def process_iter(self, attrs):
+        for pid in self.pids():
+            proc = FakeProcess(pid, self)
+            proc.info = {"pid": pid, "name": proc.name(), "memory_info": proc.memory_info()}
+            yield proc
+
+def legacy_get_processes(process_iter, limit: int):
+    """旧版/api/processes的实现（省略中间的1秒等待）"""
+    processes = []
+    all_procs = list(process_iter(['pid', 'name', 'memory_info']))
+    for proc in all_procs:
+        proc.cpu_percent(None)
+    for proc in all_procs:
+        memory_mb = proc.info['memory_info'].rss / (1024 * 1024)
+        cpu_percent = proc.cpu_percent(None)
+        processes.append({
+            'pid': proc.info['pid'],
+            'name': proc.info['name'],
+            'memory_mb': round(memory_mb, 1),
+            'cpu_percent': round(cpu_percent, 1)
+        })
+    processes.sort(key=lambda x: x['memory_mb'], reverse=True)
+    return processes[:limit]
+
+def timed(func, rounds: int) -> float:
+    """返回多轮执行的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+def bench_size(size: int, rounds: int, limit: int):
+    host = FakeHost(size)
+    table = ProcessTable(pids=host.pids, process_factory=lambda pid: FakeProcess(pid, host))
+    table.tick()
+
+    def refresh():
+        host.step()
+        table.tick()
+
+    legacy = timed(lambda: legacy_get_processes(host.process_iter, limit), rounds)
+    tick = timed(refresh, rounds)
+    query = timed(lambda: table.top(limit), rounds)
+    query_all = timed(lambda: table.top(size), rounds)
+    print(f"{size:>7} | {legacy:>10.2f} (+1000) | {tick:>10.2f} | {query:>10.3f} | {query_all:>10.2f}")
+
+def bench_real(rounds: int, limit: int):
+    import psutil
+    table = ProcessTable()
+    table.tick()
+    legacy = timed(lambda: legacy_get_processes(psutil.process_iter, limit), rounds)
+    tick = timed(table.tick, rounds)
+    query = timed(lambda: table.top(limit), rounds)
+    print(f"{'real':>7} | {legacy:>10.2f} (+1000) | {tick:>10.2f} | {query:>10.3f} | {'-':>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="进程表基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--real", action="store_true", help="额外在本机真实进程上测试")
+    args = parser.parse_args()
+
+    print("单位: 毫秒/次；旧实现每次请求还需额外等待1000毫秒")
+    print(f"{'进程数':>5} | {'旧实现请求':>9} | {'增量刷新':>8} | {'查询前N':>7} | {'查询全部':>8}")
+    for size in args.sizes:
+        bench_size(size, args.rounds, args.limit)
+    if args.real:
+        bench_real(args.rounds, args.limit)
+
+if __name__ == "__main__":
+    main()
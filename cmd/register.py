@@ -1,52 +1,51 @@
 import os
-import yaml
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from routes.commands import command_registry
+
 class register_cmd:
     def __init__(self):
-        self.name = "register_name" #将会在data/cmd下创建一个名为name的json的文件来注册系统命令
+        self.name = "register_name" #将会在data/cmd下创建一个名为name的yaml文件来注册系统命令
         self.cmd = "register_cmd"   #这是你想要注册的命令
         self.usage = "register_help>" #在此处显示此类命令的帮助
         self.type = "general"  #在此处填写你要注册的命令的分类
     def get_cmd(self):
         result = [self.name,self.cmd,self.usage,self.type]
         return result
+    def to_dict(self):
+        return {"name": self.name, "cmd": self.cmd, "usage": self.usage, "type": self.type}
     def register(self):
+        #写入data/cmd/name.yaml，名称或命令已被其他文件注册时失败
+        result = command_registry.register([self.to_dict()], self.name)
+        if not result["success"]:
+            return result["message"]
         return (f"命令{self.name}注册成功<{self.type}><{self.cmd}>")
-    def check_cmd(self):
+    def check_fields(self):
         if self.name == "" or self.cmd == "" or self.type == "":
             return False
         else:
             return True
+    #以下检查都查询内存中的注册表，不读取文件
     def check_path(self):
-        if os.path.exists(project_root,"data","cmd",f"{self.name}.yaml"):
+        if self.name in command_registry.files():
             return False
         else:
             return True
     def check_name(self):
-        with open(os.path.join(project_root,"data","cmd",f"{self.name}.yaml"),"r") as f:
-            data = yaml.safe_load(f)
-            if data[self.name] == None:
-                return False
-            else:
-                return True
+        return command_registry.get(self.name) is not None
     def check_type(self):
-        with open(os.path.join(project_root,"data","cmd",f"{self.name}.yaml"),"r") as f:
-            data = yaml.safe_load(f)
-            if data[self.type] == None:
-                return False
-            else:
-                return True
+        return self.type in command_registry.types()
     def check_cmd(self):
-        with open(os.path.join(project_root,"data","cmd",f"{self.name}.yaml"),"r") as f:
-            data = yaml.safe_load(f)
-            if data[self.cmd] == None:
-                return False
-            else:
-                return True
+        return command_registry.find_by_cmd(self.cmd) is not None
     def get_data(self):
-        with open(os.path.join(project_root,"data","cmd",f"{self.name}.yaml"),"r") as f:
-            data = yaml.safe_load(f)
-            return data
+        commands, _ = command_registry.list()
+        return {c["name"]: {"cmd": c["cmd"], "usage": c["usage"], "type": c["type"]}
+                for c in commands if c["file"] == self.name}
     def write_data(self,data):
-        with open(os.path.join(project_root,"data","cmd",f"{self.name}.yaml"),"w") as f:
-            f.write(yaml.dump(data))
-        
\ No newline at end of file
+        #data为 命令名: {cmd, usage, type} 的映射，一次写入
+        commands = [dict(spec, name=name) for name, spec in data.items()]
+        return command_registry.register(commands, self.name)
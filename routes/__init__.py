@@ -1,15 +1,94 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.templating import Jinja2Templates
 from .pages import router as pages_router, set_templates
 from .auth import router as auth_router
 from .api import router as api_router
+from .metrics import router as metrics_router
+from .monitor import start_monitors, stop_monitors, resource_sampler
+from .supervisor import supervisor
+from .servicemon import service_monitor, get_service_monitor_config
+from .history import metrics_history, record_snapshot, get_history_config
+from .sessions import session_manager, session_cleaner, get_session_config
+from .credentials import setup_credentials, password_hasher
+from .cluster import get_role, WORKER, start_replica, stop_replica
+from .assets import asset_pipeline, setup_assets
+from .pagecache import page_cache, get_page_cache_config
+from .logarchive import log_archive, archive_task, get_archive_config
+from .commands import command_watcher
+from .profiling import loop_monitor, get_loop_monitor_config
+from .memtrace import memory_tracer, memtrace_task, get_memtrace_config
 
 def init_routes(app: FastAPI, templates: Jinja2Templates):
     # 设置模板到路由中
     pages_router.templates = templates
     set_templates(templates)
+    # 模板中用asset_url('js/three.min.js')引用带指纹的静态资源
+    templates.env.globals["asset_url"] = asset_pipeline.url
     
     # 包含所有路由
     app.include_router(pages_router)
     app.include_router(auth_router)
-    app.include_router(api_router)
\ No newline at end of file
+    app.include_router(api_router)
+    app.include_router(metrics_router)
+
+# 启动后台服务
+# 多worker模式下采样、服务管理和会话清理只在管理进程中运行，worker从管理进程同步状态
+async def start_services():
+    role = get_role()
+    # 每个进程各自检测事件循环阻塞
+    loop_config = get_loop_monitor_config()
+    loop_monitor.configure(loop_config)
+    if loop_config["enabled"]:
+        loop_monitor.start()
+    memtrace_config = get_memtrace_config()
+    memory_tracer.configure(memtrace_config)
+    if memtrace_config["periodic"]:
+        memtrace_task.interval = memtrace_config["interval"]
+        memtrace_task.window = memtrace_config["window"]
+        memtrace_task.start()
+    session_config = get_session_config()
+    session_manager.configure(session_config)
+    if role != WORKER:
+        session_cleaner.interval = session_config["cleanup_interval"]
+        session_cleaner.start()
+    # 管理进程先于worker完成明文密码迁移和静态资源构建
+    await asyncio.to_thread(setup_credentials)
+    await asyncio.to_thread(setup_assets, role != WORKER)
+    page_cache.configure(get_page_cache_config())
+    metrics_history.configure(get_history_config())
+    # 只有管理进程（或单进程）写入和重建历史文件，worker只读
+    metrics_history.open(writable=role != WORKER)
+    # 每个进程各自加载命令注册表并跟踪文件变化
+    command_watcher.start()
+    if role == WORKER:
+        await start_replica()
+        return
+    resource_sampler.add_listener(record_snapshot)
+    await start_monitors()
+    await supervisor.start()
+    service_monitor.configure(get_service_monitor_config())
+    service_monitor.start()
+    archive_config = get_archive_config()
+    log_archive.configure(archive_config)
+    if archive_config["enabled"]:
+        archive_task.interval = archive_config["interval"]
+        archive_task.start()
+
+# 停止后台服务
+async def stop_services():
+    if get_role() == WORKER:
+        await stop_replica()
+    else:
+        await archive_task.stop()
+        await service_monitor.stop()
+        await supervisor.stop()
+        await stop_monitors()
+        resource_sampler.remove_listener(record_snapshot)
+        await session_cleaner.stop()
+    await command_watcher.stop()
+    await loop_monitor.stop()
+    await memtrace_task.stop()
+    metrics_history.close()
+    session_manager.close()
+    password_hasher.shutdown()
\ No newline at end of file
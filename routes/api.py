@@ -1,16 +1,32 @@
 # -- coding: utf-8 --
-import os
+import re
 import json
 import time
-import psutil
+import hashlib
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional, Union
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
+from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, Depends, Request, Response, WebSocket, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from .auth import get_current_user
-from .utils import read_config, update_config, get_data_dir
+from .auth import get_current_user, get_session
+from .credentials import password_hasher
+from .utils import read_config, modify_config, thaw, config_store
+from .monitor import resource_sampler, process_table, format_resources, PROCESS_SORT_KEYS, PROCESS_FIELDS, DEFAULT_PROCESS_FIELDS
+from .proctree import process_tree, ProcessTreeError, DEFAULT_TREE_DEPTH
+from .logindex import log_store, resolve_date_range
+from .logstream import log_follower, LogFilter
+from .logarchive import log_archive
+from .commands import command_registry
+from .supervisor import supervisor, start_service
+from .servicemon import service_monitor
+from .history import metrics_history, HISTORY_METRICS
+from .realtime import realtime_hub, check_origin
+from .httpcache import versioned_json, make_etag
+from .metrics import http_metrics
+from .profiling import loop_monitor, profiler, ProfilerBusy, MAX_PROFILE_SECONDS
+from .memtrace import memory_tracer, MemoryTracerError
 
 router = APIRouter(prefix="/api")
 logger = logging.getLogger("api")
@@ -31,7 +47,26 @@ class BackgroundSettingsModel(BaseModel):
     speed: float
 
 class BotActionModel(BaseModel):
-    action: str  # "start" or "stop"
+    action: str  # "start", "stop" or "restart"
+
+class CommandModel(BaseModel):
+    name: str
+    cmd: str
+    usage: str = ""
+    type: str
+
+class CommandRegisterModel(BaseModel):
+    file: str
+    commands: List[CommandModel]
+
+class MemoryTraceStartModel(BaseModel):
+    frames: Optional[int] = None  # 每次分配记录的调用栈层数
+
+class MemorySnapshotModel(BaseModel):
+    name: Optional[str] = None
+
+# 快照名只允许字母、数字、下划线、点和连字符
+SNAPSHOT_NAME_RE = re.compile(r"^[\w.\-]{1,64}$")
 
 # 递归更新嵌套字典
 def update_nested_dict(d: Dict, path: str, value: Any) -> Dict:
@@ -50,14 +85,19 @@ def update_nested_dict(d: Dict, path: str, value: Any) -> Dict:
     return d
 
 @router.get("/config")
-async def get_config(current_user: Dict = Depends(get_current_user)):
+async def get_config(request: Request, current_user: Dict = Depends(get_current_user)):
     """获取当前配置"""
     try:
-        config = read_config()
-        # 移除敏感信息
-        if "server" in config and "password" in config["server"]:
-            config["server"]["password"] = "*****"
-        return {"success": True, "config": config}
+        def produce():
+            # 复制一份再脱敏，不影响缓存中的配置
+            config = thaw(read_config())
+            # 移除敏感信息
+            if "server" in config and "password" in config["server"]:
+                config["server"]["password"] = "*****"
+            return {"success": True, "config": config}
+
+        # 配置文件未变化时不重新序列化
+        return versioned_json(request, make_etag("c", config_store.stamp), produce)
     except Exception as e:
         logger.error(f"获取配置失败: {str(e)}")
         return {"success": False, "message": f"获取配置失败: {str(e)}"}
@@ -66,13 +106,9 @@ async def get_config(current_user: Dict = Depends(get_current_user)):
 async def update_config_item(item: ConfigUpdateModel, current_user: Dict = Depends(get_current_user)):
     """更新配置项"""
     try:
-        config = read_config()
-        
-        # 使用递归更新嵌套字典
-        update_nested_dict(config, item.path, item.value)
-        
-        # 保存更新后的配置
-        update_config(config)
+        # 使用递归更新嵌套字典，并在锁内保存更新后的配置；写文件和fsync在线程中进行
+        if not await asyncio.to_thread(modify_config, lambda config: update_nested_dict(config, item.path, item.value)):
+            return {"success": False, "message": "更新配置失败: 写入配置文件失败"}
         
         return {"success": True, "message": "配置已更新"}
     except Exception as e:
@@ -83,12 +119,13 @@ async def update_config_item(item: ConfigUpdateModel, current_user: Dict = Depen
 async def complete_setup(current_user: Dict = Depends(get_current_user)):
     """完成初始设置，将is_new设置为False"""
     try:
-        config = read_config()
-        if "server" not in config:
-            config["server"] = {}
+        def apply(config):
+            if "server" not in config:
+                config["server"] = {}
+            config["server"]["is_new"] = False
         
-        config["server"]["is_new"] = False
-        update_config(config)
+        if not await asyncio.to_thread(modify_config, apply):
+            return {"success": False, "message": "完成设置失败: 写入配置文件失败"}
         
         return {"success": True, "message": "设置已完成"}
     except Exception as e:
@@ -99,15 +136,12 @@ async def complete_setup(current_user: Dict = Depends(get_current_user)):
 async def update_password(model: PasswordUpdateModel, current_user: Dict = Depends(get_current_user)):
     """更新用户密码"""
     try:
-        config = read_config()
-        
         # 验证当前密码
-        if config["server"]["password"] != model.current_password:
+        if not await password_hasher.verify(current_user["username"], model.current_password):
             return {"success": False, "message": "当前密码不正确"}
         
-        # 更新密码
-        config["server"]["password"] = model.new_password
-        update_config(config)
+        # 更新密码，只保存哈希
+        await password_hasher.set_password(current_user["username"], model.new_password)
         
         return {"success": True, "message": "密码已更新"}
     except Exception as e:
@@ -118,21 +152,21 @@ async def update_password(model: PasswordUpdateModel, current_user: Dict = Depen
 async def update_background(settings: BackgroundSettingsModel, current_user: Dict = Depends(get_current_user)):
     """更新背景设置"""
     try:
-        config = read_config()
-        
-        # 确保背景设置存在
-        if "ui" not in config:
-            config["ui"] = {}
-        if "background" not in config["ui"]:
-            config["ui"]["background"] = {}
+        def apply(config):
+            # 确保背景设置存在
+            if "ui" not in config:
+                config["ui"] = {}
+            if "background" not in config["ui"]:
+                config["ui"]["background"] = {}
+            
+            # 更新背景设置
+            config["ui"]["background"]["type"] = settings.type
+            config["ui"]["background"]["color"] = settings.color
+            config["ui"]["background"]["background_color"] = settings.background_color
+            config["ui"]["background"]["speed"] = settings.speed
         
-        # 更新背景设置
-        config["ui"]["background"]["type"] = settings.type
-        config["ui"]["background"]["color"] = settings.color
-        config["ui"]["background"]["background_color"] = settings.background_color
-        config["ui"]["background"]["speed"] = settings.speed
-        
-        update_config(config)
+        if not await asyncio.to_thread(modify_config, apply):
+            return {"success": False, "message": "更新背景设置失败: 写入配置文件失败"}
         
         return {"success": True, "message": "背景设置已更新"}
     except Exception as e:
@@ -140,21 +174,11 @@ async def update_background(settings: BackgroundSettingsModel, current_user: Dic
         return {"success": False, "message": f"更新背景设置失败: {str(e)}"}
 
 @router.get("/recent-logs")
-async def get_recent_logs(current_user: Dict = Depends(get_current_user)):
+async def get_recent_logs(limit: int = 10, current_user: Dict = Depends(get_current_user)):
     """获取最近的日志"""
     try:
-        # 这里模拟返回一些日志数据
-        # 实际应用中，应该从日志文件或数据库中读取
-        logs = [
-            {"timestamp": time.time() - 3600, "type": "info", "message": "系统启动成功"},
-            {"timestamp": time.time() - 3000, "type": "info", "message": "机器人已连接"},
-            {"timestamp": time.time() - 2400, "type": "warning", "message": "接收到未知命令"},
-            {"timestamp": time.time() - 1800, "type": "error", "message": "连接断开"},
-            {"timestamp": time.time() - 1200, "type": "info", "message": "重新连接成功"},
-            {"timestamp": time.time() - 600, "type": "info", "message": "处理消息: 帮助命令"},
-        ]
-        
-        return {"success": True, "logs": logs}
+        result = await asyncio.to_thread(log_store.query, page=1, page_size=limit)
+        return {"success": True, "logs": result["logs"]}
     except Exception as e:
         logger.error(f"获取日志失败: {str(e)}")
         return {"success": False, "message": f"获取日志失败: {str(e)}"}
@@ -167,115 +191,462 @@ async def get_logs(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     search: Optional[str] = None,
+    source: Optional[str] = None,
+    page_size: int = 20,
     current_user: Dict = Depends(get_current_user)
 ):
     """获取日志，支持分页和筛选"""
     try:
-        # 这里模拟返回一些日志数据
-        # 实际应用中，应该从日志文件或数据库中读取，并应用筛选条件
-        logs = [
-            {"timestamp": time.time() - 3600 * 24, "type": "info", "source": "system", "message": "系统启动成功"},
-            {"timestamp": time.time() - 3600 * 23, "type": "info", "source": "bot", "message": "机器人已连接"},
-            {"timestamp": time.time() - 3600 * 22, "type": "warning", "source": "command", "message": "接收到未知命令"},
-            {"timestamp": time.time() - 3600 * 21, "type": "error", "source": "network", "message": "连接断开"},
-            {"timestamp": time.time() - 3600 * 20, "type": "info", "source": "network", "message": "重新连接成功"},
-            {"timestamp": time.time() - 3600 * 19, "type": "info", "source": "message", "message": "处理消息: 帮助命令"},
-            {"timestamp": time.time() - 3600 * 18, "type": "debug", "source": "system", "message": "内存使用: 256MB"},
-            {"timestamp": time.time() - 3600 * 17, "type": "info", "source": "bot", "message": "处理消息: 签到命令"},
-            {"timestamp": time.time() - 3600 * 16, "type": "info", "source": "bot", "message": "处理消息: 查询命令"},
-            {"timestamp": time.time() - 3600 * 15, "type": "warning", "source": "system", "message": "CPU使用率过高: 85%"},
-        ]
-        
-        # 模拟分页
-        total_pages = 3
+        start, end = resolve_date_range(date_range, start_date, end_date)
+        levels = None if type == "all" else [t.strip().lower() for t in type.split(",")]
+        result = await asyncio.to_thread(
+            log_store.query,
+            page=max(page, 1),
+            page_size=min(max(page_size, 1), 500),
+            levels=levels,
+            source=source or None,
+            start=start,
+            end=end,
+            search=search or None,
+        )
         
-        return {
-            "success": True, 
-            "logs": logs, 
-            "pagination": {
-                "current_page": page,
-                "total_pages": total_pages,
-                "total_items": len(logs) * total_pages
-            }
-        }
+        return {"success": True, "logs": result["logs"], "pagination": result["pagination"]}
     except Exception as e:
         logger.error(f"获取日志失败: {str(e)}")
         return {"success": False, "message": f"获取日志失败: {str(e)}"}
 
+@router.get("/logs/archives")
+async def get_log_archives(current_user: Dict = Depends(get_current_user)):
+    """获取日志归档列表及各归档的摘要"""
+    try:
+        archives = await asyncio.to_thread(log_archive.summaries)
+        return {"success": True, "archives": archives}
+    except Exception as e:
+        logger.error(f"获取日志归档失败: {str(e)}")
+        return {"success": False, "message": f"获取日志归档失败: {str(e)}"}
+
+@router.get("/logs/stream")
+async def stream_logs(
+    request: Request,
+    type: str = "all",
+    source: Optional[str] = None,
+    search: Optional[str] = None,
+    offset: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """实时推送新日志（Server-Sent Events），支持断线续传"""
+    levels = None if type == "all" else [t.strip().lower() for t in type.split(",")]
+    resume = offset or request.headers.get("last-event-id")
+    subscription, replay = await log_follower.subscribe(LogFilter(levels, source, search), resume)
+
+    async def events():
+        try:
+            for entry in replay:
+                yield f"id: {entry['id']}\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    entry = await asyncio.wait_for(subscription.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": keepalive\n\n"
+                    continue
+                dropped = subscription.take_dropped()
+                if dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': dropped})}\n\n"
+                yield f"id: {entry['id']}\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+        finally:
+            log_follower.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/toggle-bot")
 async def toggle_bot(action: BotActionModel, current_user: Dict = Depends(get_current_user)):
     """切换机器人状态"""
     try:
-        # 这里应该实现实际的机器人启动/停止逻辑
-        # 这里只是模拟返回成功
-        return {"success": True, "status": action.action, "message": f"机器人已{action.action}"}
+        supervisor.load()
+        service = supervisor.get("bot")
+        if action.action == "start":
+            if not await start_service(service):
+                return {"success": False, "message": "未配置机器人启动命令(services.bot.command)"}
+        elif action.action == "stop":
+            await service.stop()
+        else:
+            return {"success": False, "message": f"未知操作: {action.action}"}
+        return {"success": True, "status": action.action, "message": f"机器人已{action.action}", "service": service.status()}
     except Exception as e:
         logger.error(f"切换机器人状态失败: {str(e)}")
         return {"success": False, "message": f"切换机器人状态失败: {str(e)}"}
 
 @router.post("/reconnect-protocol")
 async def reconnect_protocol(current_user: Dict = Depends(get_current_user)):
-    """重新连接协议"""
+    """重新连接协议（重启协议端进程）"""
     try:
-        # 这里应该实现实际的协议重连逻辑
-        # 这里只是模拟返回成功
-        return {"success": True, "message": "协议已重新连接"}
+        supervisor.load()
+        service = supervisor.get("protocol")
+        if not await service.restart():
+            return {"success": False, "message": "未配置协议端启动命令(services.protocol.command)"}
+        return {"success": True, "message": "协议已重新连接", "service": service.status()}
     except Exception as e:
         logger.error(f"重新连接协议失败: {str(e)}")
         return {"success": False, "message": f"重新连接协议失败: {str(e)}"}
 
+@router.get("/services")
+async def get_services(current_user: Dict = Depends(get_current_user)):
+    """获取协议端和bot端的运行状态"""
+    try:
+        supervisor.load()
+        return {"success": True, "services": supervisor.status()}
+    except Exception as e:
+        logger.error(f"获取服务状态失败: {str(e)}")
+        return {"success": False, "message": f"获取服务状态失败: {str(e)}"}
+
+@router.get("/services/{name}/stats")
+async def get_service_stats(name: str, limit: int = 120, current_user: Dict = Depends(get_current_user)):
+    """获取服务进程树的资源历史和泄漏检测结果"""
+    try:
+        report = await asyncio.to_thread(service_monitor.report, name, max(1, limit))
+        if report is None:
+            return {"success": False, "message": f"服务不存在或尚未采样: {name}"}
+        return {"success": True, "stats": report}
+    except Exception as e:
+        logger.error(f"获取服务资源失败: {str(e)}")
+        return {"success": False, "message": f"获取服务资源失败: {str(e)}"}
+
+@router.post("/services/{name}")
+async def control_service(name: str, action: BotActionModel, current_user: Dict = Depends(get_current_user)):
+    """启动、停止或重启指定服务"""
+    try:
+        supervisor.load()
+        service = supervisor.get(name)
+        if service is None:
+            return {"success": False, "message": f"服务不存在: {name}"}
+        if action.action == "start":
+            ok = await start_service(service)
+        elif action.action == "stop":
+            await service.stop()
+            ok = True
+        elif action.action == "restart":
+            ok = await service.restart()
+        else:
+            return {"success": False, "message": f"未知操作: {action.action}"}
+        if not ok:
+            return {"success": False, "message": f"未配置启动命令(services.{name}.command)"}
+        return {"success": True, "service": service.status()}
+    except Exception as e:
+        logger.error(f"操作服务失败: {str(e)}")
+        return {"success": False, "message": f"操作服务失败: {str(e)}"}
+
 @router.get("/system-resources")
 async def get_system_resources(current_user: Dict = Depends(get_current_user)):
     """获取系统资源使用情况"""
     try:
-        # 获取实际的系统资源使用情况
-        cpu_percent = f"{psutil.cpu_percent(interval=1)}%"
-        memory = psutil.virtual_memory()
-        memory_used = f"{float(memory.used) / (1024 * 1024):.1f}MB"
-        processes = f"{len(psutil.pids())}"
-        disk = psutil.disk_usage('/')
-        disk_used = f"{float(disk.used) / (1024 * 1024 * 1024):.1f}GB"
-
-        return {"success": True, "data":{"cpu": cpu_percent, "memory": memory_used, "processes": processes, "disk": disk_used}}
+        # 直接返回后台采样器的最新快照，不在请求中阻塞采样
+        return {"success": True, "data": format_resources(resource_sampler.snapshot())}
     except Exception as e:
         logger.error("获取系统资源失败: %s", str(e))
         return {"success": False, "message": f"获取系统资源失败: {str(e)}"}
 
-import asyncio
+@router.get("/metrics/history")
+async def get_metrics_history(
+    request: Request,
+    metrics: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    window: int = 3600,
+    step: Optional[int] = None,
+    max_points: int = 1000,
+    current_user: Dict = Depends(get_current_user)
+):
+    """获取指标历史，返回列式数据（每个指标的min/avg/max数组）"""
+    try:
+        names = [m.strip() for m in metrics.split(",")] if metrics else list(HISTORY_METRICS)
+        end = end if end is not None else time.time()
+        start = start if start is not None else end - window
+        max_points = min(max(max_points, 1), 5000)
+
+        def produce():
+            return {"success": True, **metrics_history.query(names, start, end, step, max_points)}
+
+        # 当前桶没有新样本时复用已序列化的结果；响应体可能有几百KB，查询和序列化都在线程中完成
+        digest = hashlib.sha1(json.dumps(names, ensure_ascii=False).encode()).hexdigest()[:16]
+        etag = make_etag("h", metrics_history.tag(start, end, step, max_points), digest)
+        return await asyncio.to_thread(versioned_json, request, etag, produce)
+    except Exception as e:
+        logger.error(f"获取指标历史失败: {str(e)}")
+        return {"success": False, "message": f"获取指标历史失败: {str(e)}"}
 
 @router.get("/processes")
-async def get_processes(limit: int = 5, _: Dict = Depends(get_current_user)):
+async def get_processes(
+    request: Request,
+    limit: int = 5,
+    sort: str = "memory",
+    order: Optional[str] = None,
+    q: Optional[str] = None,
+    user: Optional[str] = None,
+    offset: int = 0,
+    fields: Optional[str] = None,
+    _: Dict = Depends(get_current_user)
+):
+    """获取进程列表，数据来自后台增量维护的进程表
+
+    sort为memory、cpu、pid或name，order为asc或desc（默认内存和CPU降序、PID和名称升序）；
+    q按PID、进程名或命令行过滤（不区分大小写，含*或?时按通配符匹配），user按用户过滤；
+    fields为逗号分隔的返回字段。响应中的version为快照版本，版本不变时结果不变。
+    """
     try:
-        processes = []
-        all_procs = list(psutil.process_iter(['pid', 'name', 'memory_info']))
-
-        # 第一次采样
-        for proc in all_procs:
-            try:
-                proc.cpu_percent(None)  # 初始采样，返回0但触发内部计时器
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-
-        await asyncio.sleep(1.0)  # 非阻塞等待，给CPU使用率采样时间
-
-        for proc in all_procs:
-            try:
-                memory_mb = proc.info['memory_info'].rss / (1024 * 1024)
-                cpu_percent = proc.cpu_percent(None)  # 第二次采样，真实数值
-
-                processes.append({
-                    'pid': proc.info['pid'],
-                    'name': proc.info['name'],
-                    'memory_mb': round(memory_mb, 1),
-                    'cpu_percent': round(cpu_percent, 1)
-                })
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                continue
-
-        processes.sort(key=lambda x: x['memory_mb'], reverse=True)
-        top_processes = processes[:limit]
-
-        return {"success": True, "processes": top_processes}
+        if sort not in PROCESS_SORT_KEYS:
+            return {"success": False, "message": f"sort应为{'、'.join(PROCESS_SORT_KEYS)}之一"}
+        if order not in (None, "", "asc", "desc"):
+            return {"success": False, "message": "order应为asc或desc"}
+        selected = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else DEFAULT_PROCESS_FIELDS
+        unknown = [f for f in selected if f not in PROCESS_FIELDS]
+        if unknown:
+            return {"success": False, "message": f"未知字段: {'、'.join(unknown)}，可选: {'、'.join(PROCESS_FIELDS)}"}
+        descending = None if not order else order == "desc"
+        offset = max(offset, 0)
+        limit = max(limit, 0)
+        if not process_table.version:
+            await asyncio.to_thread(process_table.tick)
+
+        def produce():
+            return {"success": True, **process_table.query(sort, descending, q, user, offset, limit, selected)}
+
+        # 进程表未刷新时直接复用已序列化的结果；查询条件可能含任意字符，ETag中只放摘要
+        params = json.dumps([sort, order, q, user, offset, limit, selected], ensure_ascii=False)
+        digest = hashlib.sha1(params.encode()).hexdigest()[:16]
+        return versioned_json(request, make_etag("p", process_table.tag, digest), produce)
     except Exception as e:
         logger.error("获取进程信息失败: %s", str(e))
         return {"success": False, "message": f"获取进程信息失败: {str(e)}"}
+
+@router.get("/process-tree")
+async def get_process_tree(
+    request: Request,
+    root: Optional[int] = None,
+    service: Optional[str] = None,
+    depth: int = DEFAULT_TREE_DEPTH,
+    expand: Optional[str] = None,
+    collapse: Optional[str] = None,
+    sort: str = "memory",
+    _: Dict = Depends(get_current_user)
+):
+    """获取进程树，每个节点附带子树的内存和CPU合计
+
+    root或service（受管服务名）指定只返回某个进程的子树；depth层以内默认展开，
+    expand和collapse为逗号分隔的PID，分别指定总是展开和总是折叠的节点。
+    """
+    try:
+        try:
+            expanded = [int(pid) for pid in expand.split(",") if pid.strip()] if expand else []
+            collapsed = [int(pid) for pid in collapse.split(",") if pid.strip()] if collapse else []
+        except ValueError:
+            return {"success": False, "message": "expand和collapse应为逗号分隔的PID"}
+        labels = {s["pid"]: s["name"] for s in supervisor.status() if s.get("pid")}
+        if service:
+            pids = [pid for pid, name in labels.items() if name == service]
+            if not pids:
+                return {"success": False, "message": f"服务未运行: {service}"}
+            root = pids[0]
+        await asyncio.to_thread(process_tree.sync)
+
+        def produce():
+            return {"success": True, **process_tree.view(root, max(depth, 0), expanded, collapsed, sort, labels)}
+
+        params = json.dumps([root, depth, sorted(expanded), sorted(collapsed), sort, sorted(labels.items())])
+        digest = hashlib.sha1(params.encode()).hexdigest()[:16]
+        return versioned_json(request, make_etag("t", process_table.tag, digest), produce)
+    except ProcessTreeError as e:
+        return {"success": False, "message": str(e)}
+    except Exception as e:
+        logger.error(f"获取进程树失败: {str(e)}")
+        return {"success": False, "message": f"获取进程树失败: {str(e)}"}
+
+@router.get("/commands")
+async def get_commands(
+    type: Optional[str] = None,
+    q: Optional[str] = None,
+    prefix: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 100,
+    current_user: Dict = Depends(get_current_user)
+):
+    """列出已注册的命令，支持按分类过滤、关键字搜索和命令前缀补全"""
+    try:
+        offset, limit = max(offset, 0), min(max(limit, 1), 1000)
+        if prefix:
+            commands = command_registry.prefix(prefix, limit)
+            total = len(commands)
+        elif q:
+            commands, total = command_registry.search(q, type, offset, limit)
+        else:
+            commands, total = command_registry.list(type, offset, limit)
+        return {"success": True, "commands": commands, "total": total, "version": command_registry.version}
+    except Exception as e:
+        logger.error(f"获取命令列表失败: {str(e)}")
+        return {"success": False, "message": f"获取命令列表失败: {str(e)}"}
+
+@router.get("/commands/types")
+async def get_command_types(current_user: Dict = Depends(get_current_user)):
+    """获取命令分类及各分类的命令数"""
+    return {"success": True, "types": command_registry.types()}
+
+@router.get("/commands/resolve")
+async def resolve_command(text: str, current_user: Dict = Depends(get_current_user)):
+    """按消息内容匹配命令，返回命令和参数"""
+    result = command_registry.resolve(text)
+    if result is None:
+        return {"success": False, "message": "没有匹配的命令"}
+    command, args = result
+    return {"success": True, "command": command, "args": args}
+
+@router.post("/commands")
+async def register_commands(data: CommandRegisterModel, current_user: Dict = Depends(get_current_user)):
+    """批量注册命令，写入data/cmd/<file>.yaml"""
+    commands = [command.dict() for command in data.commands]
+    return await asyncio.to_thread(command_registry.register, commands, data.file)
+
+@router.get("/debug/routes")
+async def get_route_stats(current_user: Dict = Depends(get_current_user)):
+    """各路由的请求数、耗时分位数和正在处理的请求数，按总耗时排序"""
+    try:
+        return {"success": True, "routes": http_metrics.report()}
+    except Exception as e:
+        logger.error(f"获取路由耗时失败: {str(e)}")
+        return {"success": False, "message": f"获取路由耗时失败: {str(e)}"}
+
+@router.get("/debug/loop")
+async def get_loop_stats(current_user: Dict = Depends(get_current_user)):
+    """事件循环延迟和最近的阻塞记录（含阻塞时的调用栈和请求）"""
+    return {"success": True, "loop": loop_monitor.report()}
+
+@router.get("/debug/profile")
+async def profile_process(
+    seconds: float = 10,
+    hz: int = 100,
+    idle: bool = False,
+    current_user: Dict = Depends(get_current_user)
+):
+    """对当前进程采样seconds秒，返回折叠栈文件，可直接交给flamegraph.pl或speedscope"""
+    if seconds <= 0 or seconds > MAX_PROFILE_SECONDS:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                            content={"success": False, "message": f"采样时长应在0到{MAX_PROFILE_SECONDS}秒之间"})
+    try:
+        result = await asyncio.to_thread(profiler.profile, seconds, hz, idle)
+    except ProfilerBusy:
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                            content={"success": False, "message": "已有CPU分析正在进行"})
+    except Exception as e:
+        logger.error(f"CPU分析失败: {str(e)}")
+        return {"success": False, "message": f"CPU分析失败: {str(e)}"}
+    filename = time.strftime("firefly-%Y%m%d-%H%M%S.folded")
+    return Response(result["folded"], media_type="text/plain; charset=utf-8", headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Profile-Samples": str(result["samples"]),
+        "X-Profile-Seconds": str(result["seconds"]),
+    })
+
+@router.get("/debug/memory")
+async def get_memory_trace_status(current_user: Dict = Depends(get_current_user)):
+    """内存跟踪状态、进程内存和已保存的快照"""
+    try:
+        return {"success": True, "memory": await asyncio.to_thread(memory_tracer.status)}
+    except Exception as e:
+        logger.error(f"获取内存跟踪状态失败: {str(e)}")
+        return {"success": False, "message": f"获取内存跟踪状态失败: {str(e)}"}
+
+@router.post("/debug/memory/start")
+async def start_memory_trace(data: MemoryTraceStartModel, current_user: Dict = Depends(get_current_user)):
+    """开启内存跟踪，跟踪期间每次分配都有额外开销"""
+    try:
+        await asyncio.to_thread(memory_tracer.start, data.frames)
+        return {"success": True, "memory": await asyncio.to_thread(memory_tracer.status)}
+    except Exception as e:
+        logger.error(f"开启内存跟踪失败: {str(e)}")
+        return {"success": False, "message": f"开启内存跟踪失败: {str(e)}"}
+
+@router.post("/debug/memory/stop")
+async def stop_memory_trace(current_user: Dict = Depends(get_current_user)):
+    """关闭内存跟踪，已保存的快照保留"""
+    try:
+        await asyncio.to_thread(memory_tracer.stop)
+        return {"success": True, "memory": await asyncio.to_thread(memory_tracer.status)}
+    except Exception as e:
+        logger.error(f"关闭内存跟踪失败: {str(e)}")
+        return {"success": False, "message": f"关闭内存跟踪失败: {str(e)}"}
+
+@router.post("/debug/memory/snapshots")
+async def take_memory_snapshot(data: MemorySnapshotModel, current_user: Dict = Depends(get_current_user)):
+    """保存命名快照，不指定名称时按时间命名"""
+    if data.name and not SNAPSHOT_NAME_RE.match(data.name):
+        return {"success": False, "message": f"无效的快照名: {data.name}"}
+    try:
+        snapshot = await asyncio.to_thread(memory_tracer.take_snapshot, data.name)
+        return {"success": True, "snapshot": snapshot}
+    except MemoryTracerError as e:
+        return {"success": False, "message": str(e)}
+    except Exception as e:
+        logger.error(f"保存内存快照失败: {str(e)}")
+        return {"success": False, "message": f"保存内存快照失败: {str(e)}"}
+
+@router.delete("/debug/memory/snapshots/{name}")
+async def delete_memory_snapshot(name: str, current_user: Dict = Depends(get_current_user)):
+    """删除快照"""
+    if not memory_tracer.delete_snapshot(name):
+        return {"success": False, "message": f"快照不存在: {name}"}
+    return {"success": True}
+
+@router.get("/debug/memory/top")
+async def get_memory_top(
+    snapshot: Optional[str] = None,
+    group_by: str = "lineno",
+    limit: int = 20,
+    current_user: Dict = Depends(get_current_user)
+):
+    """快照（不指定时为当前）中占用内存最多的位置，按文件和行号、文件或调用栈分组"""
+    try:
+        result = await asyncio.to_thread(memory_tracer.top, snapshot, group_by, min(max(limit, 1), 500))
+        return {"success": True, **result}
+    except MemoryTracerError as e:
+        return {"success": False, "message": str(e)}
+    except Exception as e:
+        logger.error(f"获取内存分配统计失败: {str(e)}")
+        return {"success": False, "message": f"获取内存分配统计失败: {str(e)}"}
+
+@router.get("/debug/memory/diff")
+async def get_memory_diff(
+    base: str,
+    target: Optional[str] = None,
+    group_by: str = "lineno",
+    limit: int = 20,
+    current_user: Dict = Depends(get_current_user)
+):
+    """target快照（不指定时为当前）相对base快照的内存变化，按增长大小排序"""
+    try:
+        result = await asyncio.to_thread(memory_tracer.diff, base, target, group_by, min(max(limit, 1), 500))
+        return {"success": True, **result}
+    except MemoryTracerError as e:
+        return {"success": False, "message": str(e)}
+    except Exception as e:
+        logger.error(f"对比内存快照失败: {str(e)}")
+        return {"success": False, "message": f"对比内存快照失败: {str(e)}"}
+
+@router.get("/debug/memory/suspects")
+async def get_memory_suspects(limit: int = 20, current_user: Dict = Depends(get_current_user)):
+    """定期采样发现的疑似泄漏位置（需开启monitor.memory_trace.periodic）"""
+    try:
+        return {"success": True, **memory_tracer.suspects(min(max(limit, 1), 500))}
+    except Exception as e:
+        logger.error(f"获取内存采样结果失败: {str(e)}")
+        return {"success": False, "message": f"获取内存采样结果失败: {str(e)}"}
+
+@router.websocket("/ws")
+async def realtime(websocket: WebSocket):
+    """仪表盘实时推送，每个标签页一个连接，按主题订阅资源、进程、日志和服务状态"""
+    if await get_session(websocket.cookies.get("session_id")) is None or not check_origin(websocket):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await realtime_hub.serve(websocket)
@@ -0,0 +1,328 @@
+# -- coding: utf-8 --
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import anyio
+
+from .utils import get_data_dir, atomic_write
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只生成gzip版本
+    brotli = None
+
+logger = logging.getLogger("assets")
+
+# 值得预压缩的文件类型，图片等已压缩的格式只做指纹
+COMPRESSIBLE = {".js", ".css", ".html", ".svg", ".json", ".txt", ".ttf", ".otf", ".map", ".wasm"}
+# 压缩后至少要小这么多才保留压缩版本
+MIN_RATIO = 0.9
+# 指纹长度（十六进制字符）
+HASH_LENGTH = 12
+# 文件名带指纹，内容不会再变
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 按优先级排列的预压缩编码：(Content-Encoding, 文件后缀)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+CHUNK_SIZE = 64 * 1024
+
+# 获取静态资源源目录和构建目录
+def get_static_dir() -> str:
+    return os.path.join(os.path.dirname(get_data_dir()), "static")
+
+def get_build_dir() -> str:
+    return os.path.join(get_data_dir(), "assets")
+
+# 在文件名的扩展名前插入指纹：js/three.min.js -> js/three.min.<hash>.js
+def fingerprint_name(path: str, digest: str) -> str:
+    directory, filename = os.path.split(path)
+    stem, ext = os.path.splitext(filename)
+    return "/".join(filter(None, [directory, f"{stem}.{digest}{ext}"]))
+
+# 解析Accept-Encoding，返回可接受的编码及其权重
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+# 解析单个Range，返回[start, end]闭区间；不支持或无法满足时分别返回None和False
+def parse_range(header: str, size: int):
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # 多段范围按规范可以直接返回完整内容
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+class AssetPipeline:
+    """静态资源构建：生成带内容指纹的文件名以及gzip/brotli预压缩版本
+
+    构建结果保存在data/assets，清单记录源文件的大小和修改时间，未变化的文件不会重复压缩。
+    """
+
+    def __init__(self, source_dir: Optional[str] = None, build_dir: Optional[str] = None):
+        self.source_dir = source_dir or get_static_dir()
+        self.build_dir = build_dir or get_build_dir()
+        self.manifest_path = os.path.join(self.build_dir, "manifest.json")
+        self._lock = threading.Lock()
+        # 源路径 -> 清单条目
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # 带指纹的路径 -> 清单条目
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        # 每次载入清单加一，引用资源地址的缓存据此失效
+        self.generation = 0
+
+    def _sources(self) -> List[str]:
+        paths = []
+        for root, dirs, files in os.walk(self.source_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for filename in sorted(files):
+                if not filename.startswith("."):
+                    full = os.path.join(root, filename)
+                    paths.append(os.path.relpath(full, self.source_dir).replace(os.sep, "/"))
+        return paths
+
+    def output_path(self, name: str, suffix: str = "") -> str:
+        return os.path.join(self.build_dir, *name.split("/")) + suffix
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _fresh(self, entry: Optional[Dict[str, Any]], st: os.stat_result) -> bool:
+        if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            return False
+        outputs = [self.output_path(entry["name"])]
+        outputs += [self.output_path(entry["name"], suffix) for encoding, suffix in ENCODINGS
+                    if encoding in entry["encodings"]]
+        return all(os.path.exists(path) for path in outputs)
+
+    def _build_file(self, path: str, st: os.stat_result) -> Dict[str, Any]:
+        with open(os.path.join(self.source_dir, path), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        name = fingerprint_name(path, digest)
+        self._write(self.output_path(name), data)
+
+        encodings: Dict[str, int] = {}
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE:
+            variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(data, quality=11)
+            for encoding, suffix in ENCODINGS:
+                compressed = variants.get(encoding)
+                if compressed is not None and len(compressed) < len(data) * MIN_RATIO:
+                    self._write(self.output_path(name, suffix), compressed)
+                    encodings[encoding] = len(compressed)
+        return {
+            "path": path,
+            "name": name,
+            "hash": digest,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "encodings": encodings,
+        }
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("files", {})
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _apply(self, files: Dict[str, Dict[str, Any]]):
+        self.files = files
+        self.by_name = {entry["name"]: entry for entry in files.values()}
+        self.generation += 1
+
+    def build(self) -> int:
+        """构建有变化的文件并清理过期的输出，返回重新构建的文件数"""
+        with self._lock:
+            previous = self._load_manifest()
+            files: Dict[str, Dict[str, Any]] = {}
+            built = 0
+            for path in self._sources():
+                st = os.stat(os.path.join(self.source_dir, path))
+                entry = previous.get(path)
+                if not self._fresh(entry, st):
+                    entry = self._build_file(path, st)
+                    built += 1
+                files[path] = entry
+            if built or set(files) != set(previous):
+                atomic_write(self.manifest_path, json.dumps({"files": files}, ensure_ascii=False, indent=2))
+                self._prune(files)
+            self._apply(files)
+        if built:
+            logger.info(f"已构建{built}个静态资源")
+        return built
+
+    def _prune(self, files: Dict[str, Dict[str, Any]]):
+        """删除不再被清单引用的旧版本文件"""
+        keep = {os.path.abspath(self.manifest_path)}
+        for entry in files.values():
+            keep.add(os.path.abspath(self.output_path(entry["name"])))
+            for _, suffix in ENCODINGS:
+                keep.add(os.path.abspath(self.output_path(entry["name"], suffix)))
+        for root, _, filenames in os.walk(self.build_dir):
+            for filename in filenames:
+                full = os.path.abspath(os.path.join(root, filename))
+                if full not in keep and not filename.endswith(".tmp"):
+                    os.remove(full)
+
+    def load(self):
+        """只读取已有清单（多worker模式下由管理进程构建）"""
+        with self._lock:
+            self._apply(self._load_manifest())
+
+    def clean(self):
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        self._apply({})
+
+    def url(self, path: str) -> str:
+        """模板中使用的资源地址，已构建时返回带指纹的地址，否则退回/static"""
+        path = path.lstrip("/")
+        entry = self.files.get(path)
+        if entry is None:
+            return f"/static/{path}"
+        return f"/assets/{entry['name']}"
+
+# 全局资源构建
+asset_pipeline = AssetPipeline()
+
+# 启动时构建静态资源，build为False时只读取清单
+def setup_assets(build: bool = True):
+    try:
+        if build:
+            asset_pipeline.build()
+        else:
+            asset_pipeline.load()
+    except Exception as e:
+        logger.error(f"构建静态资源失败: {str(e)}")
+
+class AssetFiles:
+    """带指纹静态资源的ASGI处理器（挂载在/assets）
+
+    按Accept-Encoding选择预压缩文件，响应带immutable缓存头和强ETag，支持If-None-Match和单段Range。
+    Range请求总是针对未压缩的原始内容。
+    """
+
+    def __init__(self, pipeline: AssetPipeline):
+        self.pipeline = pipeline
+
+    def _select(self, entry: Dict[str, Any], accept_encoding: str) -> Tuple[Optional[str], str]:
+        """返回(Content-Encoding, 文件后缀)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            if encoding in entry["encodings"] and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding, suffix
+        return None, ""
+
+    async def _send_empty(self, send, status_code: int, headers: List[Tuple[bytes, bytes]]):
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        if scope["method"] not in ("GET", "HEAD"):
+            await self._send_empty(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+        entry = self.pipeline.by_name.get(scope["path"].lstrip("/"))
+        if entry is None:
+            await self._send_empty(send, 404, [(b"content-length", b"0")])
+            return
+
+        range_header = headers.get("range")
+        if range_header:
+            encoding, suffix = None, ""
+        else:
+            encoding, suffix = self._select(entry, headers.get("accept-encoding", ""))
+        etag = f'"{entry["hash"]}-{encoding}"' if encoding else f'"{entry["hash"]}"'
+        common = [
+            (b"cache-control", CACHE_CONTROL.encode()),
+            (b"etag", etag.encode()),
+            (b"vary", b"Accept-Encoding"),
+            (b"accept-ranges", b"bytes"),
+        ]
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in
+                              [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            await self._send_empty(send, 304, common)
+            return
+
+        path = self.pipeline.output_path(entry["name"], suffix)
+        size = entry["encodings"][encoding] if encoding else entry["size"]
+        start, end = 0, size - 1
+        status_code = 200
+        if range_header and size > 0:
+            if_range = headers.get("if-range")
+            byte_range = parse_range(range_header, size) if not if_range or if_range.strip() == etag else None
+            if byte_range is False:
+                await self._send_empty(send, 416, common + [(b"content-range", f"bytes */{size}".encode()),
+                                                           (b"content-length", b"0")])
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                common.append((b"content-range", f"bytes {start}-{end}/{size}".encode()))
+
+        response_headers = common + [
+            (b"content-type", entry["content_type"].encode()),
+            (b"content-length", str(end - start + 1).encode()),
+        ]
+        if encoding:
+            response_headers.append((b"content-encoding", encoding.encode()))
+        await send({"type": "http.response.start", "status": status_code, "headers": response_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        remaining = end - start + 1
+        async with await anyio.open_file(path, "rb") as f:
+            await f.seek(start)
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # 文件在发送过程中被截断，结束响应
+            await send({"type": "http.response.body", "body": b""})
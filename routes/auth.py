@@ -1,73 +1,78 @@
 from fastapi import APIRouter, Request, Response, Depends, HTTPException, status, Form, Cookie
 from fastapi.responses import JSONResponse, RedirectResponse
 import os
-import uuid
+import math
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Any
-from dotenv import load_dotenv
 
 from .utils import read_config, update_config
-
-# 加载环境变量
-load_dotenv()
+from .sessions import session_manager
+from .credentials import (password_hasher, login_limiter, HasherBusy,
+                          DEFAULT_USERNAME, DEFAULT_PASSWORD)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 logger = logging.getLogger("auth")
 
-# 存储会话
-sessions = {}
-
-# 存储会话
+# 验证用户凭据（bcrypt在线程池中计算，不阻塞事件循环）
+async def verify_credentials(username: str, password: str) -> bool:
+    return await password_hasher.verify(username, password)
 
-# 生成会话ID
-def generate_session_id() -> str:
-    return str(uuid.uuid4())
+# 读取登录请求中的用户名和密码，支持JSON和表单
+async def read_login_form(request: Request) -> Dict[str, str]:
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+    else:
+        data = await request.form()
+    return {"username": str(data.get("username") or ""), "password": str(data.get("password") or "")}
 
-# 验证用户凭据
-def verify_credentials(username: str, password: str) -> bool:
-    try:
-        env_username = os.getenv("USERNAME", "ilovefirefly")
-        env_password = os.getenv("PASSWORD", "ilovefirefly")
-        return username == env_username and password == env_password
-    except Exception as e:
-        logger.error(f"验证凭据失败: {str(e)}")
-        return False
+# 根据会话ID获取会话，未登录或已过期时返回None
+async def get_session(session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    return await session_manager.aget(session_id)
 
 # 获取当前用户
 async def get_current_user(session_id: Optional[str] = Cookie(None)) -> Dict[str, Any]:
-    if not session_id or session_id not in sessions:
+    session = await get_session(session_id)
+    if session is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="未认证",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return sessions[session_id]
+    return session
 
 @router.post("/login")
 async def login(response: Response, request: Request):
+    # 先限流再校验，密集的登录请求不会触发任何哈希计算
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_limiter.acquire(client_ip)
+    if retry_after:
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"success": False, "message": "登录尝试过于频繁，请稍后再试"},
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
     try:
-        username = os.getenv("USERNAME", "ilovefirefly")
-        password = os.getenv("PASSWORD", "ilovefirefly")
-    except Exception:
-        # 如果不是JSON格式，尝试表单格式
-        username = os.getenv("USERNAME", "ilovefirefly")
-        password = os.getenv("PASSWORD", "ilovefirefly")
-    try:
-        if verify_credentials(username, password):
+        form = await read_login_form(request)
+        username, password = form["username"], form["password"]
+        if await verify_credentials(username, password):
             # 创建会话
-            session_id = generate_session_id()
-            sessions[session_id] = {"username": username}
+            session_id = await asyncio.to_thread(session_manager.create, {"username": username})
             
             # 设置Cookie
-            response.set_cookie(key="session_id", value=session_id, httponly=True)
+            response.set_cookie(key="session_id", value=session_id, httponly=True,
+                                max_age=int(session_manager.ttl), samesite="lax")
             
             # 检查是否是新安装
             config = read_config()
             is_new = config.get("server", {}).get("is_new", False)
-            env_username = os.getenv("USERNAME", "ilovefirefly")
-            env_password = os.getenv("PASSWORD", "ilovefirefly")
-            default_credentials = (username == env_username and password == env_password)
+            default_credentials = (username == DEFAULT_USERNAME and password == DEFAULT_PASSWORD)
             
             return {
                 "success": True, 
@@ -80,6 +85,12 @@ async def login(response: Response, request: Request):
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"success": False, "message": "用户名或密码错误"}
             )
+    except HasherBusy:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"success": False, "message": "登录请求过多，请稍后再试"},
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         logger.error(f"登录失败: {str(e)}")
         return JSONResponse(
@@ -90,8 +101,7 @@ async def login(response: Response, request: Request):
 @router.post("/logout")
 async def logout(response: Response, session_id: Optional[str] = Cookie(None)):
     try:
-        if session_id and session_id in sessions:
-            del sessions[session_id]
+        await asyncio.to_thread(session_manager.delete, session_id)
         
         response.delete_cookie(key="session_id")
         return {"success": True, "redirect": "/login"}
@@ -109,37 +119,22 @@ async def change_password(
     user: dict = Depends(get_current_user)
 ):
     try:
-        env_password = os.getenv("PASSWORD", "ilovefirefly")
-        
         # 验证当前密码
-        if env_password != current_password:
+        if not await verify_credentials(user["username"], current_password):
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={"success": False, "message": "当前密码不正确"}
             )
         
-        # 更新.env文件中的密码
-        env_file_path = ".env"
-        if os.path.exists(env_file_path):
-            with open(env_file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            with open(env_file_path, 'w', encoding='utf-8') as f:
-                for line in lines:
-                    if line.startswith('PASSWORD='):
-                        f.write(f'PASSWORD={new_password}\n')
-                    else:
-                        f.write(line)
-        else:
-            # 如果.env文件不存在，创建一个
-            with open(env_file_path, 'w', encoding='utf-8') as f:
-                f.write(f'USERNAME={os.getenv("USERNAME", "ilovefirefly")}\n')
-                f.write(f'PASSWORD={new_password}\n')
-        
-        # 重新加载环境变量
-        load_dotenv(override=True)
+        # 只保存新密码的哈希
+        await password_hasher.set_password(user["username"], new_password)
         
         return {"success": True, "message": "密码已更新"}
+    except HasherBusy:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"success": False, "message": "服务繁忙，请稍后再试"}
+        )
     except Exception as e:
         logger.error(f"更新密码失败: {str(e)}")
         return JSONResponse(
@@ -0,0 +1,527 @@
+# -- coding: utf-8 --
+"""多worker模式
+
+管理进程监听端口、运行所有后台任务（资源采样、进程表、服务监控）并管理bot子进程，
+再启动N个uvicorn worker共享同一个监听套接字。worker不做任何采样，通过Unix套接字上的
+控制通道从管理进程同步状态、转发服务操作。配置文件变化时逐个替换worker：
+新worker就绪后才让旧worker优雅退出，监听套接字始终有进程在accept。
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import threading
+import subprocess
+from typing import Dict, Any, List, Optional
+
+from .utils import read_config, get_data_dir, thaw
+from .monitor import PeriodicTask, resource_sampler, process_table
+from .supervisor import supervisor
+from .servicemon import service_monitor
+from .history import metrics_history, get_history_config
+
+logger = logging.getLogger("cluster")
+
+# 进程角色，由环境变量传给worker
+ROLE_ENV = "FIREFLY_ROLE"
+CONTROL_ENV = "FIREFLY_CONTROL"
+STANDALONE = "standalone"
+MANAGER = "manager"
+WORKER = "worker"
+
+# 当前进程的角色
+def get_role() -> str:
+    return os.environ.get(ROLE_ENV, STANDALONE)
+
+# 获取多worker配置
+def get_cluster_config() -> Dict[str, Any]:
+    """获取多worker配置（server.workers等），workers不大于1时以单进程运行"""
+    server = read_config().get("server", {}) or {}
+    return {
+        "workers": max(1, int(server.get("workers", 1))),
+        "graceful_timeout": float(server.get("graceful_timeout", 30)),
+        "ready_timeout": float(server.get("ready_timeout", 30)),
+        "reload_on_config": bool(server.get("reload_on_config", True)),
+    }
+
+# 控制通道套接字路径
+def get_control_path() -> str:
+    return os.environ.get(CONTROL_ENV) or os.path.join(get_data_dir(), "run", "control.sock")
+
+# worker启动时读取并缓存的配置段：监听和worker数量、会话、认证、页面缓存、压缩、日志，
+# 以及每个进程各自运行的事件循环检测、内存跟踪和指标历史。其余配置每次使用时经config_store读取，
+# 修改后自动生效，不需要重启worker
+WORKER_CONFIG_PATHS = (
+    ("server",),
+    ("logging",),
+    ("monitor", "loop_lag"),
+    ("monitor", "memory_trace"),
+    ("monitor", "history"),
+)
+
+# 配置指纹，只包含worker缓存的配置段
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    cached = {}
+    for path in WORKER_CONFIG_PATHS:
+        value = config
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        cached[".".join(path)] = thaw(value)
+    return json.dumps(cached, sort_keys=True, ensure_ascii=False, default=str)
+
+class ControlServer:
+    """管理进程中的控制通道，每行一个JSON请求/响应"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._ready: Dict[int, asyncio.Event] = {}
+        self._processes: Optional[Dict[str, Any]] = None
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=16 * 1024 * 1024)
+        os.chmod(self.path, 0o600)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def expect(self, pid: int) -> asyncio.Event:
+        """登记一个即将启动的worker，返回其就绪事件"""
+        event = self._ready[pid] = asyncio.Event()
+        return event
+
+    def forget(self, pid: int):
+        self._ready.pop(pid, None)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                try:
+                    response = {"id": request.get("id"),
+                                "result": await self.dispatch(request["method"], request.get("params") or {})}
+                except Exception as e:
+                    logger.error(f"控制请求{request.get('method')}失败: {str(e)}")
+                    response = {"id": request.get("id"), "error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False, default=str).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def state(self) -> Dict[str, Any]:
+        """worker每次同步时读取的状态"""
+        return {
+            "resources": resource_sampler.snapshot(),
+            "process_version": process_table.version,
+            "services": supervisor.status(),
+            "service_stats": service_monitor.summary(),
+        }
+
+    def processes(self) -> Dict[str, Any]:
+        # 同一版本的进程表只导出一次，所有worker共用
+        version = process_table.version
+        if self._processes is None or self._processes["version"] != version:
+            self._processes = process_table.columns()
+        return {**self._processes, "age": process_table.age()}
+
+    async def dispatch(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "state":
+            return self.state()
+        if method == "processes":
+            return self.processes()
+        if method == "service":
+            service = supervisor.get(params["name"])
+            if service is None:
+                raise ValueError(f"未知服务: {params['name']}")
+            action = params["action"]
+            if action == "start":
+                ok = service.start()
+            elif action == "stop":
+                await service.stop()
+                ok = True
+            elif action == "restart":
+                ok = await service.restart()
+            else:
+                raise ValueError(f"未知操作: {action}")
+            return {"ok": ok, "service": service.status()}
+        if method == "service_report":
+            return await asyncio.to_thread(service_monitor.report, params["name"], int(params.get("limit", 120)))
+        if method == "ready":
+            event = self._ready.get(int(params["pid"]))
+            if event is not None:
+                event.set()
+            return True
+        raise ValueError(f"未知方法: {method}")
+
+class ControlClient:
+    """worker中的控制通道客户端，同步调用，可以在任意线程中使用"""
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._id = 0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile("rb")
+
+    def call(self, method: str, **params) -> Any:
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            self._id += 1
+            request = {"id": self._id, "method": method, "params": params}
+            try:
+                self._sock.sendall(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError("控制通道已关闭")
+            except OSError:
+                # 请求可能已经执行，不自动重试，下次调用时重新连接
+                self._close()
+                raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    async def acall(self, method: str, **params) -> Any:
+        return await asyncio.to_thread(self.call, method, **params)
+
+    def _close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+class RemoteService:
+    """worker中受管服务的代理，与ManagedService的接口一致，操作由管理进程执行"""
+
+    def __init__(self, client: ControlClient, status: Dict[str, Any]):
+        self.client = client
+        self.name = status["name"]
+        self._status = status
+
+    @property
+    def state(self) -> str:
+        return self._status["state"]
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._status["pid"]
+
+    def status(self) -> Dict[str, Any]:
+        return self._status
+
+    def _apply(self, result: Dict[str, Any]) -> bool:
+        self._status = result["service"]
+        return result["ok"]
+
+    async def start(self) -> bool:
+        return self._apply(await self.client.acall("service", name=self.name, action="start"))
+
+    async def stop(self):
+        self._apply(await self.client.acall("service", name=self.name, action="stop"))
+
+    async def restart(self) -> bool:
+        return self._apply(await self.client.acall("service", name=self.name, action="restart"))
+
+class Replica(PeriodicTask):
+    """worker中的状态同步任务，代替本地的采样器和服务管理
+
+    同步到的资源快照和进程表写入原来的全局对象并触发其监听者，
+    接口和WebSocket推送不需要区分是否运行在worker中。
+    """
+
+    name = "状态同步"
+
+    def __init__(self, client: ControlClient, interval: float = 0.5):
+        super().__init__(interval)
+        self.client = client
+        self._parent = os.getppid()
+        self._state: Dict[str, Any] = {}
+        self._resources_at: Optional[float] = None
+
+    def attach(self):
+        supervisor.remote = self
+        service_monitor.remote = self
+
+    def detach(self):
+        supervisor.remote = None
+        service_monitor.remote = None
+
+    def prime(self):
+        # 首次同步已在start_replica中完成，通知管理进程可以停止旧worker
+        try:
+            self.client.call("ready", pid=os.getpid())
+        except Exception as e:
+            logger.error(f"连接管理进程失败: {str(e)}")
+
+    def tick(self):
+        if os.getppid() != self._parent:
+            # 管理进程已退出，不再有人同步状态和接管端口
+            logger.error("管理进程已退出，worker随之退出")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        state = self.client.call("state")
+        self._state = state
+        resources = state["resources"]
+        if resources["timestamp"] != self._resources_at:
+            self._resources_at = resources["timestamp"]
+            resource_sampler.publish(resources, resources.get("age", 0.0))
+        if state["process_version"] != process_table.version:
+            process_table.load(self.client.call("processes"))
+
+    def services(self) -> List[Dict[str, Any]]:
+        return self._state.get("services", [])
+
+    def service(self, name: str) -> Optional[RemoteService]:
+        for status in self.services():
+            if status["name"] == name:
+                return RemoteService(self.client, status)
+        return None
+
+    def service_stats(self) -> Dict[str, Dict[str, Any]]:
+        return self._state.get("service_stats", {})
+
+    def service_report(self, name: str, limit: int) -> Optional[Dict[str, Any]]:
+        return self.client.call("service_report", name=name, limit=limit)
+
+# worker中的全局同步任务
+replica: Optional[Replica] = None
+
+async def start_replica():
+    global replica
+    replica = Replica(ControlClient(get_control_path()))
+    replica.attach()
+    # 开始处理请求前先同步一次，避免接口在worker中触发本地采样
+    try:
+        await asyncio.to_thread(replica.tick)
+    except Exception as e:
+        logger.error(f"同步管理进程状态失败: {str(e)}")
+    replica.start()
+
+async def stop_replica():
+    global replica
+    if replica is not None:
+        await replica.stop()
+        replica.detach()
+        replica.client.close()
+        replica = None
+
+class WorkerProcess:
+    """一个uvicorn worker子进程"""
+
+    def __init__(self, process: subprocess.Popen, ready: asyncio.Event):
+        self.process = process
+        self.pid = process.pid
+        self.ready = ready
+        self.started_at = time.monotonic()
+        self.stopping = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+class Manager:
+    """管理进程：持有监听套接字，启动、替换和回收worker"""
+
+    # worker连续崩溃时的重启间隔上限（秒）
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.config = get_cluster_config()
+        self.control = ControlServer(get_control_path())
+        self.workers: List[WorkerProcess] = []
+        self.sock: Optional[socket.socket] = None
+        self._stop = asyncio.Event()
+        self._reload = asyncio.Event()
+        self._crashes = 0
+        self._next_spawn = 0.0
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self) -> WorkerProcess:
+        fd = self.sock.fileno()
+        env = {**os.environ, ROLE_ENV: WORKER, CONTROL_ENV: self.control.path}
+        command = [sys.executable, "-m", "uvicorn", "run:app", "--fd", str(fd),
+                   "--timeout-graceful-shutdown", str(int(self.config["graceful_timeout"]))]
+        # 独立的会话：终端的Ctrl+C只发给管理进程，由它按顺序停止worker
+        process = subprocess.Popen(command, cwd=os.path.dirname(get_data_dir()), env=env,
+                                   pass_fds=(fd,), start_new_session=True)
+        worker = WorkerProcess(process, self.control.expect(process.pid))
+        self.workers.append(worker)
+        logger.info(f"已启动worker {worker.pid}")
+        return worker
+
+    async def _wait_ready(self, worker: WorkerProcess) -> bool:
+        deadline = time.monotonic() + self.config["ready_timeout"]
+        while time.monotonic() < deadline and worker.alive:
+            try:
+                await asyncio.wait_for(worker.ready.wait(), timeout=0.5)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def _stop_worker(self, worker: WorkerProcess):
+        """SIGTERM让uvicorn停止accept并处理完已有请求，超时后强制结束"""
+        worker.stopping = True
+        if worker.alive:
+            worker.process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.to_thread(worker.process.wait, self.config["graceful_timeout"] + 5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"worker {worker.pid}未能按时退出，强制结束")
+                worker.process.kill()
+                await asyncio.to_thread(worker.process.wait)
+        self.control.forget(worker.pid)
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    async def rolling_restart(self):
+        """逐个替换worker，任何时刻至少有原数量的worker在处理请求"""
+        logger.info("开始逐个重启worker")
+        for old in [w for w in self.workers if not w.stopping]:
+            if self._stop.is_set():
+                return
+            new = self._spawn()
+            if not await self._wait_ready(new):
+                logger.error(f"新worker {new.pid}未能就绪，保留旧worker并停止重启")
+                await self._stop_worker(new)
+                return
+            await self._stop_worker(old)
+        logger.info("worker重启完成")
+
+    async def _scale(self, count: int):
+        active = [w for w in self.workers if not w.stopping]
+        for _ in range(count - len(active)):
+            await self._wait_ready(self._spawn())
+        for worker in active[count:]:
+            await self._stop_worker(worker)
+
+    def _reap(self):
+        """回收意外退出的worker，连续崩溃时逐渐拉长重启间隔"""
+        for worker in [w for w in self.workers if not w.alive and not w.stopping]:
+            logger.error(f"worker {worker.pid}意外退出（退出码{worker.process.returncode}）")
+            self.control.forget(worker.pid)
+            self.workers.remove(worker)
+            uptime = time.monotonic() - worker.started_at
+            self._crashes = 0 if uptime > 60 else self._crashes + 1
+            self._next_spawn = time.monotonic() + min(self.MAX_BACKOFF, 2 ** self._crashes - 1)
+        missing = self.config["workers"] - len([w for w in self.workers if not w.stopping])
+        if missing > 0 and time.monotonic() >= self._next_spawn:
+            for _ in range(missing):
+                self._spawn()
+
+    async def _on_config_change(self):
+        config = get_cluster_config()
+        server = read_config().get("server", {}) or {}
+        if server.get("host", "0.0.0.0") != self.host or int(server.get("port", 8000)) != self.port:
+            logger.warning("监听地址或端口的修改需要完整重启后生效")
+        # 后台任务在管理进程中，直接按新配置重新加载
+        supervisor.load()
+        archives = get_history_config()
+        if archives != metrics_history.archives:
+            # 历史文件由管理进程按新布局重建，之后启动的worker映射新文件
+            metrics_history.close()
+            metrics_history.configure(archives)
+            metrics_history.open()
+        workers_changed = config["workers"] != self.config["workers"]
+        self.config = config
+        if workers_changed:
+            logger.info(f"worker数量调整为{config['workers']}")
+            await self._scale(config["workers"])
+        if config["reload_on_config"]:
+            await self.rolling_restart()
+
+    async def _watch(self):
+        fingerprint = config_fingerprint(read_config())
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            if self._stop.is_set():
+                break
+            try:
+                self._reap()
+                current = config_fingerprint(read_config())
+                if current != fingerprint:
+                    fingerprint = current
+                    await self._on_config_change()
+                if self._reload.is_set():
+                    self._reload.clear()
+                    await self.rolling_restart()
+            except Exception as e:
+                logger.error(f"管理worker失败: {str(e)}")
+
+    async def run(self):
+        from . import start_services, stop_services
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stop.set)
+        # SIGHUP手动触发逐个重启
+        loop.add_signal_handler(signal.SIGHUP, self._reload.set)
+
+        self.sock = self._bind()
+        await start_services()
+        await self.control.start()
+        try:
+            for _ in range(self.config["workers"]):
+                self._spawn()
+            await asyncio.gather(*(self._wait_ready(w) for w in list(self.workers)))
+            logger.info(f"{len(self.workers)}个worker已就绪")
+            await self._watch()
+        finally:
+            logger.info("正在停止worker")
+            await asyncio.gather(*(self._stop_worker(w) for w in list(self.workers)), return_exceptions=True)
+            await self.control.stop()
+            await stop_services()
+            self.sock.close()
+
+# 以多worker模式运行，阻塞直到收到退出信号
+def run_manager(host: str, port: int):
+    os.environ[ROLE_ENV] = MANAGER
+    asyncio.run(Manager(host, port).run())
@@ -0,0 +1,308 @@
+# -- coding: utf-8 --
+"""命令注册表：data/cmd/*.yaml中注册的机器人命令
+
+每个YAML文件是"命令名 -> {cmd, usage, type}"的映射（cmd/register.py按命令名各建一个文件，
+批量注册时写入同一个文件）。所有文件启动时加载一次，建立按名称、分类、命令字符串和前缀的索引，
+之后只在文件变化时重新加载变化的文件，查询不读磁盘。
+"""
+import os
+import re
+import bisect
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import yaml
+
+from .utils import get_data_dir, atomic_write
+from .monitor import PeriodicTask
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("commands")
+
+# 有libyaml时使用C实现，加载大量命令文件快得多
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+FIELDS = ("cmd", "usage", "type")
+# 文件名只允许字母、数字、下划线和连字符（含中文）
+FILE_RE = re.compile(r"^[\w\-]+$")
+
+# 获取命令目录
+def get_cmd_dir() -> str:
+    return os.path.join(get_data_dir(), "cmd")
+
+# 解析一个命令文件，返回其中的命令列表
+def parse_command_file(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.load(f, Loader=YamlLoader) or {}
+    if not isinstance(data, dict):
+        raise ValueError("命令文件应为 命令名: {cmd, usage, type} 的映射")
+    file = os.path.splitext(os.path.basename(path))[0]
+    commands = []
+    for name, spec in data.items():
+        if not isinstance(spec, dict):
+            raise ValueError(f"命令{name}的定义应为映射")
+        commands.append({"name": str(name), "cmd": str(spec.get("cmd") or ""),
+                         "usage": str(spec.get("usage") or ""), "type": str(spec.get("type") or ""),
+                         "file": file})
+    return commands
+
+# 检查单个命令定义，返回错误信息，没有错误时返回None
+def validate_command(command: Dict[str, Any]) -> Optional[str]:
+    for key in ("name", "cmd", "type"):
+        if not str(command.get(key) or "").strip():
+            return f"命令{command.get('name') or ''}缺少{key}"
+    return None
+
+class CommandIndex:
+    """某一时刻全部命令的只读索引，变化时整体替换，查询无需加锁"""
+
+    def __init__(self, commands: List[Dict[str, Any]], version: int):
+        self.version = version
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_cmd: Dict[str, Dict[str, Any]] = {}
+        self.by_type: Dict[str, List[Dict[str, Any]]] = {}
+        self.conflicts: List[str] = []
+        for command in commands:
+            if command["name"] in self.by_name:
+                self.conflicts.append(f"命令名{command['name']}在{self.by_name[command['name']]['file']}"
+                                      f"和{command['file']}中重复")
+                continue
+            if command["cmd"] in self.by_cmd:
+                self.conflicts.append(f"命令{command['cmd']}同时注册为{self.by_cmd[command['cmd']]['name']}"
+                                      f"和{command['name']}")
+                continue
+            self.by_name[command["name"]] = command
+            self.by_cmd[command["cmd"]] = command
+            self.by_type.setdefault(command["type"], []).append(command)
+        for items in self.by_type.values():
+            items.sort(key=lambda c: c["name"])
+        # 按命令字符串排序，用于前缀查找
+        self.cmd_keys = sorted(self.by_cmd)
+        self.commands = sorted(self.by_name.values(), key=lambda c: c["name"])
+        # 搜索用的小写文本
+        self.haystacks = [(c, f"{c['name']}\n{c['cmd']}\n{c['usage']}".lower()) for c in self.commands]
+
+class CommandRegistry:
+    """命令注册表，按文件的mtime和大小判断是否需要重新加载"""
+
+    def __init__(self, cmd_dir: Optional[str] = None):
+        self.cmd_dir = cmd_dir or get_cmd_dir()
+        self._files: Dict[str, Tuple[Tuple[int, int], List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._index = CommandIndex([], 0)
+        self._loaded = False
+
+    @property
+    def version(self) -> int:
+        """注册表版本号，每次内容变化后加一"""
+        return self._index.version
+
+    @property
+    def index(self) -> CommandIndex:
+        if not self._loaded:
+            self.refresh()
+        return self._index
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        try:
+            names = os.listdir(self.cmd_dir)
+        except FileNotFoundError:
+            return {}
+        stats = {}
+        for name in names:
+            if not name.endswith(".yaml"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cmd_dir, name))
+            except OSError:
+                continue
+            stats[name] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def refresh(self) -> bool:
+        """重新加载新增、修改过的命令文件并移除已删除的文件，内容有变化时返回True"""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> bool:
+        stats = self._scan()
+        changed = False
+        for name in [n for n in self._files if n not in stats]:
+            del self._files[name]
+            changed = True
+        for name, stat in stats.items():
+            cached = self._files.get(name)
+            if cached is not None and cached[0] == stat:
+                continue
+            try:
+                commands = parse_command_file(os.path.join(self.cmd_dir, name))
+            except Exception as e:
+                # 文件写到一半或格式错误时保留上次的内容
+                logger.error(f"加载命令文件{name}失败: {str(e)}")
+                if cached is not None:
+                    self._files[name] = (stat, cached[1])
+                continue
+            self._files[name] = (stat, commands)
+            changed = True
+        if changed or not self._loaded:
+            self._rebuild()
+            self._loaded = True
+        return changed
+
+    def _rebuild(self):
+        commands = [c for name in sorted(self._files) for c in self._files[name][1]]
+        self._version += 1
+        index = CommandIndex(commands, self._version)
+        for conflict in index.conflicts:
+            logger.warning(f"命令冲突，已忽略后加载的定义: {conflict}")
+        self._index = index
+
+    # 查询
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """按命令名查找"""
+        command = self.index.by_name.get(name)
+        return dict(command) if command else None
+
+    def find_by_cmd(self, cmd: str) -> Optional[Dict[str, Any]]:
+        """按命令字符串查找"""
+        command = self.index.by_cmd.get(cmd)
+        return dict(command) if command else None
+
+    def resolve(self, text: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """机器人收到消息时匹配命令：取在词边界处结束的最长命令字符串，返回(命令, 参数)"""
+        index = self.index
+        text = text.strip()
+        best = None
+        for match in re.finditer(r"\s|$", text):
+            command = index.by_cmd.get(text[:match.start()])
+            if command is not None:
+                best = (dict(command), text[match.start():].strip())
+        return best
+
+    def list(self, type: Optional[str] = None, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """按命令名排序列出命令，可按分类过滤，返回(本页命令, 总数)"""
+        index = self.index
+        items = index.by_type.get(type, []) if type else index.commands
+        end = None if limit is None else offset + limit
+        return [dict(c) for c in items[offset:end]], len(items)
+
+    def prefix(self, prefix: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """命令字符串以prefix开头的命令（用于补全）"""
+        index = self.index
+        keys = index.cmd_keys
+        result = []
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix) or len(result) >= limit:
+                break
+            result.append(dict(index.by_cmd[keys[i]]))
+        return result
+
+    def search(self, query: str, type: Optional[str] = None, offset: int = 0,
+               limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """在命令名、命令字符串和帮助中搜索（不区分大小写），返回(本页命令, 总数)"""
+        needle = query.lower()
+        matched = [c for c, text in self.index.haystacks
+                   if needle in text and (not type or c["type"] == type)]
+        end = None if limit is None else offset + limit
+        return [dict(c) for c in matched[offset:end]], len(matched)
+
+    def files(self) -> Dict[str, int]:
+        """各命令文件（不含扩展名）中的命令数"""
+        self.index
+        return {os.path.splitext(name)[0]: len(entry[1]) for name, entry in sorted(self._files.items())}
+
+    def types(self) -> Dict[str, int]:
+        """各分类的命令数"""
+        return {type: len(items) for type, items in sorted(self.index.by_type.items())}
+
+    # 注册
+
+    def _file_lock(self):
+        """跨进程的注册锁，多个worker同时注册时串行执行"""
+        os.makedirs(self.cmd_dir, exist_ok=True)
+        f = open(os.path.join(self.cmd_dir, ".lock"), "a")
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def register(self, commands: List[Dict[str, Any]], file: str) -> Dict[str, Any]:
+        """批量注册命令到data/cmd/<file>.yaml，一次原子写入；任何一条无效或冲突时全部不注册
+
+        同一文件中已有的同名命令会被更新。
+        """
+        if not FILE_RE.match(file or ""):
+            return {"success": False, "message": f"无效的文件名: {file}"}
+        if not commands:
+            return {"success": False, "message": "没有要注册的命令"}
+        batch: Dict[str, Dict[str, Any]] = {}
+        for command in commands:
+            error = validate_command(command)
+            if error:
+                return {"success": False, "message": error}
+            name = str(command["name"]).strip()
+            if name in batch:
+                return {"success": False, "message": f"命令名{name}重复"}
+            batch[name] = {"name": name, "cmd": str(command["cmd"]).strip(),
+                           "usage": str(command.get("usage") or ""), "type": str(command["type"]).strip(),
+                           "file": file}
+        cmds = [c["cmd"] for c in batch.values()]
+        if len(set(cmds)) != len(cmds):
+            return {"success": False, "message": "同一批次中有重复的命令字符串"}
+
+        lock = self._file_lock()
+        try:
+            with self._lock:
+                # 加锁后重新加载，避免覆盖其他进程刚写入的内容
+                self._refresh()
+                index = self._index
+                for command in batch.values():
+                    existing = index.by_name.get(command["name"])
+                    if existing is not None and existing["file"] != file:
+                        return {"success": False, "message": f"命令名{command['name']}已在{existing['file']}中注册"}
+                    owner = index.by_cmd.get(command["cmd"])
+                    if owner is not None and owner["name"] != command["name"]:
+                        return {"success": False, "message": f"命令{command['cmd']}已注册为{owner['name']}"}
+
+                name = file + ".yaml"
+                path = os.path.join(self.cmd_dir, name)
+                current = {c["name"]: c for c in self._files.get(name, (None, []))[1]}
+                current.update(batch)
+                data = {c["name"]: {key: c[key] for key in FIELDS} for c in current.values()}
+                atomic_write(path, yaml.dump(data, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True, sort_keys=False))
+                st = os.stat(path)
+                self._files[name] = ((st.st_mtime_ns, st.st_size), list(current.values()))
+                self._rebuild()
+        except Exception as e:
+            logger.error(f"注册命令失败: {str(e)}")
+            return {"success": False, "message": f"注册命令失败: {str(e)}"}
+        finally:
+            lock.close()
+        return {"success": True, "message": f"已注册{len(batch)}条命令到{file}", "count": len(batch)}
+
+class CommandWatcher(PeriodicTask):
+    """定期检查命令文件的变化，每个进程各自维护自己的注册表"""
+
+    name = "命令注册表"
+
+    def __init__(self, registry: CommandRegistry, interval: float = 2.0):
+        super().__init__(interval)
+        self.registry = registry
+
+    def prime(self):
+        self.registry.refresh()
+
+    def tick(self):
+        if self.registry.refresh():
+            logger.info(f"命令注册表已重新加载，共{len(self.registry.index.commands)}条命令")
+
+# 全局命令注册表
+command_registry = CommandRegistry()
+command_watcher = CommandWatcher(command_registry)
@@ -0,0 +1,232 @@
+# -- coding: utf-8 --
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+
+from dotenv import dotenv_values
+from passlib.context import CryptContext
+
+from .utils import read_config, modify_config, get_data_dir, atomic_write
+
+logger = logging.getLogger("auth")
+# passlib 1.7读取bcrypt 4.x的版本号时会打印无害的异常堆栈
+logging.getLogger("passlib").setLevel(logging.ERROR)
+
+# 默认账号，首次安装时使用
+DEFAULT_USERNAME = "ilovefirefly"
+DEFAULT_PASSWORD = "ilovefirefly"
+
+# 获取认证配置
+def get_auth_config() -> Dict[str, Any]:
+    """获取密码校验和登录限流配置（server.auth）
+
+    登录限流的令牌桶在每个进程中各自计数，多worker时同一IP的实际上限约为配置值乘以worker数。
+    """
+    section = (read_config().get("server", {}) or {}).get("auth", {}) or {}
+    return {
+        "bcrypt_rounds": int(section.get("bcrypt_rounds", 12)),
+        "hash_workers": int(section.get("hash_workers", 2)),
+        "max_pending": int(section.get("max_pending", 8)),
+        "login_burst": float(section.get("login_burst", 5)),
+        "login_per_minute": float(section.get("login_per_minute", 6)),
+    }
+
+# 获取.env文件路径
+def get_env_path() -> str:
+    return os.path.join(os.path.dirname(get_data_dir()), ".env")
+
+class CredentialStore:
+    """管理员账号，密码只保存bcrypt哈希（data/credentials.json）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(get_data_dir(), "credentials.json")
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, str]] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        # 用户名不存在时也校验一次，避免通过响应时间判断用户名是否正确
+        self._dummy_hash: Optional[str] = None
+
+    def configure(self, rounds: int):
+        self.context.update(bcrypt__rounds=rounds)
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self) -> Optional[Dict[str, str]]:
+        """读取账号，文件变化（如其他worker修改了密码）时重新加载"""
+        stat = self._file_stat()
+        if stat is None:
+            return None
+        if stat != self._stat:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+            self._stat = stat
+        return self._data
+
+    def save(self, username: str, password_hash: str, default_password: bool = False):
+        """保存账号（写文件，在事件循环中应通过线程调用）"""
+        with self._lock:
+            data = {"username": username, "password_hash": password_hash, "default_password": default_password}
+            atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=2), mode=0o600)
+            self._data = data
+            self._stat = self._file_stat()
+
+    def update_hash(self, username: str, password_hash: str):
+        """只更新密码哈希（如哈希参数升级），保留是否为默认密码的标记"""
+        self.save(username, password_hash, self.uses_default_password())
+
+    def uses_default_password(self) -> bool:
+        """是否仍在使用默认账号密码（迁移时记录，修改密码后清除）"""
+        data = self.load()
+        return bool(data and data.get("default_password"))
+
+    def hash(self, password: str) -> str:
+        """计算密码哈希（耗时，应在线程池中调用）"""
+        return self.context.hash(password)
+
+    def verify(self, username: str, password: str) -> Tuple[bool, Optional[str]]:
+        """校验账号密码（耗时，应在线程池中调用），返回(是否正确, 需要升级时的新哈希)"""
+        data = self.load()
+        if data is None or username != data.get("username"):
+            if self._dummy_hash is None:
+                self._dummy_hash = self.context.hash(DEFAULT_PASSWORD)
+            self.context.verify(password, self._dummy_hash)
+            return False, None
+        return self.context.verify_and_update(password, data["password_hash"])
+
+    def migrate(self):
+        """首次启动时将.env和config.yaml中的明文密码转换为哈希，并删除明文"""
+        data = self.load()
+        if data is not None:
+            if "default_password" not in data:
+                # 早期迁移的文件没有记录是否为默认密码，校验一次补上
+                ok, _ = self.verify(DEFAULT_USERNAME, DEFAULT_PASSWORD)
+                self.save(data["username"], data["password_hash"], ok)
+            return
+        env_path = get_env_path()
+        env = dotenv_values(env_path) if os.path.exists(env_path) else {}
+        username = env.get("USERNAME") or DEFAULT_USERNAME
+        password = env.get("PASSWORD") or DEFAULT_PASSWORD
+        self.save(username, self.hash(password), username == DEFAULT_USERNAME and password == DEFAULT_PASSWORD)
+        logger.info("已将登录密码转换为bcrypt哈希保存到data/credentials.json")
+
+        if os.path.exists(env_path):
+            with open(env_path, "r", encoding="utf-8", newline="") as f:
+                lines = f.readlines()
+            kept = [line for line in lines if not line.lstrip().startswith("PASSWORD=")]
+            if len(kept) != len(lines):
+                atomic_write(env_path, "".join(kept))
+        os.environ.pop("PASSWORD", None)
+
+        if "password" in (read_config().get("server", {}) or {}):
+            modify_config(lambda config: config.get("server", {}).pop("password", None))
+
+class HasherBusy(Exception):
+    """校验队列已满"""
+
+class PasswordHasher:
+    """在有界线程池中执行bcrypt，事件循环不会被哈希计算阻塞
+
+    排队的校验超过上限时直接拒绝，而不是让请求无限堆积。
+    """
+
+    def __init__(self, store: CredentialStore, workers: int = 2, max_pending: int = 8):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+
+    def configure(self, workers: int, max_pending: int):
+        self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+
+    @property
+    def busy(self) -> bool:
+        return self._pending >= self.max_pending
+
+    async def _run(self, func, *args):
+        if self.busy:
+            raise HasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def verify(self, username: str, password: str) -> bool:
+        ok, new_hash = await self._run(self.store.verify, username, password)
+        if ok and new_hash:
+            # 哈希参数已更新（如提高了轮数），顺便重新保存
+            await asyncio.to_thread(self.store.update_hash, username, new_hash)
+        return ok
+
+    async def set_password(self, username: str, password: str):
+        password_hash = await self._run(self.store.hash, password)
+        default = username == DEFAULT_USERNAME and password == DEFAULT_PASSWORD
+        await asyncio.to_thread(self.store.save, username, password_hash, default)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+class LoginRateLimiter:
+    """按IP的令牌桶，在计算任何哈希之前拒绝密集的登录请求
+
+    状态只在当前进程中：多worker时每个worker各有一组令牌桶，同一IP的请求分散到不同worker后，
+    实际允许的速率最多为配置值乘以worker数。
+    """
+
+    # 记录的IP数量超过该值时清理已回满的桶
+    MAX_BUCKETS = 10000
+
+    def __init__(self, burst: float = 5, per_minute: float = 6):
+        self.burst = burst
+        self.rate = per_minute / 60
+        # IP -> (剩余令牌, 上次更新时间)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def configure(self, burst: float, per_minute: float):
+        self.burst = burst
+        self.rate = per_minute / 60
+
+    def acquire(self, key: str) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+# 全局实例
+credential_store = CredentialStore()
+password_hasher = PasswordHasher(credential_store)
+login_limiter = LoginRateLimiter()
+
+# 按配置初始化，并迁移明文密码
+def setup_credentials():
+    config = get_auth_config()
+    credential_store.configure(config["bcrypt_rounds"])
+    password_hasher.configure(config["hash_workers"], config["max_pending"])
+    login_limiter.configure(config["login_burst"], config["login_per_minute"])
+    credential_store.migrate()
@@ -0,0 +1,247 @@
+# -- coding: utf-8 --
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from .utils import get_data_dir, read_config
+
+logger = logging.getLogger("history")
+
+# 记录的指标，顺序决定文件布局
+HISTORY_METRICS = (
+    "cpu_percent",
+    "memory_percent",
+    "memory_used",
+    "disk_percent",
+    "processes",
+    "protocol_rss",
+    "protocol_cpu",
+    "bot_rss",
+    "bot_cpu",
+)
+
+# 默认分辨率: (步长秒数, 槽位数) —— 1秒保留10分钟, 10秒保留24小时, 5分钟保留30天
+DEFAULT_ARCHIVES = ((1, 600), (10, 8640), (300, 8640))
+
+MAGIC = b"FFMETRIC"
+HEADER = struct.Struct("<8sIIq")
+HEADER_SIZE = 64
+
+# 每个槽位: 桶起始时间, 然后每个指标依次为 min, avg, max, 样本数
+SLOT_FIELDS_FIXED = 1
+METRIC_FIELDS = 4
+NAN = float("nan")
+
+# 获取历史存储配置
+def get_history_config() -> Tuple[Tuple[int, int], ...]:
+    """读取monitor.history.archives，格式为[[步长秒数, 槽位数], ...]"""
+    section = (read_config().get("monitor", {}) or {}).get("history", {}) or {}
+    archives = section.get("archives")
+    if not archives:
+        return DEFAULT_ARCHIVES
+    return tuple(sorted((int(step), int(slots)) for step, slots in archives))
+
+class MetricsHistory:
+    """多分辨率的定长时间序列存储
+
+    数据保存在内存映射文件中，每个分辨率是一个按时间取模的环形区域，
+    每个采样直接更新各分辨率当前桶的min/avg/max，重启后历史仍然保留。
+    """
+
+    def __init__(self, path: Optional[str] = None, archives: Tuple[Tuple[int, int], ...] = DEFAULT_ARCHIVES,
+                 metrics: Tuple[str, ...] = HISTORY_METRICS):
+        self.path = path or os.path.join(get_data_dir(), "metrics", "history.bin")
+        self.metrics = metrics
+        self.metric_index = {name: i for i, name in enumerate(metrics)}
+        self.slot_size = SLOT_FIELDS_FIXED + METRIC_FIELDS * len(metrics)
+        self.configure(archives)
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._data: Optional[memoryview] = None
+        self._writable = False
+        self._last_flush = 0.0
+
+    def configure(self, archives: Tuple[Tuple[int, int], ...]):
+        """设置分辨率，需要在open之前调用"""
+        self.archives = archives
+        # 每个分辨率在数据区中的起始位置（以double为单位）
+        self._bases: List[int] = []
+        base = 0
+        for _, slots in archives:
+            self._bases.append(base)
+            base += slots * self.slot_size
+        self._total = base
+
+    def _layout_id(self) -> int:
+        layout = repr((self.metrics, self.archives)).encode()
+        return struct.unpack("<q", hashlib.sha1(layout).digest()[:8])[0]
+
+    def open(self, writable: bool = True):
+        """打开历史文件
+
+        只有写入样本的进程（单进程或管理进程）以writable打开，布局不符时重建文件；
+        worker只读映射，文件不存在或布局不符时不提供历史数据，不能改动其他进程正在映射的文件。
+        """
+        size = HEADER_SIZE + self._total * 8
+        header = HEADER.pack(MAGIC, 1, len(self.metrics), self._layout_id())
+        valid = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            with open(self.path, "rb") as f:
+                valid = f.read(HEADER.size) == header
+        if not valid:
+            if not writable:
+                logger.warning("指标历史文件不存在或布局与配置不符，等待管理进程重建")
+                return
+            if os.path.exists(self.path):
+                logger.warning("指标历史文件布局已变化，重新创建")
+            # 写入新文件后替换，仍在映射旧文件的进程不受影响
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(header.ljust(HEADER_SIZE, b"\0"))
+                f.truncate(size)
+            os.replace(tmp_path, self.path)
+        self._writable = writable
+        if writable:
+            self._file = open(self.path, "r+b")
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)[HEADER_SIZE:].cast("d")
+
+    def close(self):
+        with self._lock:
+            if self._mmap is None:
+                return
+            self._data.release()
+            if self._writable:
+                self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+            self._data = self._mmap = self._file = None
+
+    def record(self, values: Dict[str, float], timestamp: Optional[float] = None):
+        """写入一个样本，同时更新所有分辨率的当前桶"""
+        if self._data is None or not self._writable:
+            return
+        now = timestamp if timestamp is not None else time.time()
+        data = self._data
+        size = self.slot_size
+        with self._lock:
+            for (step, slots), base in zip(self.archives, self._bases):
+                bucket = now - now % step
+                slot = base + int(bucket // step) % slots * size
+                if data[slot] != bucket:
+                    # 进入新的桶，清除该槽位上一轮的旧数据
+                    data[slot] = bucket
+                    for k in range(slot + SLOT_FIELDS_FIXED, slot + size, METRIC_FIELDS):
+                        data[k] = data[k + 1] = data[k + 2] = NAN
+                        data[k + 3] = 0
+                for name, value in values.items():
+                    i = self.metric_index.get(name)
+                    if i is None or value is None:
+                        continue
+                    p = slot + SLOT_FIELDS_FIXED + METRIC_FIELDS * i
+                    count = data[p + 3] + 1
+                    data[p + 3] = count
+                    if count == 1:
+                        data[p] = data[p + 1] = data[p + 2] = value
+                    else:
+                        if value < data[p]:
+                            data[p] = value
+                        data[p + 1] += (value - data[p + 1]) / count
+                        if value > data[p + 2]:
+                            data[p + 2] = value
+            if now - self._last_flush >= 60:
+                self._mmap.flush()
+                self._last_flush = now
+
+    def _pick_archive(self, start: float, end: float, max_points: int) -> int:
+        """选择能覆盖时间范围且点数不超过max_points的最细分辨率"""
+        now = time.time()
+        for i, (step, slots) in enumerate(self.archives):
+            covers = now - step * slots <= start
+            if covers and (end - start) / step <= max_points:
+                return i
+        return len(self.archives) - 1
+
+    def _plan(self, start: float, end: float, step: Optional[int], max_points: int) -> Tuple[int, float, float]:
+        """确定查询使用的分辨率以及第一个和最后一个桶"""
+        if step is not None:
+            choices = [i for i, (s, _) in enumerate(self.archives) if s >= step]
+            index = choices[0] if choices else len(self.archives) - 1
+        else:
+            index = self._pick_archive(start, end, max_points)
+        step, slots = self.archives[index]
+        # 超出该分辨率保留时长的部分已被覆盖，点数过多时只取最近的部分
+        start = max(start, time.time() - step * slots)
+        last = end - end % step
+        first = max(start - start % step, last - (max_points - 1) * step)
+        return index, first, last
+
+    def tag(self, start: float, end: float, step: Optional[int] = None, max_points: int = 1000) -> str:
+        """查询结果的版本：所选的桶范围加上最后一个桶的样本数
+
+        范围内只有最后一个桶（当前桶）还会写入新样本，更早的桶只在移出范围后才会被覆盖。
+        样本数从共享的历史文件中读取，多worker时各进程得到的版本一致。
+        """
+        index, first, last = self._plan(start, end, step, max_points)
+        step, slots = self.archives[index]
+        slot = self._bases[index] + int(last // step) % slots * self.slot_size
+        count = 0
+        with self._lock:
+            data = self._data
+            if data is not None and data[slot] == last:
+                count = sum(int(data[k]) for k in range(slot + SLOT_FIELDS_FIXED + 3, slot + self.slot_size, METRIC_FIELDS))
+        return f"{step}-{int(first)}-{int(last)}-{count}"
+
+    def query(self, metrics: List[str], start: float, end: float, step: Optional[int] = None,
+              max_points: int = 1000) -> Dict[str, Any]:
+        """查询时间范围内的列式数据，缺失的桶为None"""
+        index, first, last = self._plan(start, end, step, max_points)
+        step, slots = self.archives[index]
+        base = self._bases[index]
+        buckets = [first + k * step for k in range(int((last - first) // step) + 1)] if last >= first else []
+
+        names = [name for name in metrics if name in self.metric_index]
+        series = {name: {"min": [], "avg": [], "max": []} for name in names}
+        data = self._data
+        size = self.slot_size
+        with self._lock:
+            for bucket in buckets:
+                slot = base + int(bucket // step) % slots * size
+                present = data is not None and data[slot] == bucket
+                for name in names:
+                    column = series[name]
+                    p = slot + SLOT_FIELDS_FIXED + METRIC_FIELDS * self.metric_index[name]
+                    if present and data[p + 3]:
+                        column["min"].append(data[p])
+                        column["avg"].append(round(data[p + 1], 3))
+                        column["max"].append(data[p + 2])
+                    else:
+                        column["min"].append(None)
+                        column["avg"].append(None)
+                        column["max"].append(None)
+        return {"step": step, "timestamps": buckets, "series": series}
+
+# 全局指标历史
+metrics_history = MetricsHistory()
+
+# 将系统资源快照和服务资源写入历史
+def record_snapshot(snapshot: Dict[str, Any]):
+    from .servicemon import service_monitor
+
+    values = {name: snapshot.get(name) for name in ("cpu_percent", "memory_percent", "memory_used",
+                                                     "disk_percent", "processes")}
+    for name, stats in service_monitor.stats.items():
+        if stats.current is not None:
+            values[f"{name}_rss"] = stats.current["rss"]
+            values[f"{name}_cpu"] = stats.current["cpu_percent"]
+    metrics_history.record(values, snapshot.get("timestamp"))
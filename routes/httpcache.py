@@ -0,0 +1,195 @@
+# -- coding: utf-8 --
+import gzip
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from .utils import read_config
+from .assets import parse_accept_encoding, brotli
+
+logger = logging.getLogger("httpcache")
+
+# 会计算ETag和压缩的响应类型
+CACHEABLE_TYPES = ("application/json", "text/html", "text/plain", "text/css", "application/javascript")
+# 超过该大小的响应在线程池中压缩，避免阻塞事件循环
+THREAD_THRESHOLD = 256 * 1024
+
+# 获取响应压缩配置
+def get_compression_config() -> Dict[str, Any]:
+    """获取响应压缩配置（server.compression）"""
+    section = (read_config().get("server", {}) or {}).get("compression", {}) or {}
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "min_size": int(section.get("min_size", 1024)),
+        "gzip_level": int(section.get("gzip_level", 6)),
+        "brotli_quality": int(section.get("brotli_quality", 4)),
+        "cache_entries": int(section.get("cache_entries", 64)),
+    }
+
+# 去掉弱标记，按弱比较判断ETag是否相同
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+# 判断If-None-Match是否命中
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = _opaque(etag)
+    return any(_opaque(tag) == target for tag in if_none_match.split(","))
+
+# 由数据版本组成ETag
+def make_etag(*parts: Any) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+# 数据未变化时直接返回304，不再生成响应体
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+class LRUBytes:
+    """按键缓存响应体（已序列化或已压缩），按条数淘汰"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Any, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: bytes):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+# 已序列化的JSON响应体，按ETag缓存
+json_bodies = LRUBytes(32)
+
+# 按版本缓存的JSON响应：同一ETag只序列化一次，客户端已有时返回304
+def versioned_json(request: Request, etag: str, produce: Callable[[], Any]) -> Response:
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    body = json_bodies.get(etag)
+    if body is None:
+        body = json.dumps(produce(), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+        json_bodies.put(etag, body)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+class CompressionMiddleware:
+    """响应压缩和条件请求（纯ASGI实现）
+
+    只处理一次性发送完整响应体的JSON/HTML等响应，流式响应（如日志的SSE）原样透传。
+    响应没有ETag时按内容摘要生成，命中If-None-Match时返回304；
+    压缩结果按(ETag, 编码)缓存，数据未变化时不会重复压缩。压缩后ETag变为弱ETag。
+    """
+
+    def __init__(self, app, config: Optional[Dict[str, Any]] = None):
+        self.app = app
+        self.config = config or get_compression_config()
+        self.cache = LRUBytes(self.config["cache_entries"])
+
+    def _choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+            if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.config["brotli_quality"])
+        return gzip.compress(body, compresslevel=self.config["gzip_level"], mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.config["enabled"]:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        conditional = scope["method"] in ("GET", "HEAD")
+        encoding = self._choose_encoding(request_headers.get("accept-encoding", ""))
+        start_message: Optional[Dict[str, Any]] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                if self._eligible(message):
+                    start_message = message
+                else:
+                    # 不需要处理的响应（包括SSE）立即发送响应头
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            if message.get("more_body"):
+                # 分块发送的响应不缓冲
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            await self._finish(start_message, message["body"], request_headers, conditional, encoding, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _eligible(self, start: Dict[str, Any]) -> bool:
+        headers = Headers(raw=start["headers"])
+        content_type = headers.get("content-type", "")
+        return (start["status"] == 200 and "content-encoding" not in headers
+                and content_type.startswith(CACHEABLE_TYPES))
+
+    async def _finish(self, start: Dict[str, Any], body: bytes, request_headers: Headers,
+                      conditional: bool, encoding: Optional[str], send):
+        headers = MutableHeaders(raw=list(start["headers"]))
+        etag = headers.get("etag")
+        if etag is None and conditional:
+            etag = '"' + hashlib.blake2b(body, digest_size=10).hexdigest() + '"'
+            headers["etag"] = etag
+
+        if etag is not None and conditional and etag_matches(request_headers.get("if-none-match"), etag):
+            kept = [(k, v) for k, v in headers.raw if k in (b"etag", b"cache-control", b"vary", b"set-cookie")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        large = len(body) >= self.config["min_size"]
+        if large:
+            headers.add_vary_header("Accept-Encoding")
+        if encoding is not None and large:
+            key = (etag, encoding) if etag is not None else None
+            compressed = self.cache.get(key) if key is not None else None
+            if compressed is None:
+                if len(body) >= THREAD_THRESHOLD:
+                    compressed = await asyncio.to_thread(self._compress, body, encoding)
+                else:
+                    compressed = self._compress(body, encoding)
+                if key is not None:
+                    self.cache.put(key, compressed)
+            body = compressed
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            if etag is not None and not etag.startswith("W/"):
+                headers["etag"] = "W/" + etag
+
+        await send({"type": "http.response.start", "status": start["status"], "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
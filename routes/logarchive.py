@@ -0,0 +1,455 @@
+# -- coding: utf-8 --
+"""日志归档：轮换出的日志按块压缩保存，每个归档附带摘要，查询时跳过不可能命中的归档和块
+
+归档文件由多个独立的gzip成员组成（可直接用zcat查看），每个成员是若干条完整日志。
+摘要记录时间范围、各级别和来源的条数以及内容的布隆过滤器，按块和整个文件各一份。
+"""
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from .utils import read_config
+from .logindex import LEVELS, get_log_dir, log_store, remove_index_files, LogStore
+from .logstream import parse_line
+from .logsearch import SearchQuery
+from .monitor import PeriodicTask
+
+logger = logging.getLogger("logarchive")
+
+ARCHIVE_SUFFIX = ".gz"
+SUMMARY_SUFFIX = ".summary.json"
+# 布隆过滤器：每个元素10位、7个哈希函数，误判率约1%
+BLOOM_BITS_PER_ITEM = 10
+BLOOM_HASHES = 7
+# 布隆过滤器中存放各词（按空白切分）的字符三元组，搜索词按同样方式切分后全部命中才可能匹配，
+# 与原有的子串搜索语义一致，中文同样适用
+GRAM = 3
+# 查询时缓存的已解压块数
+BLOCK_CACHE_ENTRIES = 8
+
+# 获取日志归档配置
+def get_archive_config() -> Dict[str, Any]:
+    """获取日志归档配置（logging.archive）"""
+    section = (read_config().get("logging", {}) or {}).get("archive", {}) or {}
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "block_size": int(section.get("block_kb", 256)) * 1024,
+        "level": int(section.get("level", 6)),
+        "max_total_mb": float(section.get("max_total_mb", 1024)),
+        "max_age_days": float(section.get("max_age_days", 90)),
+        "interval": float(section.get("interval", 60)),
+    }
+
+# 文本中各词的字符三元组，不足三个字符的词不计入
+def grams(text: str) -> Set[str]:
+    result: Set[str] = set()
+    for word in set(text.split()):
+        result.update(word[i:i + GRAM] for i in range(len(word) - GRAM + 1))
+    return result
+
+class BloomFilter:
+    """布隆过滤器，哈希用crc32/adler32双重哈希，跨进程结果稳定"""
+
+    def __init__(self, bits: bytearray, hashes: int = BLOOM_HASHES):
+        self.bits = bits
+        self.size = len(bits) * 8
+        self.hashes = hashes
+
+    @classmethod
+    def build(cls, items: Set[str]) -> "BloomFilter":
+        size = max(64, len(items) * BLOOM_BITS_PER_ITEM)
+        bloom = cls(bytearray((size + 7) // 8))
+        for item in items:
+            for position in bloom._positions(item):
+                bloom.bits[position >> 3] |= 1 << (position & 7)
+        return bloom
+
+    def _positions(self, item: str):
+        data = item.encode("utf-8")
+        h1 = zlib.crc32(data)
+        h2 = zlib.adler32(data) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def might_contain(self, items: Set[str]) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for item in items for p in self._positions(item))
+
+    def encode(self) -> str:
+        return base64.b64encode(bytes(self.bits)).decode("ascii")
+
+    @classmethod
+    def decode(cls, text: str) -> "BloomFilter":
+        return cls(bytearray(base64.b64decode(text)))
+
+# 将一块日志文本拆分为条目，续行（如堆栈）并入上一条
+def split_entries(data: bytes) -> List[Dict[str, Any]]:
+    entries: List[Dict[str, Any]] = []
+    for line in data.splitlines(keepends=True):
+        entry = parse_line(line)
+        if entry is not None:
+            entries.append(entry)
+        elif entries:
+            entries[-1]["message"] += "\n" + line.decode("utf-8", "replace").rstrip("\r\n")
+    return entries
+
+class _BlockWriter:
+    """把日志文件切成以完整条目为边界的块，逐块压缩写入并统计摘要"""
+
+    def __init__(self, out, block_size: int, level: int):
+        self.out = out
+        self.block_size = block_size
+        self.level = level
+        self.blocks: List[Dict[str, Any]] = []
+        self.sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self.grams: Set[str] = set()
+        self.offset = 0
+        self._lines: List[bytes] = []
+        self._entries: List[Dict[str, Any]] = []
+        self._raw_size = 0
+        self._skip = 0
+
+    def _source_id(self, name: str) -> int:
+        source_id = self._source_ids.get(name)
+        if source_id is None:
+            source_id = len(self.sources)
+            self.sources.append(name)
+            self._source_ids[name] = source_id
+        return source_id
+
+    def add_line(self, line: bytes):
+        entry = parse_line(line)
+        if entry is not None:
+            if self._raw_size >= self.block_size:
+                self.flush()
+            self._entries.append(entry)
+        elif self._entries:
+            self._entries[-1]["message"] += "\n" + line.decode("utf-8", "replace").rstrip("\r\n")
+        elif not self.blocks:
+            # 文件开头不属于任何条目的行
+            self._skip += len(line)
+        self._lines.append(line)
+        self._raw_size += len(line)
+
+    def flush(self):
+        if not self._lines:
+            return
+        raw = b"".join(self._lines)
+        entries = self._entries
+        counts: Dict[Tuple[int, int], int] = {}
+        for entry in entries:
+            key = (LEVELS.index(entry["type"]) if entry["type"] in LEVELS else 1, self._source_id(entry["source"]))
+            counts[key] = counts.get(key, 0) + 1
+        block_grams = grams("\n".join(entry["message"] for entry in entries).lower())
+        self.grams.update(block_grams)
+        compressed = gzip.compress(raw, compresslevel=self.level, mtime=0)
+        self.out.write(compressed)
+        timestamps = [entry["timestamp"] for entry in entries]
+        self.blocks.append({
+            "offset": self.offset,
+            "length": len(compressed),
+            "raw_size": len(raw),
+            "skip": self._skip,
+            "count": len(entries),
+            "start": min(timestamps) if timestamps else None,
+            "end": max(timestamps) if timestamps else None,
+            "counts": [[level, source, n] for (level, source), n in sorted(counts.items())],
+            "bloom": BloomFilter.build(block_grams).encode(),
+        })
+        self.offset += len(compressed)
+        self._lines = []
+        self._entries = []
+        self._raw_size = 0
+        self._skip = 0
+
+    def summary(self, name: str) -> Dict[str, Any]:
+        levels: Dict[str, int] = {}
+        sources: Dict[str, int] = {}
+        for block in self.blocks:
+            for level, source, n in block["counts"]:
+                levels[LEVELS[level]] = levels.get(LEVELS[level], 0) + n
+                sources[self.sources[source]] = sources.get(self.sources[source], 0) + n
+        starts = [b["start"] for b in self.blocks if b["start"] is not None]
+        ends = [b["end"] for b in self.blocks if b["end"] is not None]
+        return {
+            "name": name,
+            "start": min(starts) if starts else None,
+            "end": max(ends) if ends else None,
+            "count": sum(b["count"] for b in self.blocks),
+            "raw_size": sum(b["raw_size"] for b in self.blocks),
+            "size": self.offset,
+            "levels": levels,
+            "source_counts": sources,
+            "sources": self.sources,
+            "bloom": BloomFilter.build(self.grams).encode(),
+            "blocks": self.blocks,
+        }
+
+class ArchiveSegment:
+    """一个归档文件及其摘要"""
+
+    def __init__(self, path: str, summary: Dict[str, Any], mtime: float):
+        self.path = path
+        self.summary = summary
+        self.mtime = mtime
+        self.bloom = BloomFilter.decode(summary["bloom"])
+        self.block_blooms = [BloomFilter.decode(block["bloom"]) for block in summary["blocks"]]
+        self._source_ids = {name: i for i, name in enumerate(summary["sources"])}
+
+    def find_source(self, name: str) -> Optional[int]:
+        return self._source_ids.get(name)
+
+    def read_block(self, i: int) -> List[Dict[str, Any]]:
+        block = self.summary["blocks"][i]
+        with open(self.path, "rb") as f:
+            f.seek(block["offset"])
+            raw = gzip.decompress(f.read(block["length"]))
+        return split_entries(raw[block["skip"]:])
+
+class _BlockPart:
+    """查询结果中的一个归档块，能只凭摘要计数时不解压"""
+
+    def __init__(self, archive: "LogArchive", segment: ArchiveSegment, index: int,
+                 count: Optional[int], match):
+        self.archive = archive
+        self.segment = segment
+        self.index = index
+        self._count = count
+        self._match = match
+        self._entries: Optional[List[Dict[str, Any]]] = None
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self._entries is None:
+            entries = self.archive.block_entries(self.segment, self.index)
+            self._entries = [entry for entry in reversed(entries) if self._match(entry)]
+        return self._entries
+
+    @property
+    def count(self) -> int:
+        if self._count is None:
+            self._count = len(self._load())
+        return self._count
+
+    def take(self, start: int, n: int) -> List[Dict[str, Any]]:
+        return [dict(entry) for entry in self._load()[start:start + n]]
+
+class LogArchive:
+    """data/logs/archive下的归档：压缩轮换日志、按大小和时间清理、为日志查询提供归档中的条目"""
+
+    def __init__(self, log_dir: Optional[str] = None, base_name: str = "app.log"):
+        self.log_dir = log_dir or get_log_dir()
+        self.base_name = base_name
+        self.archive_dir = os.path.join(self.log_dir, "archive")
+        self.rotated_re = re.compile(re.escape(base_name) + r"\.\d{4}-\d{2}-\d{2}(_\d{2}-\d{2}(-\d{2})?)?$")
+        self.config = get_archive_config()
+        self._segments: Dict[str, ArchiveSegment] = {}
+        self._blocks: "OrderedDict[Tuple[str, int], List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, config: Dict[str, Any]):
+        self.config = config
+
+    def archived_names(self) -> Set[str]:
+        """已归档的原日志文件名"""
+        try:
+            names = os.listdir(self.archive_dir)
+        except FileNotFoundError:
+            return set()
+        return {n[:-len(ARCHIVE_SUFFIX)] for n in names if n.endswith(ARCHIVE_SUFFIX)}
+
+    def pending(self) -> List[str]:
+        """等待归档的轮换日志"""
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(os.path.join(self.log_dir, n) for n in names if self.rotated_re.match(n))
+
+    def compress(self, path: str) -> Dict[str, Any]:
+        """把一个轮换日志压缩为归档并写入摘要，完成后删除原文件"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        name = os.path.basename(path)
+        target = os.path.join(self.archive_dir, name + ARCHIVE_SUFFIX)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as out:
+            writer = _BlockWriter(out, self.config["block_size"], self.config["level"])
+            for line in src:
+                writer.add_line(line)
+            writer.flush()
+            out.flush()
+            os.fsync(out.fileno())
+        summary = writer.summary(name)
+        summary_tmp = f"{target}{SUMMARY_SUFFIX}.{os.getpid()}.tmp"
+        with open(summary_tmp, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, separators=(",", ":"))
+        # 先写摘要再放置归档，归档存在即表示完整
+        os.replace(summary_tmp, target + SUMMARY_SUFFIX)
+        os.replace(tmp_path, target)
+        # 原文件的索引不再需要，归档有自己的摘要
+        signature = LogStore._signature(path)
+        os.remove(path)
+        if signature:
+            remove_index_files(os.path.join(self.log_dir, ".index"), signature)
+        return summary
+
+    def _remove(self, name: str):
+        for suffix in (ARCHIVE_SUFFIX, ARCHIVE_SUFFIX + SUMMARY_SUFFIX):
+            try:
+                os.remove(os.path.join(self.archive_dir, name + suffix))
+            except OSError:
+                pass
+
+    def enforce_retention(self) -> List[str]:
+        """按保留天数和总大小删除最旧的归档，返回删除的文件名"""
+        removed = []
+        cutoff = time.time() - self.config["max_age_days"] * 86400
+        entries = []
+        for segment in self.segments():
+            summary = segment.summary
+            # 按归档中最新一条日志的时间计算保留天数
+            newest = summary["end"] if summary["end"] is not None else segment.mtime
+            entries.append((summary["name"], summary["size"], newest))
+        total = sum(size for _, size, _ in entries)
+        limit = self.config["max_total_mb"] * 1024 * 1024
+        for name, size, newest in entries:
+            if newest >= cutoff and total <= limit:
+                break
+            self._remove(name)
+            total -= size
+            removed.append(name)
+        return removed
+
+    def run_once(self) -> Dict[str, Any]:
+        """归档所有轮换日志并执行保留策略"""
+        archived = []
+        for path in self.pending():
+            try:
+                summary = self.compress(path)
+                archived.append(summary["name"])
+                logger.info(f"已归档日志{summary['name']}: {summary['raw_size']}字节压缩为{summary['size']}字节")
+            except Exception as e:
+                logger.error(f"归档日志{os.path.basename(path)}失败: {str(e)}")
+        removed = self.enforce_retention()
+        if removed:
+            logger.info(f"按保留策略删除了归档: {', '.join(removed)}")
+        return {"archived": archived, "removed": removed}
+
+    def segments(self) -> List[ArchiveSegment]:
+        """按时间从旧到新排列的归档，摘要按文件修改时间缓存"""
+        current = []
+        for name in sorted(self.archived_names()):
+            path = os.path.join(self.archive_dir, name + ARCHIVE_SUFFIX)
+            try:
+                mtime = os.path.getmtime(path)
+                segment = self._segments.get(name)
+                if segment is None or segment.mtime != mtime:
+                    with open(path + SUMMARY_SUFFIX, "r", encoding="utf-8") as f:
+                        segment = ArchiveSegment(path, json.load(f), mtime)
+                    self._segments[name] = segment
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"读取归档摘要{name}失败: {str(e)}")
+                continue
+            current.append(segment)
+        alive = {os.path.basename(s.path)[:-len(ARCHIVE_SUFFIX)] for s in current}
+        for name in [n for n in self._segments if n not in alive]:
+            del self._segments[name]
+        return current
+
+    def block_entries(self, segment: ArchiveSegment, i: int) -> List[Dict[str, Any]]:
+        """解压一个块，最近用过的块保留在内存中"""
+        key = (segment.path, i, segment.mtime)
+        with self._lock:
+            entries = self._blocks.get(key)
+            if entries is not None:
+                self._blocks.move_to_end(key)
+                return entries
+        entries = segment.read_block(i)
+        with self._lock:
+            self._blocks[key] = entries
+            while len(self._blocks) > BLOCK_CACHE_ENTRIES:
+                self._blocks.popitem(last=False)
+        return entries
+
+    def parts(self, level_codes: Optional[Set[int]], source: Optional[str], start: Optional[float],
+              end: Optional[float], query: Optional[SearchQuery]) -> List[_BlockPart]:
+        """按查询条件筛选出可能命中的块，从新到旧排列"""
+        needle_grams: Set[str] = set()
+        if query is not None:
+            for word in query.words():
+                needle_grams |= grams(word)
+
+        def match(entry):
+            return ((level_codes is None or (LEVELS.index(entry["type"]) if entry["type"] in LEVELS else 1) in level_codes)
+                    and (source is None or entry["source"] == source)
+                    and (start is None or entry["timestamp"] >= start)
+                    and (end is None or entry["timestamp"] < end)
+                    and (query is None or query.match(entry["message"])))
+
+        parts: List[_BlockPart] = []
+        for segment in reversed(self.segments()):
+            summary = segment.summary
+            if summary["start"] is None:
+                continue
+            if (end is not None and summary["start"] >= end) or (start is not None and summary["end"] < start):
+                continue
+            source_id = segment.find_source(source) if source else None
+            if source and source_id is None:
+                continue
+            if needle_grams and not segment.bloom.might_contain(needle_grams):
+                continue
+            for i in range(len(summary["blocks"]) - 1, -1, -1):
+                block = summary["blocks"][i]
+                if block["start"] is None:
+                    continue
+                if (end is not None and block["start"] >= end) or (start is not None and block["end"] < start):
+                    continue
+                count = sum(n for level, sid, n in block["counts"]
+                            if (level_codes is None or level in level_codes)
+                            and (source_id is None or sid == source_id))
+                if count == 0:
+                    continue
+                if needle_grams and not segment.block_blooms[i].might_contain(needle_grams):
+                    continue
+                inside = ((start is None or block["start"] >= start) and (end is None or block["end"] < end))
+                # 整块都在时间范围内且不需要搜索内容时，摘要中的计数就是命中数
+                exact = count if inside and query is None else None
+                parts.append(_BlockPart(self, segment, i, exact, match))
+        return parts
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        """各归档的摘要（不含布隆过滤器和块信息），从新到旧"""
+        result = []
+        for segment in reversed(self.segments()):
+            summary = segment.summary
+            result.append({key: summary[key] for key in
+                           ("name", "start", "end", "count", "raw_size", "size", "levels", "source_counts")})
+            result[-1]["blocks"] = len(summary["blocks"])
+        return result
+
+class ArchiveTask(PeriodicTask):
+    """定期归档轮换出的日志"""
+
+    name = "日志归档"
+
+    def __init__(self, archive: LogArchive):
+        super().__init__(archive.config["interval"])
+        self.archive = archive
+
+    def prime(self):
+        self.tick()
+
+    def tick(self):
+        self.archive.run_once()
+
+# 全局日志归档，日志查询同时检索归档
+log_archive = LogArchive()
+log_store.archive = log_archive
+archive_task = ArchiveTask(log_archive)
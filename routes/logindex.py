@@ -0,0 +1,492 @@
+# -- coding: utf-8 --
+import os
+import re
+import json
+import time
+import struct
+import bisect
+import hashlib
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from operator import le, sub
+from itertools import accumulate, islice
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .utils import get_data_dir
+from .logsearch import SearchQuery, TermIndex
+
+logger = logging.getLogger("logindex")
+
+# 与setup_logging中的格式对应: '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LINE_RE = re.compile(
+    rb"^(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2}),(\d{3}) - (.*?) - "
+    rb"(DEBUG|INFO|WARNING|ERROR|CRITICAL) - "
+)
+
+LEVELS = ["debug", "info", "warning", "error", "critical"]
+LEVEL_CODES = {name.upper().encode(): code for code, name in enumerate(LEVELS)}
+
+# 解析JSON格式的日志行（logging.format为json时），返回(时间戳, 级别, 来源, 内容)，不是JSON日志时返回None
+def parse_json_record(line: bytes) -> Optional[Tuple[float, str, str, str]]:
+    if not line.startswith(b"{"):
+        return None
+    try:
+        data = json.loads(line)
+        return float(data["ts"]), str(data["level"]).lower(), str(data["source"]), str(data["msg"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# 索引记录: 行偏移, 时间戳, 级别, 来源编号
+RECORD = struct.Struct("<qdbH")
+# 文件签名取首行的前若干字节，日志轮换（重命名）后索引仍可复用
+SIGNATURE_BYTES = 256
+# 由文件开头计算签名：通常取首行；首行超过SIGNATURE_BYTES时取整个开头，
+# 开头还不完整（首行尚未写完）时返回空，等写完后再处理
+def file_signature(head: bytes) -> bytes:
+    newline = head.find(b"\n")
+    if newline >= 0:
+        return head[:newline + 1]
+    return head if len(head) >= SIGNATURE_BYTES else b""
+
+# 每次增量索引读取的块大小
+READ_CHUNK = 1024 * 1024
+# 补齐倒排索引时每批读取的条目数
+READ_BATCH = 10000
+
+# 获取日志目录
+def get_log_dir() -> str:
+    return os.path.join(get_data_dir(), "logs")
+
+class FileIndex:
+    """单个日志文件的索引：每条日志的起始偏移、时间戳、级别和来源，以及内容的倒排索引"""
+
+    def __init__(self, path: str, index_dir: str, signature: bytes):
+        self.path = path
+        self.signature = signature
+        key = hashlib.sha1(signature).hexdigest()
+        self.record_path = os.path.join(index_dir, f"{key}.idx")
+        self.meta_path = os.path.join(index_dir, f"{key}.json")
+        self.terms_path = os.path.join(index_dir, f"{key}.terms")
+        self.lock_path = os.path.join(index_dir, f"{key}.lock")
+        self._ts_cache: Tuple[bytes, float] = (b"", 0.0)
+        self.terms = TermIndex(self.terms_path)
+        self.reset()
+        with self._file_lock():
+            self._load()
+            self._sync_terms()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def reset(self):
+        """清空内存中的索引"""
+        self.offsets = array("q")
+        self.timestamps = array("d")
+        # 时间戳的前缀最大值（单调不减，用于二分）和时间戳比之前最大值回退的最大量
+        self.peaks = array("d")
+        self.skew = 0.0
+        self.levels = array("b")
+        self.sources = array("H")
+        self.source_names: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self.size = 0
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写锁，多个worker更新同一个索引时串行执行"""
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _load(self, file_size: Optional[int] = None) -> bool:
+        """从磁盘加载已持久化、但内存中还没有的记录（可能由其他worker写入），返回是否加载了新记录
+
+        file_size为日志文件当前大小，持久化的索引超出该大小时说明是截断之前的旧索引，不加载。
+        """
+        start = len(self.offsets)
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            count = meta["count"]
+            if count <= start or (file_size is not None and meta["size"] > file_size):
+                return False
+            with open(self.record_path, "rb") as f:
+                f.seek(start * RECORD.size)
+                data = f.read((count - start) * RECORD.size)
+            if len(data) != (count - start) * RECORD.size:
+                raise ValueError("索引记录不完整")
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"日志索引损坏，将重建: {str(e)}")
+            return False
+        for offset, ts, level, source in RECORD.iter_unpack(data):
+            self.offsets.append(offset)
+            self.timestamps.append(ts)
+            self.levels.append(level)
+            self.sources.append(source)
+        timestamps = self.timestamps[start:]
+        if all(map(le, timestamps, islice(timestamps, 1, None))) and (not self.peaks or self.peaks[-1] <= timestamps[0]):
+            # 通常是单进程写入，时间戳已经递增，前缀最大值就是时间戳本身
+            self.peaks.extend(timestamps)
+        else:
+            previous = self.peaks[-1] if self.peaks else timestamps[0]
+            peaks = array("d", accumulate(timestamps, max, initial=previous))[1:]
+            self.peaks.extend(peaks)
+            self.skew = max(self.skew, max(map(sub, peaks, timestamps)))
+        self.source_names = meta["sources"]
+        self._source_ids = {name: i for i, name in enumerate(self.source_names)}
+        self.size = meta["size"]
+        return True
+
+    def _save(self, start: int):
+        """追加新增记录并原子地更新元数据"""
+        mode = "r+b" if start and os.path.exists(self.record_path) else "wb"
+        with open(self.record_path, mode) as f:
+            f.seek(start * RECORD.size)
+            f.write(b"".join(
+                RECORD.pack(self.offsets[i], self.timestamps[i], self.levels[i], self.sources[i])
+                for i in range(start, len(self.offsets))
+            ))
+            f.truncate()
+        self.terms.flush()
+        meta = {"path": os.path.basename(self.path), "size": self.size,
+                "count": len(self.offsets), "sources": self.source_names}
+        # 多个worker可能同时更新同一个索引，临时文件名按进程区分
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _sync_terms(self):
+        """倒排索引落后于条目索引时（如旧版本建立的索引）补齐"""
+        start = self.terms.count
+        if start >= len(self.offsets):
+            return
+        with open(self.path, "rb") as f:
+            for i in range(start, len(self.offsets), READ_BATCH):
+                indices = list(range(i, min(i + READ_BATCH, len(self.offsets))))
+                for entry_id, entry in zip(indices, self.read_entries(f, indices)):
+                    self.terms.add(entry_id, entry["message"], self.levels[entry_id], self.sources[entry_id])
+                self.terms.flush()
+
+    def _timestamp(self, match) -> float:
+        prefix = match.group(0)[:19]
+        cached_prefix, cached_ts = self._ts_cache
+        if prefix != cached_prefix:
+            y, mo, d, h, mi, s = (int(match.group(i)) for i in range(1, 7))
+            cached_ts = time.mktime((y, mo, d, h, mi, s, 0, 0, -1))
+            self._ts_cache = (prefix, cached_ts)
+        return cached_ts + int(match.group(7)) / 1000
+
+    def _add_timestamp(self, ts: float):
+        # 多个worker追加同一个文件时，后写入的条目时间戳可能略早于前一条
+        peak = self.peaks[-1] if self.peaks and self.peaks[-1] > ts else ts
+        self.timestamps.append(ts)
+        self.peaks.append(peak)
+        if peak - ts > self.skew:
+            self.skew = peak - ts
+
+    def find_source(self, name: str) -> Optional[int]:
+        """查找来源编号，文件中没有该来源时返回None"""
+        return self._source_ids.get(name)
+
+    def _source_id(self, name: str) -> int:
+        source_id = self._source_ids.get(name)
+        if source_id is None:
+            source_id = len(self.source_names)
+            self.source_names.append(name)
+            self._source_ids[name] = source_id
+        return source_id
+
+    def sync(self, file_size: int):
+        """在索引文件锁内同步到日志文件的当前大小
+
+        先加载其他worker已写入的记录，再由当前进程索引剩余部分，保证索引文件只被顺序追加。
+        """
+        if file_size == self.size:
+            return
+        with self._file_lock():
+            truncated = file_size < self.size
+            if truncated:
+                self.reset()
+            # 未截断时其他worker可能已经索引到比file_size（调用前取得）更新的位置
+            if self._load(file_size if truncated else None):
+                self.terms.resync()
+                self._sync_terms()
+            elif truncated:
+                # 文件被截断且还没有其他worker重建过索引，由当前进程重建
+                self.terms.reset()
+            self.update(file_size)
+
+    def update(self, file_size: int) -> int:
+        """增量索引文件新增的完整行，返回新增条目数（调用方需持有索引文件锁）"""
+        if file_size <= self.size:
+            return 0
+        start = len(self.offsets)
+        old_size = self.size
+        with open(self.path, "rb") as f:
+            f.seek(self.size)
+            pos = self.size
+            pending = b""
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                chunk = pending + chunk
+                end = chunk.rfind(b"\n") + 1
+                pending = chunk[end:]
+                for line in chunk[:end].splitlines(keepends=True):
+                    record = parse_json_record(line)
+                    if record is not None:
+                        self.offsets.append(pos)
+                        self._add_timestamp(record[0])
+                        self.levels.append(LEVELS.index(record[1]) if record[1] in LEVELS else 1)
+                        self.sources.append(self._source_id(record[2]))
+                        self.terms.add(len(self.offsets) - 1, record[3], self.levels[-1], self.sources[-1])
+                        pos += len(line)
+                        continue
+                    match = LOG_LINE_RE.match(line)
+                    if match:
+                        self.offsets.append(pos)
+                        self._add_timestamp(self._timestamp(match))
+                        self.levels.append(LEVEL_CODES[match.group(9)])
+                        self.sources.append(self._source_id(match.group(8).decode("utf-8", "replace")))
+                        self.terms.add(len(self.offsets) - 1, line[match.end():].decode("utf-8", "replace"),
+                                       self.levels[-1], self.sources[-1])
+                    elif self.offsets:
+                        # 续行（如堆栈）属于上一条日志
+                        self.terms.add(len(self.offsets) - 1, line.decode("utf-8", "replace"))
+                    pos += len(line)
+            self.size = pos
+        if self.size != old_size:
+            self._save(start)
+        return len(self.offsets) - start
+
+    def entry_end(self, i: int) -> int:
+        return self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+
+    def read_entries(self, f, indices: List[int]) -> List[Dict[str, Any]]:
+        """按偏移读取指定条目"""
+        entries = []
+        for i in indices:
+            f.seek(self.offsets[i])
+            raw = f.read(self.entry_end(i) - self.offsets[i])
+            entries.append(self.parse_entry(raw, i))
+        return entries
+
+    def parse_entry(self, raw: bytes, i: int) -> Dict[str, Any]:
+        record = parse_json_record(raw)
+        if record is not None:
+            message = record[3]
+        else:
+            text = raw.decode("utf-8", "replace").rstrip("\r\n")
+            match = LOG_LINE_RE.match(raw)
+            message = text[len(match.group(0).decode("utf-8", "replace")):] if match else text
+        return {
+            "timestamp": self.timestamps[i],
+            "type": LEVELS[self.levels[i]],
+            "source": self.source_names[self.sources[i]],
+            "message": message,
+        }
+
+    def time_range(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        """二分查找时间范围内的条目下标区间[lo, hi)，区间之外的条目都不在范围内
+
+        时间戳不严格递增，因此在前缀最大值上二分，上界按最大回退量放宽；
+        回退量不为0时区间两端可能混有范围外的条目，由exact_range和within处理。
+        """
+        lo = 0 if start is None else bisect.bisect_left(self.peaks, start)
+        hi = len(self.peaks) if end is None else bisect.bisect_left(self.peaks, end + self.skew)
+        return lo, max(lo, hi)
+
+    def exact_range(self, start: Optional[float], end: Optional[float], lo: int, hi: int) -> Tuple[int, int]:
+        """[lo, hi)中确定全部在时间范围内的子区间，其余部分需要逐条检查时间戳"""
+        if not self.skew:
+            return lo, hi
+        inner_lo = lo if start is None else max(lo, bisect.bisect_left(self.peaks, start + self.skew))
+        inner_hi = hi if end is None else min(hi, bisect.bisect_left(self.peaks, end))
+        return inner_lo, max(inner_lo, inner_hi)
+
+    def within(self, indices, start: Optional[float], end: Optional[float]) -> List[int]:
+        """逐条检查时间戳，保留范围内的条目"""
+        timestamps = self.timestamps
+        return [i for i in indices
+                if (start is None or timestamps[i] >= start) and (end is None or timestamps[i] < end)]
+
+# 删除一个日志文件的全部索引文件（条目索引、元数据和倒排索引）
+def remove_index_files(index_dir: str, signature: bytes):
+    key = hashlib.sha1(signature).hexdigest()
+    for suffix in (".idx", ".json", ".lock", ".terms", ".terms-wal", ".terms-shm"):
+        try:
+            os.remove(os.path.join(index_dir, key + suffix))
+        except OSError:
+            pass
+
+class LogStore:
+    """data/logs下所有日志文件（含轮换文件）的查询入口"""
+
+    def __init__(self, log_dir: Optional[str] = None, base_name: str = "app.log"):
+        self.log_dir = log_dir or get_log_dir()
+        self.base_name = base_name
+        self.index_dir = os.path.join(self.log_dir, ".index")
+        self._indexes: Dict[bytes, FileIndex] = {}
+        self._lock = threading.Lock()
+        # 已压缩归档的轮换日志（见logarchive），查询时在未归档的文件之后检索
+        self.archive = None
+
+    def _log_files(self) -> List[str]:
+        """按时间从旧到新排列的日志文件，轮换文件后缀为日期"""
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        archived = self.archive.archived_names() if self.archive is not None else set()
+        rotated = sorted(n for n in names if n.startswith(self.base_name + ".") and n not in archived)
+        files = [os.path.join(self.log_dir, n) for n in rotated]
+        if self.base_name in names:
+            files.append(os.path.join(self.log_dir, self.base_name))
+        return files
+
+    @staticmethod
+    def _signature(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return file_signature(f.read(SIGNATURE_BYTES))
+
+    def refresh(self) -> List[FileIndex]:
+        """同步所有日志文件的索引，只处理新增的部分"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        current: List[FileIndex] = []
+        for path in self._log_files():
+            try:
+                size = os.path.getsize(path)
+                signature = self._signature(path)
+            except OSError:
+                continue
+            if not signature:
+                continue
+            index = self._indexes.get(signature)
+            if index is None:
+                index = FileIndex(path, self.index_dir, signature)
+                self._indexes[signature] = index
+            index.path = path
+            index.sync(size)
+            current.append(index)
+
+        # 清理已删除文件的索引
+        alive = {index.signature for index in current}
+        for signature in [s for s in self._indexes if s not in alive]:
+            stale = self._indexes.pop(signature)
+            stale.terms.close()
+            remove_index_files(self.index_dir, signature)
+        return current
+
+    def query(self, page: int = 1, page_size: int = 20, levels: Optional[List[str]] = None,
+              source: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+              search: Optional[str] = None) -> Dict[str, Any]:
+        """按条件分页查询日志，结果按时间倒序"""
+        with self._lock:
+            indexes = self.refresh()
+            level_codes = {LEVELS.index(l) for l in levels if l in LEVELS} if levels else None
+            query = SearchQuery.parse(search)
+
+            def select(index: FileIndex, lo: int, hi: int, source_id: Optional[int], exact: bool):
+                """[lo, hi)中满足条件的条目（从新到旧），有搜索词时先由倒排索引缩小范围"""
+                matched = index.terms.matches(query, lo, hi, level_codes, source_id) if query is not None else None
+                if matched is None:
+                    if level_codes is None and source_id is None:
+                        matched = range(hi - 1, lo - 1, -1)
+                    else:
+                        levels_arr, sources_arr = index.levels, index.sources
+                        matched = [i for i in range(hi - 1, lo - 1, -1)
+                                   if (level_codes is None or levels_arr[i] in level_codes)
+                                   and (source_id is None or sources_arr[i] == source_id)]
+                return matched if exact else index.within(matched, start, end)
+
+            # 从新到旧收集每个文件中满足条件的条目
+            segments = []
+            for index in reversed(indexes):
+                lo, hi = index.time_range(start, end)
+                if lo >= hi:
+                    continue
+                source_id = index.find_source(source) if source else None
+                if source and source_id is None:
+                    continue
+                # 时间戳有回退时，区间两端的条目逐条确认时间，中间部分直接使用
+                inner_lo, inner_hi = index.exact_range(start, end, lo, hi)
+                for part_lo, part_hi, exact in ((inner_hi, hi, False), (inner_lo, inner_hi, True), (lo, inner_lo, False)):
+                    if part_lo < part_hi:
+                        segments.append((index, select(index, part_lo, part_hi, source_id, exact)))
+
+            skip = (page - 1) * page_size
+            logs: List[Dict[str, Any]] = []
+            total = 0
+            if query is None or not query.verify:
+                # 只依赖索引即可计数和定位页面，直接按偏移读取本页条目
+                for index, matched in segments:
+                    n = len(matched)
+                    if skip < total + n and len(logs) < page_size:
+                        local = skip - total if skip > total else 0
+                        take = matched[local:local + page_size - len(logs)]
+                        with open(index.path, "rb") as f:
+                            logs.extend(index.read_entries(f, list(take)))
+                    total += n
+            else:
+                # 短语和无法走索引的词需要读取候选条目确认
+                for index, matched in segments:
+                    with open(index.path, "rb") as f:
+                        for entry in index.read_entries(f, matched):
+                            if not query.match(entry["message"]):
+                                continue
+                            if skip <= total < skip + page_size:
+                                logs.append(entry)
+                            total += 1
+
+            # 归档中的日志比所有未归档的文件都旧，只解压本页需要或无法凭摘要计数的块
+            if self.archive is not None:
+                for part in self.archive.parts(level_codes, source, start, end, query):
+                    n = part.count
+                    if skip < total + n and len(logs) < page_size:
+                        local = skip - total if skip > total else 0
+                        logs.extend(part.take(local, page_size - len(logs)))
+                    total += n
+
+        return {
+            "logs": logs,
+            "pagination": {
+                "current_page": page,
+                "total_pages": max(1, (total + page_size - 1) // page_size),
+                "total_items": total,
+                "page_size": page_size,
+            },
+        }
+
+# 将日期范围参数转换为时间戳区间
+def resolve_date_range(date_range: str, start_date: Optional[str] = None,
+                       end_date: Optional[str] = None) -> Tuple[Optional[float], Optional[float]]:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if date_range == "today":
+        return today.timestamp(), None
+    if date_range == "yesterday":
+        return (today - timedelta(days=1)).timestamp(), today.timestamp()
+    if date_range == "week":
+        return (today - timedelta(days=today.weekday())).timestamp(), None
+    if date_range == "month":
+        return today.replace(day=1).timestamp(), None
+    if date_range == "custom":
+        start = datetime.strptime(start_date, "%Y-%m-%d").timestamp() if start_date else None
+        end = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).timestamp() if end_date else None
+        return start, end
+    return None, None
+
+# 全局日志存储
+log_store = LogStore()
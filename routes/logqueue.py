@@ -0,0 +1,144 @@
+# -- coding: utf-8 --
+"""日志队列：业务代码只把日志记录放入有界队列，由后台线程批量写入控制台和文件
+
+事件循环中的logger调用不再直接做磁盘I/O，按日期轮换也在后台线程中进行。
+"""
+import json
+import queue
+import logging
+import logging.handlers
+import threading
+from typing import Any, Dict, List, Optional
+
+# 队列满时的处理方式
+DROP = "drop"
+BLOCK = "block"
+
+_STOP = object()
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行JSON: {"ts", "level", "source", "msg"}，堆栈等多行内容也在同一行内"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        if record.stack_info:
+            message += "\n" + self.formatStack(record.stack_info)
+        return json.dumps({"ts": round(record.created, 3), "level": record.levelname,
+                           "source": record.name, "msg": message}, ensure_ascii=False)
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列，队列满时按策略丢弃或阻塞等待"""
+
+    def __init__(self, log_queue: "queue.Queue", policy: str = DROP):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.policy == BLOCK:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# 把一批日志写入处理器：格式化后一次写入、一次flush
+def write_batch(handler: logging.Handler, records: List[logging.LogRecord]):
+    if not isinstance(handler, logging.StreamHandler):
+        for record in records:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return
+
+    rotating = isinstance(handler, logging.handlers.BaseRotatingHandler)
+    handler.acquire()
+    try:
+        if isinstance(handler, logging.handlers.WatchedFileHandler):
+            handler.reopenIfNeeded()
+        if isinstance(handler, logging.FileHandler) and handler.stream is None:
+            handler.stream = handler._open()
+        lines: List[str] = []
+        for record in records:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                if rotating and handler.shouldRollover(record):
+                    # 轮换前先写完属于旧文件的部分
+                    handler.stream.write("".join(lines))
+                    lines = []
+                    handler.doRollover()
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        if lines:
+            handler.stream.write("".join(lines))
+        handler.flush()
+    except Exception:
+        handler.handleError(records[-1])
+    finally:
+        handler.release()
+
+class BatchingQueueListener:
+    """后台线程：取出队列中已有的全部记录（最多batch_size条），批量交给各处理器"""
+
+    def __init__(self, log_queue: "queue.Queue", handlers: List[logging.Handler],
+                 source: BoundedQueueHandler, batch_size: int = 512):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.source = source
+        self.batch_size = batch_size
+        self._reported = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _dropped_record(self) -> Optional[logging.LogRecord]:
+        dropped = self.source.dropped - self._reported
+        if dropped <= 0:
+            return None
+        self._reported += dropped
+        return logging.LogRecord("logging", logging.WARNING, __file__, 0,
+                                 f"日志队列已满，丢弃了{dropped}条日志", None, None)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            notice = self._dropped_record()
+            if notice is not None:
+                batch.append(notice)
+            for handler in self.handlers:
+                write_batch(handler, batch)
+
+    def stop(self, timeout: float = 5.0):
+        """写完队列中剩余的日志后退出"""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self.queue.qsize(), "capacity": self.queue.maxsize, "dropped": self.source.dropped}
@@ -0,0 +1,256 @@
+# -- coding: utf-8 --
+"""日志全文检索：分词、查询解析和增量倒排索引
+
+分词规则：英文、数字等按单词切分并转为小写；中日韩文字按相邻两字切分（如"处理消息"切分为
+"处理""理消""消息"），单独出现的一个汉字不建索引。
+查询中空白分隔的各词须同时出现（AND），每个词（或双引号括起的短语）的词元须连续出现。
+倒排索引使用SQLite FTS5（无内容表），写入的是分好的词元，短语匹配由FTS5按位置完成。
+"""
+import os
+import re
+import sqlite3
+import logging
+import threading
+from typing import List, Optional, Set, Tuple
+
+logger = logging.getLogger("logsearch")
+
+# 中日韩文字（汉字、假名、谚文）
+CJK_RANGES = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿"
+TOKEN_RE = re.compile(rf"[^\W{CJK_RANGES}]+|[{CJK_RANGES}]+")
+CJK_RE = re.compile(rf"[{CJK_RANGES}]")
+QUERY_RE = re.compile(r'"([^"]*)"?|(\S+)')
+# 词元之间的分隔符，用于判断短语中的词元是否连续出现
+SEP = "\x00"
+# 过长的词（如编码后的数据）只保留前若干字符
+MAX_TOKEN = 64
+
+# 将文本切分为词元
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if CJK_RE.match(word):
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word[:MAX_TOKEN])
+    return tokens
+
+class SearchTerm:
+    """查询中的一个词或短语"""
+
+    def __init__(self, text: str):
+        self.text = text.lower()
+        self.tokens = tokenize(text)
+        # 没有可索引词元或含有单独汉字的词（如"我"），退化为子串匹配
+        self.scan = not self.tokens or any(len(word) == 1 and CJK_RE.match(word)
+                                           for word in TOKEN_RE.findall(self.text))
+        self.pattern = SEP + SEP.join(self.tokens) + SEP
+
+class SearchQuery:
+    """解析后的搜索条件"""
+
+    def __init__(self, terms: List[SearchTerm]):
+        self.terms = terms
+        self.indexed = [term for term in terms if not term.scan]
+        # 子串匹配的词无法走索引，需要读取日志内容确认
+        self.verify = any(term.scan for term in terms)
+
+    @classmethod
+    def parse(cls, search: Optional[str]) -> Optional["SearchQuery"]:
+        """解析搜索字符串，没有有效内容时返回None"""
+        if not search:
+            return None
+        terms = []
+        for phrase, word in QUERY_RE.findall(search):
+            text = (phrase or word).strip()
+            if text:
+                terms.append(SearchTerm(text))
+        return cls(terms) if terms else None
+
+    def expression(self) -> Optional[str]:
+        """FTS5查询表达式：每个词作为一个短语，多个短语之间为AND"""
+        if not self.indexed:
+            return None
+        return " ".join('"' + " ".join(term.tokens) + '"' for term in self.indexed)
+
+    def words(self) -> List[str]:
+        """匹配的日志中一定包含的片段（各单词、连续的汉字和子串匹配的词），用于归档的布隆过滤器"""
+        words = []
+        for term in self.terms:
+            if term.scan:
+                words.append(term.text)
+            else:
+                words.extend(word[:MAX_TOKEN] for word in TOKEN_RE.findall(term.text))
+        return words
+
+    def match(self, message: str) -> bool:
+        lowered = message.lower()
+        joined = None
+        for term in self.terms:
+            if term.scan:
+                if term.text not in lowered:
+                    return False
+                continue
+            if joined is None:
+                joined = SEP + SEP.join(tokenize(lowered)) + SEP
+            if term.pattern not in joined:
+                return False
+        return True
+
+# 写入索引的级别和来源词元，级别、来源过滤与搜索词一起由FTS5完成
+LEVEL_TOKEN = "fflevel{}"
+SOURCE_TOKEN = "ffsource{}"
+
+class Matches:
+    """倒排索引的查询结果（按条目编号从新到旧），计数和分页都在SQLite中完成，不取出全部编号"""
+
+    def __init__(self, index: "TermIndex", expression: str, lo: int, hi: int, tail_hit: bool):
+        self.index = index
+        self.expression = expression
+        self.lo = lo
+        self.hi = hi
+        self.tail = [index.tail] if tail_hit else []
+        self._count: Optional[int] = None
+
+    def _where(self) -> str:
+        return "FROM terms WHERE terms MATCH ? AND rowid >= ? AND rowid < ?"
+
+    def __len__(self) -> int:
+        if self._count is None:
+            rows = self.index.execute(f"SELECT count(*) {self._where()}", (self.expression, self.lo, self.hi))
+            self._count = rows[0][0] + len(self.tail)
+        return self._count
+
+    def __getitem__(self, item: slice) -> List[int]:
+        start, stop = item.start or 0, item.stop
+        result = self.tail[start:stop]
+        # 其余部分在SQLite中分页，LIMIT -1表示不限条数
+        offset = max(0, start - len(self.tail))
+        limit = -1 if stop is None else max(0, stop - len(self.tail) - offset)
+        if limit != 0:
+            rows = self.index.execute(f"SELECT rowid {self._where()} ORDER BY rowid DESC LIMIT ? OFFSET ?",
+                                      (self.expression, self.lo, self.hi, limit, offset))
+            result.extend(row[0] for row in rows)
+        return result
+
+    def __iter__(self):
+        return iter(self[0:None])
+
+class TermIndex:
+    """单个日志文件的倒排索引，保存在SQLite FTS5表中，行号即条目编号
+
+    最后一条日志可能还会追加续行（如堆栈），暂存在内存中，下一条日志出现后才写入索引。
+    多个worker共用同一个索引文件，写入时跳过其他进程已写入的条目。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self._open()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"倒排索引损坏，将重建: {str(e)}")
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            self._open()
+        self.count = self._stored_count()
+        self._pending: List[tuple] = []
+        self.tail: Optional[int] = None
+        self._tail_fields: Tuple[int, int] = (0, 0)
+        self._tail_text: List[str] = []
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(body, content='', columnsize=0, "
+            "detail=full, tokenize='unicode61 remove_diacritics 0')"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _stored_count(self) -> int:
+        row = self._conn.execute("SELECT value FROM state WHERE key = 'count'").fetchone()
+        return row[0] if row else 0
+
+    def execute(self, sql: str, params: tuple) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def add(self, entry: int, text: str, level: int = 0, source: int = 0):
+        """加入一条日志（内容、级别和来源编号），或为最后一条日志追加续行"""
+        if entry == self.tail:
+            self._tail_text.append(text)
+            return
+        if self.tail is not None and self.tail >= self.count:
+            level_code, source_id = self._tail_fields
+            tokens = tokenize("\n".join(self._tail_text))
+            body = " ".join([LEVEL_TOKEN.format(level_code), SOURCE_TOKEN.format(source_id)] + tokens)
+            self._pending.append((self.tail, body))
+        self.tail = entry
+        self._tail_fields = (level, source)
+        self._tail_text = [text]
+
+    def flush(self):
+        """写入已完整的条目"""
+        if not self._pending:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stored = self._stored_count()
+                rows = [row for row in self._pending if row[0] >= stored]
+                self._conn.executemany("INSERT INTO terms (rowid, body) VALUES (?, ?)", rows)
+                self.count = max(stored, rows[-1][0] + 1) if rows else stored
+                self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('count', ?)", (self.count,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._pending = []
+
+    def matches(self, query: SearchQuery, lo: int, hi: int, level_codes: Optional[Set[int]] = None,
+                source_id: Optional[int] = None) -> Optional[Matches]:
+        """[lo, hi)中满足搜索词和级别、来源条件的条目，查询中没有可索引的词时返回None"""
+        expression = query.expression()
+        if expression is None:
+            return None
+        clauses = [expression]
+        if level_codes is not None:
+            clauses.append("(" + " OR ".join(f'"{LEVEL_TOKEN.format(code)}"' for code in sorted(level_codes) or [-1]) + ")")
+        if source_id is not None:
+            clauses.append(f'"{SOURCE_TOKEN.format(source_id)}"')
+        # 尚未写入索引的最后一条直接匹配内容
+        tail_hit = (self.tail is not None and lo <= self.tail < hi and self.tail >= self.count
+                    and (level_codes is None or self._tail_fields[0] in level_codes)
+                    and (source_id is None or self._tail_fields[1] == source_id)
+                    and query.match(self.tail_message()))
+        return Matches(self, " AND ".join(clauses), lo, hi, tail_hit)
+
+    def tail_message(self) -> str:
+        return "\n".join(self._tail_text)
+
+    def resync(self):
+        """其他进程写入了新条目后，丢弃内存中暂存的条目，以已写入的数量为准重新补齐"""
+        with self._lock:
+            self.count = self._stored_count()
+        self._pending = []
+        self.tail = None
+        self._tail_text = []
+
+    def reset(self):
+        """清空索引"""
+        with self._lock:
+            self._conn.execute("INSERT INTO terms (terms) VALUES ('delete-all')")
+            self._conn.execute("DELETE FROM state")
+        self.count = 0
+        self._pending = []
+        self.tail = None
+        self._tail_text = []
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
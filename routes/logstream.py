@@ -0,0 +1,235 @@
+# -- coding: utf-8 --
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from .logindex import LOG_LINE_RE, LEVELS, SIGNATURE_BYTES, get_log_dir, parse_json_record, file_signature
+from .logsearch import SearchQuery
+
+logger = logging.getLogger("logstream")
+
+# 单次读取的最大字节数
+READ_CHUNK = 256 * 1024
+# 断线续传最多回放的字节数
+REPLAY_LIMIT = 4 * 1024 * 1024
+# 超过READ_CHUNK的行只保留开头部分，并加上此标记
+TRUNCATED_MARK = " …(已截断)".encode()
+
+# 解析一行日志，不是日志起始行时返回None
+def parse_line(line: bytes) -> Optional[Dict[str, Any]]:
+    record = parse_json_record(line)
+    if record is not None:
+        return {"timestamp": record[0], "type": record[1], "source": record[2], "message": record[3]}
+    match = LOG_LINE_RE.match(line)
+    if not match:
+        return None
+    y, mo, d, h, mi, s = (int(match.group(i)) for i in range(1, 7))
+    return {
+        "timestamp": time.mktime((y, mo, d, h, mi, s, 0, 0, -1)) + int(match.group(7)) / 1000,
+        "type": match.group(9).decode().lower(),
+        "source": match.group(8).decode("utf-8", "replace"),
+        "message": line[match.end():].decode("utf-8", "replace").rstrip("\r\n"),
+    }
+
+# 将读取到的完整行组合为日志条目，续行（如堆栈）并入上一条
+def parse_chunk(data: bytes, base: int, last: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    entries: List[Dict[str, Any]] = []
+    pos = base
+    for line in data.splitlines(keepends=True):
+        pos += len(line)
+        entry = parse_line(line)
+        if entry is None:
+            text = line.decode("utf-8", "replace").rstrip("\r\n")
+            if entries:
+                entries[-1]["message"] += "\n" + text
+                entries[-1]["offset"] = pos
+                continue
+            # 批次开头的续行沿用上一条日志的级别和来源
+            entry = {"timestamp": last["timestamp"] if last else time.time(),
+                     "type": last["type"] if last else "info",
+                     "source": last["source"] if last else "",
+                     "message": text}
+        entry["offset"] = pos
+        entries.append(entry)
+    return entries
+
+class LogFilter:
+    """服务端日志过滤条件，与/api/logs的参数一致"""
+
+    def __init__(self, levels: Optional[List[str]] = None, source: Optional[str] = None,
+                 search: Optional[str] = None):
+        self.levels = set(levels) & set(LEVELS) if levels else None
+        self.source = source or None
+        self.query = SearchQuery.parse(search)
+
+    def match(self, entry: Dict[str, Any]) -> bool:
+        if self.levels is not None and entry["type"] not in self.levels:
+            return False
+        if self.source is not None and entry["source"] != self.source:
+            return False
+        if self.query is not None and not self.query.match(entry["message"]):
+            return False
+        return True
+
+class Subscription:
+    """单个订阅者，积压超过上限时丢弃最旧的条目"""
+
+    def __init__(self, log_filter: LogFilter, backlog: int = 500):
+        self.filter = log_filter
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=backlog)
+        self.dropped = 0
+
+    def push(self, entry: Dict[str, Any]):
+        if not self.filter.match(entry):
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(entry)
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+class LogFollower:
+    """跟踪活动日志文件，由一个读取任务分发给所有订阅者"""
+
+    def __init__(self, path: Optional[str] = None, poll_interval: float = 0.5, backlog: int = 500):
+        self.path = path or os.path.join(get_log_dir(), "app.log")
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+        self.generation = ""
+        self.position = 0
+        self._last: Optional[Dict[str, Any]] = None
+        self._subscribers: Set[Subscription] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _identify(self) -> Tuple[str, int]:
+        """返回(文件标识, 文件大小)，文件标识由首行计算，轮换后会变化"""
+        try:
+            with open(self.path, "rb") as f:
+                head = f.read(SIGNATURE_BYTES)
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return "", 0
+        signature = file_signature(head)
+        if not signature:
+            return "", size
+        return hashlib.sha1(signature).hexdigest()[:12], size
+
+    def _read(self, start: int, end: int) -> Tuple[bytes, int]:
+        """读取[start, end)之间的完整行，返回数据和实际结束位置
+
+        单行超过READ_CHUNK时只返回该行开头部分（加截断标记），结束位置跳到行尾。
+        """
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            data = f.read(min(end - start, READ_CHUNK))
+            complete = data.rfind(b"\n") + 1
+            if complete or len(data) < READ_CHUNK:
+                return data[:complete], start + complete
+            # 超长的行：找到行尾，丢弃其余部分
+            pos = start + len(data)
+            while pos < end:
+                chunk = f.read(min(end - pos, READ_CHUNK))
+                if not chunk:
+                    break
+                newline = chunk.find(b"\n")
+                if newline >= 0:
+                    return data + TRUNCATED_MARK + b"\n", pos + newline + 1
+                pos += len(chunk)
+        # 超长的行还没有写完，等写完后再读取
+        return b"", start
+
+    def _poll(self) -> List[Dict[str, Any]]:
+        generation, size = self._identify()
+        if generation != self.generation or size < self.position:
+            # 文件轮换或被截断，从新文件开头读取
+            self.generation = generation
+            self.position = 0
+            self._last = None
+        if size <= self.position:
+            return []
+        data, end = self._read(self.position, size)
+        entries = parse_chunk(data, self.position, self._last)
+        if entries:
+            # 截断的行实际结束于end
+            entries[-1]["offset"] = end
+        entries = self._tag(entries)
+        self.position = end
+        if entries:
+            self._last = entries[-1]
+        return entries
+
+    def _tag(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """为条目添加事件ID（文件标识:结束偏移），客户端断线后凭此续传"""
+        for entry in entries:
+            entry["id"] = f"{self.generation}:{entry['offset']}"
+        return entries
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                for entry in await asyncio.to_thread(self._poll):
+                    for subscription in list(self._subscribers):
+                        subscription.push(entry)
+            except Exception as e:
+                logger.error(f"读取日志失败: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+        self._task = None
+
+    async def subscribe(self, log_filter: LogFilter, resume: Optional[str] = None) -> Tuple[Subscription, List[Dict[str, Any]]]:
+        """订阅新日志；resume为上次收到的事件ID时补发断线期间的条目"""
+        if self._task is None:
+            # 首个订阅者：从文件末尾开始跟踪
+            self.generation, self.position = await asyncio.to_thread(self._identify)
+            self._last = None
+        subscription = Subscription(log_filter, self.backlog)
+        self._subscribers.add(subscription)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        replay: List[Dict[str, Any]] = []
+        start = self._resume_offset(resume)
+        if start is not None and start < self.position:
+            replay = await asyncio.to_thread(self._replay, start, self.position)
+            replay = [entry for entry in replay if log_filter.match(entry)][-self.backlog:]
+        return subscription, replay
+
+    def _resume_offset(self, resume: Optional[str]) -> Optional[int]:
+        if not resume:
+            return None
+        generation, _, offset = resume.partition(":")
+        if generation != self.generation:
+            # 断线期间日志已轮换，从当前文件开头补发
+            return 0
+        try:
+            return int(offset)
+        except ValueError:
+            return None
+
+    def _replay(self, start: int, end: int) -> List[Dict[str, Any]]:
+        if end - start > REPLAY_LIMIT:
+            # 断线太久时只回放末尾部分，从下一个完整行开始
+            with open(self.path, "rb") as f:
+                f.seek(end - REPLAY_LIMIT)
+                start = end - REPLAY_LIMIT + len(f.readline())
+        entries: List[Dict[str, Any]] = []
+        while start < end:
+            data, stop = self._read(start, end)
+            if stop == start:
+                break
+            entries.extend(parse_chunk(data, start, entries[-1] if entries else None))
+            if entries:
+                entries[-1]["offset"] = stop
+            start = stop
+        return self._tag(entries)
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+# 全局日志跟踪器
+log_follower = LogFollower()
@@ -0,0 +1,292 @@
+# -- coding: utf-8 --
+"""面板自身的内存分析：用tracemalloc按分配位置统计内存，并对比两个快照找出增长的位置
+
+两种用法：
+- 手动：开启跟踪、在不同时刻保存命名快照，查看某个快照中占用最多的位置或两个快照之间的差异。
+  跟踪期间每次内存分配都有额外开销，排查完应关闭。
+- 定期采样：每隔interval秒只跟踪window秒，窗口结束时记录窗口内分配且仍未释放的内存，然后关闭
+  跟踪。泄漏的位置几乎每个窗口都有存活的分配，短暂的分配在窗口结束时已释放，
+  据此列出疑似泄漏的位置。开销只在窗口内产生，可以在生产环境中长期开启。
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import tracemalloc
+from collections import deque, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import psutil
+
+from .utils import read_config
+from .monitor import PeriodicTask
+from .profiling import short_path
+
+logger = logging.getLogger("memtrace")
+
+GROUP_BY = ("lineno", "filename", "traceback")
+# 快照中排除tracemalloc自身和导入机制的分配
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, __file__),
+)
+# 每个采样窗口保留的分配位置数，以及计入的最小存活大小（过滤零散的小分配）
+WINDOW_SITES = 100
+MIN_SITE_BYTES = 1024
+
+MANUAL = "manual"
+PERIODIC = "periodic"
+
+# 获取内存分析配置
+def get_memtrace_config() -> Dict[str, Any]:
+    """获取内存分析配置（monitor.memory_trace）"""
+    section = (read_config().get("monitor", {}) or {}).get("memory_trace", {}) or {}
+    interval = max(10.0, float(section.get("interval", 600)))
+    return {
+        "periodic": bool(section.get("periodic", False)),
+        "interval": interval,
+        "window": min(max(1.0, float(section.get("window", 30))), interval / 2),
+        "frames": min(max(1, int(section.get("frames", 1))), 64),
+        "windows": max(2, int(section.get("windows", 24))),
+        "max_snapshots": max(2, int(section.get("max_snapshots", 10))),
+    }
+
+class MemoryTracerError(Exception):
+    """操作无法执行（未开启跟踪、快照不存在等），消息直接返回给用户"""
+
+# 把统计项转为可序列化的字典，路径缩短为项目内相对路径或包路径
+def format_stat(stat, group_by: str) -> Dict[str, Any]:
+    # 调用栈从最外层到最内层排列，最后一帧是分配内存的位置
+    frame = stat.traceback[-1]
+    item = {
+        "file": short_path(frame.filename),
+        "line": frame.lineno if group_by != "filename" else None,
+        "size": stat.size,
+        "count": stat.count,
+    }
+    if hasattr(stat, "size_diff"):
+        item["size_diff"] = stat.size_diff
+        item["count_diff"] = stat.count_diff
+    if group_by == "traceback":
+        item["traceback"] = [f"{short_path(f.filename)}:{f.lineno}" for f in stat.traceback]
+    return item
+
+class MemoryTracer:
+    """tracemalloc的开关、命名快照和定期采样窗口"""
+
+    def __init__(self):
+        self.frames = 1
+        self.max_snapshots = 10
+        # 名称 -> {time, snapshot, size, count}
+        self.snapshots: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 定期采样：每个窗口内分配且在窗口结束时仍存活的位置 -> (大小, 个数)
+        self.windows: deque = deque(maxlen=24)
+        # 当前跟踪由谁开启：None、MANUAL或PERIODIC
+        self._owner: Optional[str] = None
+        self._window_started = 0.0
+        self._lock = threading.RLock()
+
+    def configure(self, config: Dict[str, Any]):
+        self.frames = config["frames"]
+        self.max_snapshots = config["max_snapshots"]
+        if self.windows.maxlen != config["windows"]:
+            self.windows = deque(self.windows, maxlen=config["windows"])
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: Optional[int] = None):
+        """开启手动跟踪；定期采样的窗口正在进行时改为手动跟踪，窗口结束时不再关闭"""
+        with self._lock:
+            frames = min(max(1, int(frames or self.frames)), 64)
+            if tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() != frames:
+                tracemalloc.stop()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._owner = MANUAL
+            logger.info(f"已开启内存跟踪（{frames}层调用栈）")
+
+    def stop(self):
+        """关闭跟踪，已保存的快照保留"""
+        with self._lock:
+            tracemalloc.stop()
+            self._owner = None
+            logger.info("已关闭内存跟踪")
+
+    def _take(self) -> tracemalloc.Snapshot:
+        if not tracemalloc.is_tracing():
+            raise MemoryTracerError("内存跟踪未开启")
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def take_snapshot(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """保存命名快照，超出数量上限时丢弃最早的快照"""
+        snapshot = self._take()
+        name = name or time.strftime("snapshot-%H%M%S")
+        entry = {"time": time.time(), "snapshot": snapshot,
+                 "size": sum(trace.size for trace in snapshot.traces), "count": len(snapshot.traces)}
+        with self._lock:
+            self.snapshots.pop(name, None)
+            self.snapshots[name] = entry
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+        return self._describe(name)
+
+    def delete_snapshot(self, name: str) -> bool:
+        with self._lock:
+            return self.snapshots.pop(name, None) is not None
+
+    def _get(self, name: Optional[str]) -> tracemalloc.Snapshot:
+        """取命名快照，name为空时取当前的快照（不保存）"""
+        if not name:
+            return self._take()
+        with self._lock:
+            entry = self.snapshots.get(name)
+        if entry is None:
+            raise MemoryTracerError(f"快照不存在: {name}")
+        return entry["snapshot"]
+
+    def _describe(self, name: str) -> Dict[str, Any]:
+        entry = self.snapshots[name]
+        return {"name": name, "time": entry["time"], "frames": entry["snapshot"].traceback_limit,
+                "size": entry["size"], "count": entry["count"]}
+
+    def top(self, name: Optional[str] = None, group_by: str = "lineno", limit: int = 20) -> Dict[str, Any]:
+        """快照中占用内存最多的位置"""
+        if group_by not in GROUP_BY:
+            raise MemoryTracerError(f"group_by应为{'、'.join(GROUP_BY)}之一")
+        stats = self._get(name).statistics(group_by)
+        return {
+            "snapshot": name or None,
+            "total_size": sum(stat.size for stat in stats),
+            "total_count": sum(stat.count for stat in stats),
+            "stats": [format_stat(stat, group_by) for stat in stats[:limit]],
+        }
+
+    def diff(self, base: str, target: Optional[str] = None, group_by: str = "lineno",
+             limit: int = 20) -> Dict[str, Any]:
+        """target（为空时取当前）相对base的变化，按增长的大小排序"""
+        if group_by not in GROUP_BY:
+            raise MemoryTracerError(f"group_by应为{'、'.join(GROUP_BY)}之一")
+        old = self._get(base)
+        new = self._get(target)
+        stats = new.compare_to(old, group_by)
+        return {
+            "base": base,
+            "target": target or None,
+            "size_diff": sum(stat.size_diff for stat in stats),
+            "count_diff": sum(stat.count_diff for stat in stats),
+            "stats": [format_stat(stat, group_by) for stat in stats[:limit]],
+        }
+
+    # 定期采样
+
+    def begin_window(self) -> bool:
+        """开始一个采样窗口，手动跟踪进行中时跳过"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start(self.frames)
+            self._owner = PERIODIC
+            self._window_started = time.time()
+            return True
+
+    def end_window(self):
+        """记录窗口内分配且仍存活的内存，然后关闭跟踪（窗口期间改为手动跟踪时保持开启）"""
+        with self._lock:
+            if self._owner != PERIODIC or not tracemalloc.is_tracing():
+                return
+            snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            tracemalloc.stop()
+            self._owner = None
+            started = self._window_started
+        stats = snapshot.statistics("lineno")
+        sites = {(short_path(stat.traceback[-1].filename), stat.traceback[-1].lineno): (stat.size, stat.count)
+                 for stat in stats[:WINDOW_SITES] if stat.size >= MIN_SITE_BYTES}
+        self.windows.append({"start": started, "end": time.time(), "size": sum(s.size for s in stats),
+                             "sites": sites})
+
+    def abort_window(self):
+        """丢弃进行中的采样窗口"""
+        with self._lock:
+            if self._owner == PERIODIC:
+                tracemalloc.stop()
+                self._owner = None
+
+    def suspects(self, limit: int = 20) -> Dict[str, Any]:
+        """定期采样的结果：在大多数窗口中都有存活分配的位置，按平均存活大小排序"""
+        windows = list(self.windows)
+        totals: Dict[Tuple[str, int], List[int]] = {}
+        for window in windows:
+            for site, (size, count) in window["sites"].items():
+                entry = totals.setdefault(site, [0, 0, 0, 0])
+                entry[0] += 1
+                entry[1] += size
+                entry[2] += count
+                entry[3] = size
+        sites = []
+        for (file, line), (seen, size, count, last) in totals.items():
+            sites.append({
+                "file": file, "line": line, "windows": seen,
+                "mean_size": size // seen, "mean_count": count // seen, "last_size": last,
+                # 至少3个窗口、且在3/4以上的窗口中都有存活分配
+                "suspected": len(windows) >= 3 and seen >= 0.75 * len(windows),
+            })
+        sites.sort(key=lambda s: (s["suspected"], s["windows"] * s["mean_size"]), reverse=True)
+        return {
+            "windows": [{"start": w["start"], "end": w["end"], "size": w["size"]} for w in windows],
+            "sites": sites[:limit],
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """跟踪状态、tracemalloc自身的开销、进程内存和已保存的快照"""
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        memory = psutil.Process(os.getpid()).memory_info()
+        with self._lock:
+            snapshots = [self._describe(name) for name in self.snapshots]
+        return {
+            "tracing": tracing,
+            "mode": self._owner,
+            "frames": tracemalloc.get_traceback_limit() if tracing else self.frames,
+            "traced_current": current,
+            "traced_peak": peak,
+            "overhead": tracemalloc.get_tracemalloc_memory(),
+            "rss": memory.rss,
+            "vms": memory.vms,
+            "snapshots": snapshots,
+            "windows": len(self.windows),
+        }
+
+class MemoryTraceTask(PeriodicTask):
+    """定期采样：每隔interval秒跟踪window秒"""
+
+    name = "内存采样"
+
+    def __init__(self, tracer: MemoryTracer, interval: float = 600.0, window: float = 30.0):
+        super().__init__(interval)
+        self.tracer = tracer
+        self.window = window
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(self.interval - self.window, 0))
+            try:
+                if not self.tracer.begin_window():
+                    continue
+                await asyncio.sleep(self.window)
+                await asyncio.to_thread(self.tracer.end_window)
+            except asyncio.CancelledError:
+                # 停止时关闭窗口内开启的跟踪
+                self.tracer.abort_window()
+                raise
+            except Exception as e:
+                logger.error(f"{self.name}失败: {str(e)}")
+
+# 全局内存分析
+memory_tracer = MemoryTracer()
+memtrace_task = MemoryTraceTask(memory_tracer)
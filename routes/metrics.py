@@ -0,0 +1,358 @@
+# -- coding: utf-8 --
+import os
+import time
+import bisect
+import hmac
+import asyncio
+import logging
+import itertools
+import ipaddress
+from typing import Dict, Any, List, Optional, Tuple
+
+from fastapi import APIRouter, Request, Response, status
+
+from .utils import read_config
+from .monitor import resource_sampler, process_table
+from .supervisor import supervisor, RUNNING
+from .servicemon import service_monitor
+from .profiling import loop_monitor
+
+router = APIRouter(tags=["metrics"])
+logger = logging.getLogger("metrics")
+
+# 请求耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 事件循环打点延迟直方图的桶上限（秒）
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 未匹配到路由的请求统一记为一个标签，避免随意的路径产生大量序列
+UNMATCHED_ROUTE = "<unmatched>"
+
+# 获取指标导出配置
+def get_metrics_config() -> Dict[str, Any]:
+    """获取/metrics配置（monitor.metrics），token非空时需要Bearer认证，
+    为空时只允许本机访问（allow_remote为true时不限制）"""
+    section = (read_config().get("monitor", {}) or {}).get("metrics", {}) or {}
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "token": str(section.get("token", "") or ""),
+        "allow_remote": bool(section.get("allow_remote", False)),
+    }
+
+# 请求是否来自本机
+def is_local_client(request: Request) -> bool:
+    if request.client is None:
+        return False
+    try:
+        return ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        return False
+
+# 进程内指标的标签：多worker时每个worker各自计数，按pid区分，由Prometheus汇总
+def worker_labels() -> Dict[str, str]:
+    return {"worker": str(os.getpid())}
+
+class Histogram:
+    """固定桶的直方图，按标签分别计数，只在事件循环中更新"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # 标签 -> [各桶计数(非累计，最后一个为+Inf), 总和, 总数]
+        self.series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, labels: Tuple[str, ...], q: float) -> Optional[float]:
+        """按桶内线性插值估算分位数，落在+Inf桶时返回最后一个桶上限"""
+        series = self.series.get(labels)
+        if series is None or not series[2]:
+            return None
+        rank = q * series[2]
+        cumulative = 0
+        for i, n in enumerate(series[0]):
+            if n and cumulative + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+class HttpMetrics:
+    """HTTP请求计数、耗时和正在处理的请求"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        # (方法, 路由, 状态码) -> 请求数
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        # (方法, 路由) -> 最长耗时
+        self.slowest: Dict[Tuple[str, str], float] = {}
+        # 正在处理的请求：编号 -> (scope, 开始时间, asyncio任务)，路由在请求匹配后才写入scope，读取时再取
+        self.active: Dict[int, Tuple[Dict[str, Any], float, Any]] = {}
+        self._ids = itertools.count()
+
+    def begin(self, scope: Dict[str, Any]) -> int:
+        token = next(self._ids)
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        self.active[token] = (scope, time.perf_counter(), task)
+        return token
+
+    def end(self, token: int, status_code: int):
+        scope, start, _ = self.active.pop(token)
+        self.record(scope["method"], route_template(scope), status_code, time.perf_counter() - start)
+
+    def record(self, method: str, route: str, status_code: int, duration: float):
+        self.latency.observe((method, route), duration)
+        key = (method, route, str(status_code))
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if duration > self.slowest.get((method, route), 0.0):
+            self.slowest[(method, route)] = duration
+
+    def in_flight(self) -> Dict[Tuple[str, str], Tuple[int, float]]:
+        """各路由正在处理的请求数和其中最久的已耗时（秒）"""
+        now = time.perf_counter()
+        result: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        for scope, start, _ in list(self.active.values()):
+            key = (scope["method"], route_template(scope))
+            count, oldest = result.get(key, (0, 0.0))
+            result[key] = (count + 1, max(oldest, now - start))
+        return result
+
+    def describe_task(self, task) -> Optional[str]:
+        """asyncio任务正在处理的请求，供事件循环阻塞记录使用（在看门狗线程中调用）"""
+        for scope, _, owner in list(self.active.values()):
+            if owner is task:
+                return f"{scope['method']} {route_template(scope)}"
+        return None
+
+    def report(self) -> List[Dict[str, Any]]:
+        """各路由的请求数、错误数、耗时分位数（毫秒）和正在处理的请求，按总耗时从高到低排序"""
+        errors: Dict[Tuple[str, str], int] = {}
+        for (method, route, code), count in list(self.requests.items()):
+            if code.startswith("5"):
+                errors[(method, route)] = errors.get((method, route), 0) + count
+        in_flight = self.in_flight()
+        keys = set(self.latency.series) | set(in_flight)
+        rows = []
+        for key in keys:
+            _, total, count = self.latency.series.get(key, ([], 0.0, 0))
+            active, oldest = in_flight.get(key, (0, 0.0))
+            slowest = self.slowest.get(key)
+
+            # 桶内插值可能超过实际的最长耗时
+            def quantile(q: float) -> Optional[float]:
+                value = self.latency.quantile(key, q)
+                return min(value, slowest) if value is not None and slowest is not None else value
+
+            rows.append({
+                "method": key[0], "route": key[1], "count": count, "errors": errors.get(key, 0),
+                "total_ms": ms(total), "mean_ms": ms(total / count) if count else None,
+                "p50_ms": ms(quantile(0.5)), "p95_ms": ms(quantile(0.95)),
+                "p99_ms": ms(quantile(0.99)), "max_ms": ms(slowest),
+                "in_flight": active, "oldest_in_flight_ms": ms(oldest) if active else None,
+            })
+        rows.sort(key=lambda row: row["total_ms"] or 0, reverse=True)
+        return rows
+
+# 秒转为毫秒
+def ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 3) if value is not None else None
+
+# 全局HTTP指标
+http_metrics = HttpMetrics()
+# 事件循环打点延迟
+loop_lag = Histogram(LOOP_LAG_BUCKETS)
+loop_monitor.add_listener(lambda lag: loop_lag.observe((), lag))
+loop_monitor.describe_task = http_metrics.describe_task
+
+# 获取请求匹配到的路由模板，如/api/services/{name}
+def route_template(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # 挂载的子应用（如/static）以挂载路径为准
+    return scope.get("root_path") or UNMATCHED_ROUTE
+
+class MetricsMiddleware:
+    """记录每个HTTP请求的路由、状态码和耗时（纯ASGI实现，不影响流式响应）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = http_metrics.begin(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_metrics.end(token, status_code)
+
+# 转义标签值
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# 格式化数值，整数不带小数点
+def format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Exposition:
+    """Prometheus文本格式的输出缓冲"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        if labels:
+            text = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+            self.lines.append(f"{name}{{{text}}} {format_value(value)}")
+        else:
+            self.lines.append(f"{name} {format_value(value)}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+# 主机资源，来自后台采样器的最新快照
+def collect_host(out: Exposition):
+    snapshot = resource_sampler.snapshot()
+    out.family("firefly_cpu_usage_percent", "gauge", "Host CPU usage in percent.")
+    out.sample("firefly_cpu_usage_percent", snapshot["cpu_percent"])
+    out.family("firefly_memory_used_bytes", "gauge", "Host memory in use.")
+    out.sample("firefly_memory_used_bytes", snapshot["memory_used"])
+    out.family("firefly_memory_total_bytes", "gauge", "Host memory size.")
+    out.sample("firefly_memory_total_bytes", snapshot["memory_total"])
+    out.family("firefly_disk_used_bytes", "gauge", "Used space on the monitored disk.")
+    out.sample("firefly_disk_used_bytes", snapshot["disk_used"])
+    out.family("firefly_disk_total_bytes", "gauge", "Size of the monitored disk.")
+    out.sample("firefly_disk_total_bytes", snapshot["disk_total"])
+    out.family("firefly_processes", "gauge", "Number of processes on the host.")
+    out.sample("firefly_processes", snapshot["processes"])
+    out.family("firefly_sample_age_seconds", "gauge", "Age of the host resource sample.")
+    out.sample("firefly_sample_age_seconds", snapshot["age"])
+    out.family("firefly_process_table_age_seconds", "gauge", "Age of the process table snapshot.")
+    out.sample("firefly_process_table_age_seconds", process_table.age() if process_table.version else 0)
+
+# 受管服务的状态、重启次数和进程树资源
+def collect_services(out: Exposition):
+    services = supervisor.status()
+    out.family("firefly_service_up", "gauge", "Whether the supervised service is running.")
+    for service in services:
+        out.sample("firefly_service_up", 1 if service["state"] == RUNNING else 0, {"service": service["name"]})
+    out.family("firefly_service_restarts_total", "counter", "Automatic restarts of the supervised service.")
+    for service in services:
+        out.sample("firefly_service_restarts_total", service["restarts"], {"service": service["name"]})
+
+    gauges = (
+        ("firefly_service_rss_bytes", "rss", "Resident memory of the service process tree."),
+        ("firefly_service_uss_bytes", "uss", "Unique memory of the service process tree."),
+        ("firefly_service_cpu_percent", "cpu_percent", "CPU usage of the service process tree in percent."),
+        ("firefly_service_threads", "threads", "Threads in the service process tree."),
+        ("firefly_service_open_fds", "fds", "Open file descriptors in the service process tree."),
+    )
+    summary = service_monitor.summary()
+    current = {name: stats["current"] for name, stats in summary.items() if stats["current"]}
+    for metric, field, help_text in gauges:
+        out.family(metric, "gauge", help_text)
+        for name, values in current.items():
+            out.sample(metric, values[field], {"service": name})
+    out.family("firefly_service_memory_leak_suspected", "gauge", "Whether steady RSS growth was detected.")
+    for name, stats in summary.items():
+        out.sample("firefly_service_memory_leak_suspected", 1 if stats["leak"]["suspected"] else 0, {"service": name})
+
+# HTTP请求计数和耗时直方图
+def collect_http(out: Exposition):
+    worker = worker_labels()
+    out.family("firefly_http_requests_total", "counter", "HTTP requests by route and status code, per worker.")
+    for (method, route, code), count in list(http_metrics.requests.items()):
+        out.sample("firefly_http_requests_total", count,
+                   {"method": method, "route": route, "status": code, **worker})
+
+    histogram = http_metrics.latency
+    name = "firefly_http_request_duration_seconds"
+    out.family(name, "histogram", "HTTP request latency by route, per worker.")
+    bounds = [format_value(b) for b in histogram.buckets] + ["+Inf"]
+    for (method, route), (counts, total, count) in list(histogram.series.items()):
+        labels = {"method": method, "route": route, **worker}
+        cumulative = 0
+        for bound, n in zip(bounds, counts):
+            cumulative += n
+            out.sample(f"{name}_bucket", cumulative, {**labels, "le": bound})
+        out.sample(f"{name}_sum", total, labels)
+        out.sample(f"{name}_count", count, labels)
+
+    out.family("firefly_http_requests_in_flight", "gauge", "HTTP requests currently being handled by route, per worker.")
+    for (method, route), (count, _) in http_metrics.in_flight().items():
+        out.sample("firefly_http_requests_in_flight", count, {"method": method, "route": route, **worker})
+
+# 事件循环延迟和阻塞次数
+def collect_loop(out: Exposition):
+    worker = worker_labels()
+    name = "firefly_event_loop_lag_seconds"
+    out.family(name, "histogram", "How late the event loop heartbeat fired, per worker.")
+    counts, total, count = loop_lag.series.get((), ([0] * (len(loop_lag.buckets) + 1), 0.0, 0))
+    cumulative = 0
+    for bound, n in zip([format_value(b) for b in loop_lag.buckets] + ["+Inf"], counts):
+        cumulative += n
+        out.sample(f"{name}_bucket", cumulative, {**worker, "le": bound})
+    out.sample(f"{name}_sum", total, worker)
+    out.sample(f"{name}_count", count, worker)
+    out.family("firefly_event_loop_stalls_total", "counter", "Event loop stalls longer than the threshold, per worker.")
+    out.sample("firefly_event_loop_stalls_total", loop_monitor.stalls_total, worker)
+
+# 生成完整的指标文本，只读取已聚合的状态，不做任何采样
+def render_metrics() -> str:
+    out = Exposition()
+    collect_host(out)
+    collect_services(out)
+    collect_http(out)
+    collect_loop(out)
+    return out.render()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus指标导出"""
+    config = get_metrics_config()
+    if not config["enabled"]:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    if config["token"]:
+        # compare_digest不接受含非ASCII字符的str，按字节比较
+        expected = f"Bearer {config['token']}".encode()
+        if not hmac.compare_digest(request.headers.get("authorization", "").encode(), expected):
+            return Response(status_code=status.HTTP_401_UNAUTHORIZED,
+                            headers={"WWW-Authenticate": "Bearer"})
+    elif not config["allow_remote"] and not is_local_client(request):
+        # 未设置token时默认只允许本机抓取
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+    except Exception as e:
+        logger.error(f"生成指标失败: {str(e)}")
+        return Response(f"# 生成指标失败: {str(e)}\n", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        media_type="text/plain")
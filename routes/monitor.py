@@ -0,0 +1,546 @@
+# -- coding: utf-8 --
+import re
+import asyncio
+import bisect
+import heapq
+import itertools
+import time
+import logging
+from array import array
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import psutil
+
+from .utils import read_config
+
+logger = logging.getLogger("monitor")
+
+# 获取监控配置
+def get_monitor_config() -> Dict[str, Any]:
+    """获取监控相关配置"""
+    monitor = read_config().get("monitor", {}) or {}
+    return {
+        "interval": float(monitor.get("interval", 1.0)),
+        "process_interval": float(monitor.get("process_interval", 2.0)),
+        "disk_path": monitor.get("disk_path", "/"),
+    }
+
+class PeriodicTask:
+    """周期性后台任务，tick在线程池中执行，避免阻塞事件循环"""
+
+    name = "periodic"
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[Any], None]] = []
+
+    def tick(self):
+        raise NotImplementedError
+
+    def add_listener(self, callback: Callable[[Any], None]):
+        """注册回调，每次tick产出数据后在采样线程中调用"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Any], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, data: Any):
+        for callback in list(self._listeners):
+            try:
+                callback(data)
+            except Exception as e:
+                logger.error(f"{self.name}回调失败: {str(e)}")
+
+    def prime(self):
+        """首次tick之前的准备工作"""
+
+    async def after_tick(self):
+        """每次tick之后在事件循环中执行"""
+
+    async def _run(self):
+        await asyncio.to_thread(self.prime)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.tick)
+                await self.after_tick()
+            except Exception as e:
+                logger.error(f"{self.name}采样失败: {str(e)}")
+
+    def start(self):
+        """启动后台任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class ResourceSampler(PeriodicTask):
+    """后台系统资源采样器，所有请求共享同一份快照"""
+
+    name = "系统资源"
+
+    def __init__(self, interval: float = 1.0, disk_path: str = "/"):
+        super().__init__(interval)
+        self.disk_path = disk_path
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._sampled_at = 0.0
+
+    def sample(self) -> Dict[str, Any]:
+        """采集一次系统资源（非阻塞，CPU使用率为距上次采样的平均值）"""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        return {
+            "timestamp": time.time(),
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_used": memory.used,
+            "memory_total": memory.total,
+            "memory_percent": memory.percent,
+            "processes": len(psutil.pids()),
+            "disk_used": disk.used,
+            "disk_total": disk.total,
+            "disk_percent": disk.percent,
+        }
+
+    def _store(self, snapshot: Dict[str, Any], age: float = 0.0):
+        self._snapshot = snapshot
+        self._sampled_at = time.monotonic() - age
+
+    def publish(self, snapshot: Dict[str, Any], age: float = 0.0):
+        """写入外部产生的快照（多进程模式下由管理进程同步）并通知监听者"""
+        snapshot = {k: v for k, v in snapshot.items() if k != "age"}
+        self._store(snapshot, age)
+        self._notify(snapshot)
+
+    def prime(self):
+        # 初始采样，之后每次调用返回两次采样之间的CPU使用率
+        psutil.cpu_percent(interval=None)
+
+    def tick(self):
+        snapshot = self.sample()
+        self._store(snapshot)
+        self._notify(snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取最新快照，附带快照的年龄（秒）"""
+        if self._snapshot is None:
+            # 后台任务尚未产出数据时同步采集一次
+            self._store(self.sample())
+        data = dict(self._snapshot)
+        data["age"] = round(time.monotonic() - self._sampled_at, 3)
+        return data
+
+# 将资源快照格式化为仪表盘显示的文本
+def format_resources(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "cpu": f"{snapshot['cpu_percent']}%",
+        "memory": f"{float(snapshot['memory_used']) / (1024 * 1024):.1f}MB",
+        "processes": f"{snapshot['processes']}",
+        "disk": f"{float(snapshot['disk_used']) / (1024 * 1024 * 1024):.1f}GB",
+        "timestamp": snapshot["timestamp"],
+        "age": snapshot.get("age", 0.0),
+    }
+
+class _ProcessEntry:
+    """进程表中的一项，保存上一次采样的CPU时间用于计算增量"""
+
+    __slots__ = ("proc", "pid", "create_time", "ppid", "name", "user", "cmdline", "rss", "cpu_percent", "cpu_time",
+                 "sampled_at", "denied")
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.pid = proc.pid
+        # 与PID一起唯一确定一个进程，用于发现PID被复用
+        self.create_time: Optional[float] = None
+        self.ppid = 0
+        self.name = ""
+        # 用户和命令行在进程生命周期内基本不变，只在首次采样时读取
+        self.user: Optional[str] = None
+        self.cmdline = ""
+        self.rss = 0
+        self.cpu_percent = 0.0
+        self.cpu_time: Optional[float] = None
+        self.sampled_at = 0.0
+        self.denied = False
+
+# 读取进程的创建时间：psutil.Process.create_time()返回首次读取时缓存的值，发现不了PID复用，
+# 这里通过psutil的内部对象直接读取（在oneshot中与名称、父进程等共用一次/proc/<pid>/stat的解析）；
+# 内部接口不可用时退回公开接口，由is_running()重新读取创建时间来发现PID复用
+def _read_create_time(proc) -> float:
+    impl = getattr(proc, "_proc", None)
+    if impl is not None:
+        try:
+            return impl.create_time()
+        except (AttributeError, TypeError):
+            pass
+    if not proc.is_running():
+        raise psutil.NoSuchProcess(proc.pid)
+    return proc.create_time()
+
+# 命令行最多保留的字符数，避免个别进程的超长参数撑大快照和同步数据
+MAX_CMDLINE = 1024
+# 可用的排序键及其默认顺序（True为降序）
+PROCESS_SORT_KEYS: Dict[str, bool] = {
+    "memory": True,
+    "cpu": True,
+    "pid": False,
+    "name": False,
+}
+# 可选的返回字段
+PROCESS_FIELDS = ("pid", "name", "user", "cmdline", "rss", "memory_mb", "cpu_percent")
+DEFAULT_PROCESS_FIELDS = ("pid", "name", "memory_mb", "cpu_percent")
+
+# 把过滤条件转为正则：含*或?时按通配符匹配整个PID、进程名或命令行，否则按子串匹配
+def compile_process_pattern(pattern: str) -> "re.Pattern":
+    pattern = pattern.strip().lower().replace("\0", "").replace("\n", " ")
+    if "*" in pattern or "?" in pattern:
+        body = "".join("[^\\n\\0]*" if c == "*" else "[^\\n\\0]" if c == "?" else re.escape(c) for c in pattern)
+        # 每个字段前都有分隔符，以分隔符开头的正则比后顾断言快得多
+        return re.compile(f"[\\n\\0]{body}(?![^\\n\\0])")
+    return re.compile(re.escape(pattern))
+
+class ProcessSnapshot:
+    """某一时刻进程表的列式快照，刷新时整体替换，查询无需加锁
+
+    每列是按PID排列的并行数组；排序结果按排序键缓存，同一快照的翻页和过滤只做数组选取。
+    所有进程的PID、名称和命令行拼接为一个字符串，过滤时直接在其上用正则查找，按匹配的偏移量定位到行。
+    """
+
+    def __init__(self, version: int = 0, timestamp: float = 0.0, pid=(), name=(), user=(), cmdline=(),
+                 rss=(), cpu_percent=(), ppid=None):
+        self.version = version
+        self.timestamp = timestamp
+        order = sorted(range(len(pid)), key=pid.__getitem__)
+        self.pid = array("q", [pid[i] for i in order])
+        # 父进程PID，父进程已退出时为被过继到的进程（通常是1）
+        self.ppid = array("q", [ppid[i] for i in order] if ppid else [0] * len(order))
+        self.name: List[str] = [name[i] for i in order]
+        self.user: List[str] = [user[i] for i in order]
+        self.cmdline: List[str] = [cmdline[i] for i in order]
+        self.rss = array("Q", [rss[i] for i in order])
+        self.cpu_percent = array("d", [cpu_percent[i] for i in order])
+        self.size = len(self.pid)
+        # 搜索文本：每行为"\0PID\n名称\n命令行"，starts[i]为第i行开头的\0的偏移
+        texts = ["\n".join((str(p), n.replace("\n", " "), c.replace("\n", " "))).lower().replace("\0", " ")
+                 for p, n, c in zip(self.pid, self.name, self.cmdline)]
+        self.starts = array("q", itertools.accumulate((len(t) + 1 for t in texts[:-1]), initial=0)) if texts else array("q")
+        self.haystack = "\0" + "\0".join(texts)
+        self.by_user: Dict[str, array] = {}
+        for i, owner in enumerate(self.user):
+            self.by_user.setdefault(owner, array("q")).append(i)
+        self._orders: Dict[Tuple[str, bool], array] = {}
+        self._formatted: Dict[str, List[Any]] = {}
+
+    @classmethod
+    def from_entries(cls, entries: List[_ProcessEntry], version: int, timestamp: float) -> "ProcessSnapshot":
+        return cls(version, timestamp, [e.pid for e in entries], [e.name for e in entries],
+                   [e.user or "" for e in entries], [e.cmdline for e in entries],
+                   [e.rss for e in entries], [e.cpu_percent for e in entries], [e.ppid for e in entries])
+
+    def order(self, sort: str, descending: bool = False) -> array:
+        """按排序键排列的行号，同一快照内缓存；键相同的行按PID升序"""
+        cached = self._orders.get((sort, descending))
+        if cached is None:
+            if sort == "memory":
+                key = self.rss.__getitem__
+            elif sort == "cpu":
+                key = self.cpu_percent.__getitem__
+            elif sort == "name":
+                names = [n.lower() for n in self.name]
+                key = names.__getitem__
+            else:
+                key = self.pid.__getitem__
+            cached = array("q", sorted(range(self.size), key=key, reverse=descending))
+            self._orders[(sort, descending)] = cached
+        return cached
+
+    def match(self, pattern: Optional[str] = None, user: Optional[str] = None) -> Optional[bytearray]:
+        """符合条件的行（掩码），没有条件时返回None"""
+        if pattern and not self.size:
+            return bytearray()
+        users = None
+        if user is not None:
+            users = bytearray(self.size)
+            for i in self.by_user.get(user, ()):
+                users[i] = 1
+        if not pattern:
+            return users
+        mask = bytearray(self.size)
+        regex = compile_process_pattern(pattern)
+        haystack, starts = self.haystack, self.starts
+        m = regex.search(haystack)
+        while m is not None:
+            row = bisect.bisect_right(starts, m.start()) - 1
+            if users is None or users[row]:
+                mask[row] = 1
+            # 同一行只需匹配一次，从下一行开始继续查找
+            if row + 1 >= self.size:
+                break
+            m = regex.search(haystack, starts[row + 1])
+        return mask
+
+    def column(self, field: str) -> List[Any]:
+        """取出一列（memory_mb和cpu_percent为显示用的舍入值），同一快照内缓存"""
+        values = self._formatted.get(field)
+        if values is None:
+            if field == "memory_mb":
+                values = [round(v / (1024 * 1024), 1) for v in self.rss]
+            elif field == "cpu_percent":
+                values = [round(v, 1) for v in self.cpu_percent]
+            else:
+                values = getattr(self, field)
+            self._formatted[field] = values
+        return values
+
+    def query(self, sort: str = "memory", descending: Optional[bool] = None, pattern: Optional[str] = None,
+              user: Optional[str] = None, offset: int = 0, limit: Optional[int] = None,
+              fields=DEFAULT_PROCESS_FIELDS) -> Tuple[List[Dict[str, Any]], int]:
+        """过滤、排序并分页，返回(本页进程, 符合条件的总数)"""
+        sort = sort if sort in PROCESS_SORT_KEYS else "memory"
+        if descending is None:
+            descending = PROCESS_SORT_KEYS[sort]
+        mask = self.match(pattern, user)
+        end = None if limit is None else offset + limit
+        if mask is None:
+            total = self.size
+            if descending and end is not None and end < total and sort in ("memory", "cpu") \
+                    and (sort, True) not in self._orders:
+                # 只取前几名时不必完整排序（与降序排序的结果一致）
+                column = self.rss if sort == "memory" else self.cpu_percent
+                rows = heapq.nlargest(end, range(total), key=column.__getitem__)[offset:]
+            else:
+                rows = self.order(sort, descending)[offset:end]
+        else:
+            order = self.order(sort, descending)
+            selected = list(itertools.compress(order, map(mask.__getitem__, order)))
+            total = len(selected)
+            rows = selected[offset:end]
+        columns = [self.column(field) for field in fields]
+        page = [dict(zip(fields, values)) for values in
+                zip(*[[column[i] for i in rows] for column in columns])] if columns else [{} for _ in rows]
+        return page, total
+
+    def summary(self) -> Dict[str, Any]:
+        """全部进程的数量、内存和CPU合计，以及进程所属的用户"""
+        return {
+            "count": self.size,
+            "memory_mb": round(sum(self.rss) / (1024 * 1024), 1),
+            "cpu_percent": round(sum(self.cpu_percent, 0.0), 1),
+            "users": sorted(self.by_user),
+        }
+
+class ProcessTable(PeriodicTask):
+    """增量维护的进程表
+
+    跨采样周期复用psutil.Process对象，只为新出现的PID创建对象并移除已退出的进程，
+    CPU使用率由两次采样之间的CPU时间增量计算，查询时不再等待采样。
+    每次刷新产出一份列式快照（ProcessSnapshot），查询都在快照上进行。
+    """
+
+    name = "进程表"
+
+    def __init__(self, interval: float = 2.0,
+                 pids: Callable[[], List[int]] = psutil.pids,
+                 process_factory: Callable[[int], Any] = psutil.Process,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(interval)
+        self._pids = pids
+        self._process_factory = process_factory
+        self._clock = clock
+        self._entries: Dict[int, _ProcessEntry] = {}
+        self._snapshot = ProcessSnapshot()
+        self._refreshed_at = 0.0
+        # 进程表实例的标识，与版本号一起唯一确定一份快照（重启后版本号从头计数）
+        self.epoch = int(time.time() * 1000)
+
+    @property
+    def version(self) -> int:
+        """快照版本号，每次刷新加一"""
+        return self._snapshot.version
+
+    @property
+    def snapshot(self) -> ProcessSnapshot:
+        """当前快照，尚未刷新过时同步刷新一次"""
+        if not self._snapshot.version:
+            self.tick()
+        return self._snapshot
+
+    def _sample(self, entry: _ProcessEntry, now: float) -> bool:
+        """采样单个进程，进程已退出或PID已被新进程复用时返回False"""
+        proc = entry.proc
+        try:
+            with proc.oneshot():
+                create_time = _read_create_time(proc)
+                if entry.create_time is None:
+                    entry.create_time = create_time
+                elif create_time != entry.create_time:
+                    return False
+                entry.name = proc.name()
+                # 父进程退出后会被过继，每轮都重新读取
+                entry.ppid = proc.ppid()
+                times = proc.cpu_times()
+                entry.rss = proc.memory_info().rss
+                if entry.user is None:
+                    self._describe(entry)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return False
+        except psutil.AccessDenied:
+            # 无权限读取的进程保留在表中但不再采样，避免每轮重复尝试
+            entry.denied = True
+            return True
+
+        cpu_time = times.user + times.system
+        if entry.cpu_time is not None and cpu_time >= entry.cpu_time and now > entry.sampled_at:
+            entry.cpu_percent = (cpu_time - entry.cpu_time) / (now - entry.sampled_at) * 100
+        else:
+            # 首次采样，本轮没有可用的增量
+            entry.cpu_percent = 0.0
+        entry.cpu_time = cpu_time
+        entry.sampled_at = now
+        return True
+
+    def _create(self, pid: int) -> Optional[_ProcessEntry]:
+        try:
+            return _ProcessEntry(self._process_factory(pid))
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+
+    @staticmethod
+    def _describe(entry: _ProcessEntry):
+        """读取进程的用户和命令行，无权限读取时留空"""
+        proc = entry.proc
+        try:
+            entry.user = proc.username()
+        except (psutil.AccessDenied, KeyError):
+            entry.user = ""
+        try:
+            entry.cmdline = " ".join(proc.cmdline())[:MAX_CMDLINE]
+        except psutil.AccessDenied:
+            entry.cmdline = ""
+
+    def tick(self):
+        """刷新一次进程表"""
+        now = self._clock()
+        current = set(self._pids())
+        entries = self._entries
+
+        # 移除已退出的进程
+        for pid in [pid for pid in entries if pid not in current]:
+            del entries[pid]
+
+        # 只为新出现的进程创建对象
+        for pid in current:
+            if pid not in entries:
+                entry = self._create(pid)
+                if entry is not None:
+                    entries[pid] = entry
+
+        rows = []
+        for pid, entry in list(entries.items()):
+            if entry.denied:
+                continue
+            if not self._sample(entry, now):
+                # 进程已退出，或PID已被新进程复用：上一个进程的用户、命令行和CPU时间都不再适用，重新建立
+                entry = self._create(pid)
+                if entry is None or not self._sample(entry, now):
+                    entries.pop(pid, None)
+                    continue
+                entries[pid] = entry
+            if not entry.denied:
+                rows.append(entry)
+
+        self._snapshot = ProcessSnapshot.from_entries(rows, self._snapshot.version + 1, time.time())
+        self._refreshed_at = time.monotonic()
+        self._notify(self._snapshot.version)
+
+    prime = tick
+
+    def query(self, sort: str = "memory", descending: Optional[bool] = None, pattern: Optional[str] = None,
+              user: Optional[str] = None, offset: int = 0, limit: Optional[int] = None,
+              fields=DEFAULT_PROCESS_FIELDS) -> Dict[str, Any]:
+        """在当前快照上过滤、排序并分页，结果附带快照版本"""
+        snapshot = self.snapshot
+        processes, total = snapshot.query(sort, descending, pattern, user, offset, limit, fields)
+        return {
+            "processes": processes,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "version": snapshot.version,
+            "timestamp": snapshot.timestamp,
+            "summary": snapshot.summary(),
+        }
+
+    def top(self, limit: int, sort: str = "memory") -> List[Dict[str, Any]]:
+        """按内存或CPU取前N个进程"""
+        return self.snapshot.query(sort, offset=0, limit=max(limit, 0))[0]
+
+    def age(self) -> float:
+        """距上次刷新的秒数"""
+        return round(time.monotonic() - self._refreshed_at, 3)
+
+    @property
+    def timestamp(self) -> float:
+        """当前快照的采样时间"""
+        return self._snapshot.timestamp
+
+    @property
+    def tag(self) -> str:
+        """快照标识，可用作ETag的一部分"""
+        return f"{self.epoch:x}.{self._snapshot.version}"
+
+    def columns(self) -> Dict[str, Any]:
+        """导出当前快照（列式），用于同步到其他进程"""
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "epoch": self.epoch,
+            "timestamp": snapshot.timestamp,
+            "age": self.age(),
+            "pid": snapshot.pid.tolist(),
+            "ppid": snapshot.ppid.tolist(),
+            "name": snapshot.name,
+            "user": snapshot.user,
+            "cmdline": snapshot.cmdline,
+            "rss": snapshot.rss.tolist(),
+            "cpu_percent": [round(v, 2) for v in snapshot.cpu_percent],
+        }
+
+    def load(self, columns: Dict[str, Any]):
+        """载入其他进程导出的快照，代替本地采样"""
+        count = len(columns["pid"])
+        self._snapshot = ProcessSnapshot(
+            columns["version"], columns["timestamp"], columns["pid"], columns["name"],
+            columns.get("user") or [""] * count, columns.get("cmdline") or [""] * count,
+            columns["rss"], columns["cpu_percent"], columns.get("ppid"))
+        self.epoch = columns["epoch"]
+        self._refreshed_at = time.monotonic() - columns.get("age", 0.0)
+        self._notify(self._snapshot.version)
+
+# 全局采样器
+resource_sampler = ResourceSampler()
+process_table = ProcessTable()
+
+# 启动所有监控任务
+async def start_monitors():
+    config = get_monitor_config()
+    resource_sampler.interval = config["interval"]
+    resource_sampler.disk_path = config["disk_path"]
+    process_table.interval = config["process_interval"]
+    resource_sampler.start()
+    process_table.start()
+
+# 停止所有监控任务
+async def stop_monitors():
+    await resource_sampler.stop()
+    await process_table.stop()
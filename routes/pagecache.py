@@ -0,0 +1,110 @@
+# -- coding: utf-8 --
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, FrozenSet, Optional, Tuple
+
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Template, meta
+
+from .utils import read_config, config_store
+from .assets import asset_pipeline
+
+logger = logging.getLogger("pages")
+
+# 获取页面缓存配置
+def get_page_cache_config() -> Dict[str, Any]:
+    """获取页面缓存配置（server.page_cache）"""
+    section = (read_config().get("server", {}) or {}).get("page_cache", {}) or {}
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "max_entries": int(section.get("max_entries", 128)),
+    }
+
+class PageCache:
+    """渲染结果缓存
+
+    缓存键由模板名和模板实际引用到的上下文变量组成（通过解析模板得到），
+    与模板无关的上下文（如未被使用的user）不会让缓存分裂。
+    配置文件被写入、静态资源清单重新载入或模板文件修改后，缓存整体失效。
+    引用了request的模板不缓存。
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self.enabled = True
+        self._entries: "OrderedDict[Tuple, Tuple[bytes, str, Template]]" = OrderedDict()
+        # 模板名 -> (模板对象, 引用的变量)
+        self._variables: Dict[str, Tuple[Template, FrozenSet[str]]] = {}
+        self._generation: Optional[Tuple[str, int]] = None
+        self._lock = threading.Lock()
+
+    def configure(self, config: Dict[str, Any]):
+        with self._lock:
+            self.enabled = config["enabled"]
+            self.max_entries = config["max_entries"]
+            self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._variables.clear()
+
+    def _referenced(self, templates: Jinja2Templates, name: str) -> Tuple[Template, FrozenSet[str]]:
+        """模板引用的上下文变量（不含全局函数），模板文件修改后重新解析"""
+        template = templates.get_template(name)
+        known = self._variables.get(name)
+        if known is not None and known[0] is template:
+            return known
+        env = templates.env
+        source = env.loader.get_source(env, name)[0]
+        names = frozenset(meta.find_undeclared_variables(env.parse(source)) - set(env.globals))
+        self._variables[name] = (template, names)
+        return template, names
+
+    def _check_generation(self):
+        generation = (config_store.stamp, asset_pipeline.generation)
+        if generation != self._generation:
+            with self._lock:
+                self._entries.clear()
+                self._generation = generation
+
+    @staticmethod
+    def _key_value(value: Any) -> str:
+        if value is not None and value is read_config():
+            # 整个配置只需用文件标识代表，不必逐项序列化
+            return config_store.stamp
+        return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+    def render(self, templates: Jinja2Templates, name: str, context: Dict[str, Any]) -> HTMLResponse:
+        """渲染页面，命中缓存时直接返回已编码的HTML和ETag"""
+        if not self.enabled:
+            return templates.TemplateResponse(name, context)
+        template, names = self._referenced(templates, name)
+        if "request" in names:
+            return templates.TemplateResponse(name, context)
+
+        self._check_generation()
+        key = (name,) + tuple((var, self._key_value(context.get(var))) for var in sorted(names))
+        entry = self._entries.get(key)
+        # 模板文件修改后get_template返回新的模板对象，旧条目自然失效
+        if entry is not None and entry[2] is template:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+            body, etag = entry[0], entry[1]
+        else:
+            body = template.render(context).encode("utf-8")
+            etag = '"' + hashlib.blake2b(body, digest_size=10).hexdigest() + '"'
+            with self._lock:
+                self._entries[key] = (body, etag, template)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return HTMLResponse(body, headers={"ETag": etag})
+
+# 全局页面缓存
+page_cache = PageCache()
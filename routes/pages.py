@@ -5,6 +5,8 @@ import logging
 
 from .auth import get_current_user
 from .utils import read_config
+from .pagecache import page_cache
+from .credentials import credential_store
 
 router = APIRouter(tags=["pages"])
 # templates将在__init__.py中被设置
@@ -22,7 +24,7 @@ async def root(request: Request):
 
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return page_cache.render(templates, "login.html", {"request": request})
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def dashboard_page(request: Request, user: dict = Depends(get_current_user)):
@@ -33,12 +35,11 @@ async def dashboard_page(request: Request, user: dict = Depends(get_current_user
         if config.get("server", {}).get("is_new", False):
             return RedirectResponse(url="/start")
         
-        # 检查是否使用默认密码
-        default_password = config.get("server", {}).get("password") == "ilovefirefly"
-        default_username = config.get("server", {}).get("username") == "ilovefirefly"
-        show_password_warning = default_password and default_username
+        # 检查是否仍在使用默认账号密码（明文密码已迁移为哈希，由迁移时记录的标记判断）
+        show_password_warning = credential_store.uses_default_password()
         
-        return templates.TemplateResponse(
+        return page_cache.render(
+            templates,
             "dashboard.html", 
             {
                 "request": request, 
@@ -64,7 +65,8 @@ async def settings_page(request: Request, user: dict = Depends(get_current_user)
             "speed": 1.0
         })
         
-        return templates.TemplateResponse(
+        return page_cache.render(
+            templates,
             "settings.html", 
             {
                 "request": request, 
@@ -86,7 +88,8 @@ async def start_page(request: Request, user: dict = Depends(get_current_user)):
         if not config.get("server", {}).get("is_new", True):
             return RedirectResponse(url="/dashboard")
         
-        return templates.TemplateResponse(
+        return page_cache.render(
+            templates,
             "start.html", 
             {
                 "request": request, 
@@ -103,7 +106,8 @@ async def logs_page(request: Request, user: dict = Depends(get_current_user)):
     try:
         config = read_config()
         
-        return templates.TemplateResponse(
+        return page_cache.render(
+            templates,
             "logs.html", 
             {
                 "request": request, 
@@ -120,7 +124,8 @@ async def processes_page(request: Request, user: dict = Depends(get_current_user
     try:
         config = read_config()
         
-        return templates.TemplateResponse(
+        return page_cache.render(
+            templates,
             "processes.html", 
             {
                 "request": request, 
@@ -135,15 +140,15 @@ async def processes_page(request: Request, user: dict = Depends(get_current_user
 @router.get("/run")
 async def run_page(request: Request, user: dict = Depends(get_current_user)):
     try:
-        return templates.TemplateResponse("run.html", {"request": request, "user": user})
+        return page_cache.render(templates, "run.html", {"request": request, "user": user})
     except Exception as e:
         logger.error(f"加载运行页面失败: {e}")
-        return templates.TemplateResponse("error.html", {"request": request, "error": str(e)})
+        return page_cache.render(templates, "error.html", {"request": request, "error": str(e)})
 
 @router.get("/error")
 async def error_page(request: Request, error: str = "未知错误"):
     try:
-        return templates.TemplateResponse("error.html", {"request": request, "error": error})
+        return page_cache.render(templates, "error.html", {"request": request, "error": error})
     except Exception as e:
         logger.error(f"加载错误页面失败: {e}")
-        return templates.TemplateResponse("error.html", {"request": request, "error": "页面加载失败"})
\ No newline at end of file
+        return page_cache.render(templates, "error.html", {"request": request, "error": "页面加载失败"})
\ No newline at end of file
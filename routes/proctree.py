@@ -0,0 +1,265 @@
+# -- coding: utf-8 --
+"""进程树：由进程表快照中的父进程PID建立父子关系，并计算每个子树的内存和CPU合计
+
+机器人端（如zhenxun、yunzai）和协议端（如NapCat）通常是一棵进程树：node或python主进程
+加上浏览器和各种辅助子进程，只看单个进程无法知道一个服务总共占用了多少资源。
+
+父子关系在两次快照之间增量维护：只处理新出现、已退出和被过继的进程，其余节点保持不变；
+节点按深度分层，子树合计从最深的一层开始逐层累加到父节点，一次遍历完成。
+"""
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .monitor import ProcessSnapshot, ProcessTable, process_table
+
+MB = 1024 * 1024
+# 子节点的排序方式
+TREE_SORT_KEYS = ("memory", "cpu", "pid", "name")
+# 默认展开的层数
+DEFAULT_TREE_DEPTH = 2
+
+class ProcessTreeError(Exception):
+    """查询的进程不存在等，消息直接返回给用户"""
+
+class ProcessTree:
+    """增量维护的进程树，首次查询时建立，之后每次查询前同步到进程表的最新快照"""
+
+    def __init__(self, table: ProcessTable):
+        self.table = table
+        self.snapshot: Optional[ProcessSnapshot] = None
+        # 进程上报的父进程PID，以及树中实际挂接的父节点（父进程不在快照中时为None，即作为根节点）
+        self.ppid: Dict[int, int] = {}
+        self.parent: Dict[int, Optional[int]] = {}
+        self.children: Dict[int, Set[int]] = {}
+        self.roots: Set[int] = set()
+        # 父进程尚未出现在快照中的节点（如无权限读取的进程的子进程），父进程出现后挂接
+        self.waiting: Dict[int, Set[int]] = {}
+        self.depth: Dict[int, int] = {}
+        self.levels: List[Set[int]] = []
+        # 子树合计，按快照中的行号存放
+        self.rows: Dict[int, int] = {}
+        self.total_rss = array("Q")
+        self.total_cpu = array("d")
+        self.descendants = array("q")
+        # 最近一次同步的变化
+        self.changes = {"added": 0, "removed": 0, "moved": 0}
+        self._lock = threading.Lock()
+
+    def sync(self) -> bool:
+        """同步到进程表的最新快照，有新快照时返回True"""
+        snapshot = self.table.snapshot
+        if snapshot is self.snapshot:
+            return False
+        with self._lock:
+            if snapshot is self.snapshot:
+                return False
+            self._apply(snapshot)
+            self._sum(snapshot)
+            self.snapshot = snapshot
+        return True
+
+    # 父子关系
+
+    def _apply(self, snapshot: ProcessSnapshot):
+        current = dict(zip(snapshot.pid, snapshot.ppid))
+        old = self.ppid
+        removed = [pid for pid in old if pid not in current]
+        added = []
+        moved = []
+        for pid, ppid in current.items():
+            previous = old.get(pid)
+            if previous is None:
+                added.append(pid)
+            elif previous != ppid:
+                moved.append(pid)
+
+        relink: Set[int] = set()
+        for pid in removed:
+            self._detach(pid)
+            for child in self.children.pop(pid):
+                self.parent[child] = None
+                # 仍在快照中的子进程重新挂接（通常已被过继，会同时出现在moved中）
+                if child in current:
+                    relink.add(child)
+            self._set_depth(pid, None)
+            del self.ppid[pid], self.parent[pid]
+        for pid in added:
+            self.ppid[pid] = current[pid]
+            self.parent[pid] = None
+            self.children[pid] = set()
+            relink.add(pid)
+        for pid in added:
+            # 之前找不到父进程的节点
+            relink.update(self.waiting.pop(pid, ()))
+        for pid in moved:
+            self._detach(pid)
+            self.ppid[pid] = current[pid]
+            relink.add(pid)
+
+        for pid in relink:
+            self._detach(pid)
+        for pid in relink:
+            self._attach(pid)
+        self._update_depths(relink)
+        self.changes = {"added": len(added), "removed": len(removed), "moved": len(moved)}
+
+    def _detach(self, pid: int):
+        parent = self.parent.get(pid)
+        if parent is not None:
+            self.children[parent].discard(pid)
+        else:
+            self.roots.discard(pid)
+            waiting = self.waiting.get(self.ppid[pid])
+            if waiting is not None:
+                waiting.discard(pid)
+                if not waiting:
+                    del self.waiting[self.ppid[pid]]
+        self.parent[pid] = None
+
+    def _attach(self, pid: int):
+        ppid = self.ppid[pid]
+        if ppid in self.ppid and ppid != pid and not self._is_ancestor(pid, ppid):
+            self.parent[pid] = ppid
+            self.children[ppid].add(pid)
+            return
+        self.parent[pid] = None
+        self.roots.add(pid)
+        if ppid > 0 and ppid not in self.ppid:
+            self.waiting.setdefault(ppid, set()).add(pid)
+
+    def _is_ancestor(self, pid: int, node: int) -> bool:
+        """pid是否为node的祖先（挂接后会形成环）"""
+        while node is not None:
+            if node == pid:
+                return True
+            node = self.parent.get(node)
+        return False
+
+    def _set_depth(self, pid: int, depth: Optional[int]):
+        previous = self.depth.get(pid)
+        if previous == depth:
+            return
+        if previous is not None:
+            self.levels[previous].discard(pid)
+        if depth is None:
+            del self.depth[pid]
+        else:
+            while len(self.levels) <= depth:
+                self.levels.append(set())
+            self.levels[depth].add(pid)
+            self.depth[pid] = depth
+        while self.levels and not self.levels[-1]:
+            self.levels.pop()
+
+    def _update_depths(self, relinked: Iterable[int]):
+        """重新计算挂接位置变化的节点及其子树的深度；祖先也变化过的节点由祖先一并处理"""
+        relinked = set(relinked)
+        for pid in relinked:
+            node = self.parent[pid]
+            while node is not None and node not in relinked:
+                node = self.parent[node]
+            if node is not None:
+                continue
+            parent = self.parent[pid]
+            stack = [(pid, 0 if parent is None else self.depth[parent] + 1)]
+            while stack:
+                node, depth = stack.pop()
+                self._set_depth(node, depth)
+                stack.extend((child, depth + 1) for child in self.children[node])
+
+    # 子树合计
+
+    def _sum(self, snapshot: ProcessSnapshot):
+        """从最深的一层开始，把每个节点的合计累加到父节点"""
+        rows = {pid: i for i, pid in enumerate(snapshot.pid)}
+        total_rss = array("Q", snapshot.rss)
+        total_cpu = array("d", snapshot.cpu_percent)
+        descendants = array("q", [0] * snapshot.size)
+        parent = self.parent
+        for level in reversed(self.levels):
+            for pid in level:
+                owner = parent[pid]
+                if owner is None:
+                    continue
+                row, up = rows[pid], rows[owner]
+                total_rss[up] += total_rss[row]
+                total_cpu[up] += total_cpu[row]
+                descendants[up] += descendants[row] + 1
+        self.rows = rows
+        self.total_rss = total_rss
+        self.total_cpu = total_cpu
+        self.descendants = descendants
+
+    # 查询
+
+    def view(self, root: Optional[int] = None, depth: int = DEFAULT_TREE_DEPTH, expand: Iterable[int] = (),
+             collapse: Iterable[int] = (), sort: str = "memory",
+             labels: Optional[Dict[int, str]] = None) -> Dict[str, Any]:
+        """以嵌套结构返回进程树
+
+        root为空时返回整个森林，否则只返回以root为根的子树。从根算起depth层以内的节点默认展开，
+        expand中的节点总是展开，collapse中的节点总是折叠；折叠的节点只返回子树合计。
+        labels为PID到名称的映射（如受管服务），对应节点带上service字段。
+        """
+        self.sync()
+        if sort not in TREE_SORT_KEYS:
+            raise ProcessTreeError(f"sort应为{'、'.join(TREE_SORT_KEYS)}之一")
+        with self._lock:
+            snapshot = self.snapshot
+            if root is not None and root not in self.rows:
+                raise ProcessTreeError(f"进程不存在: {root}")
+            expand, collapse = set(expand), set(collapse)
+            labels = labels or {}
+            rows = self.rows
+            if sort == "memory":
+                key = lambda pid: (-self.total_rss[rows[pid]], pid)
+            elif sort == "cpu":
+                key = lambda pid: (-self.total_cpu[rows[pid]], pid)
+            elif sort == "name":
+                key = lambda pid: (snapshot.name[rows[pid]].lower(), pid)
+            else:
+                key = None
+
+            def build(pid: int, level: int) -> Dict[str, Any]:
+                row = rows[pid]
+                node = {
+                    "pid": pid,
+                    "ppid": snapshot.ppid[row],
+                    "name": snapshot.name[row],
+                    "user": snapshot.user[row],
+                    "memory_mb": round(snapshot.rss[row] / MB, 1),
+                    "cpu_percent": round(snapshot.cpu_percent[row], 1),
+                    "total_memory_mb": round(self.total_rss[row] / MB, 1),
+                    "total_cpu_percent": round(self.total_cpu[row], 1),
+                    "descendants": self.descendants[row],
+                    "children": [],
+                }
+                if pid in labels:
+                    node["service"] = labels[pid]
+                children = self.children[pid]
+                opened = pid not in collapse and (level < depth or pid in expand)
+                node["collapsed"] = bool(children) and not opened
+                if children and opened:
+                    node["children"] = [build(child, level + 1) for child in sorted(children, key=key)]
+                return node
+
+            tops = [root] if root is not None else sorted(self.roots, key=key)
+            # 从最外层到最内层的祖先，便于定位子树
+            path = []
+            node = self.parent.get(root) if root is not None else None
+            while node is not None:
+                path.append(node)
+                node = self.parent[node]
+            return {
+                "version": snapshot.version,
+                "timestamp": snapshot.timestamp,
+                "count": snapshot.size,
+                "root": root,
+                "path": path[::-1],
+                "tree": [build(pid, 0) for pid in tops],
+                "changes": dict(self.changes),
+            }
+
+# 全局进程树
+process_tree = ProcessTree(process_table)
@@ -0,0 +1,263 @@
+# -- coding: utf-8 --
+"""运行时诊断：事件循环阻塞检测和采样式CPU分析
+
+LoopMonitor在事件循环中定时打点，由另一个线程检查打点是否按时到达；超过阈值时抓取事件循环
+线程当时的调用栈，也就是造成阻塞的代码。Profiler在指定时长内定时采样各线程的调用栈，输出
+火焰图工具（flamegraph.pl、speedscope、inferno等）可直接读取的折叠栈格式。
+两者都不需要重启进程，多worker模式下只作用于当前进程。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import read_config
+
+logger = logging.getLogger("profiling")
+
+# 单次CPU分析的最长时间（秒）和最高采样频率
+MAX_PROFILE_SECONDS = 60
+MAX_PROFILE_HZ = 1000
+# 调用栈最多保留的层数（从最内层算起）
+MAX_STACK_DEPTH = 128
+# 线程空闲等待时所在的函数，默认不计入CPU分析
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 获取事件循环阻塞检测配置
+def get_loop_monitor_config() -> Dict[str, Any]:
+    """获取事件循环阻塞检测配置（monitor.loop_lag）"""
+    section = (read_config().get("monitor", {}) or {}).get("loop_lag", {}) or {}
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "threshold_ms": max(1.0, float(section.get("threshold_ms", 100))),
+        "interval_ms": max(1.0, float(section.get("interval_ms", 50))),
+        "history": max(1, int(section.get("history", 50))),
+    }
+
+# 缩短文件路径：项目内的文件用相对路径，第三方库从包名开始
+def short_path(filename: str) -> str:
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        return os.path.relpath(filename, PROJECT_ROOT)
+    marker = "site-packages" + os.sep
+    index = filename.rfind(marker)
+    if index >= 0:
+        return filename[index + len(marker):]
+    return os.path.basename(filename) if os.path.isabs(filename) else filename
+
+# 调用栈（从最外层到最内层），每帧格式为"函数 (文件:行号)"，与py-spy的折叠栈一致
+def frame_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({short_path(code.co_filename)}:{frame.f_lineno})".replace(";", ":"))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+class LoopMonitor:
+    """事件循环阻塞检测
+
+    事件循环中的协程每interval打一次点；看门狗线程发现打点逾期超过threshold时，抓取事件循环
+    线程的调用栈。阻塞结束后记录阻塞时长、调用栈和当时正在处理的请求，并通知监听器每次打点的延迟。
+    """
+
+    def __init__(self):
+        self.threshold = 0.1
+        self.interval = 0.05
+        self.stalls: deque = deque(maxlen=50)
+        self.stalls_total = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        # 由HTTP指标提供：根据asyncio任务返回正在处理的请求（如"GET /api/processes"）
+        self.describe_task: Optional[Callable[[Any], Optional[str]]] = None
+        self._listeners: List[Callable[[float], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = 0.0
+        # 看门狗为当前这次阻塞抓到的信息，阻塞结束时取走
+        self._captured: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def configure(self, config: Dict[str, Any]):
+        self.threshold = config["threshold_ms"] / 1000
+        self.interval = config["interval_ms"] / 1000
+        if self.stalls.maxlen != config["history"]:
+            self.stalls = deque(self.stalls, maxlen=config["history"])
+
+    def add_listener(self, callback: Callable[[float], None]):
+        """注册回调，每次打点后在事件循环中以延迟（秒）调用"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[float], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    @property
+    def watchdog_ident(self) -> Optional[int]:
+        return self._thread.ident if self._thread is not None else None
+
+    async def _run(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._beat - self.interval)
+            self._observe(lag)
+
+    def _observe(self, lag: float):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        for callback in list(self._listeners):
+            try:
+                callback(lag)
+            except Exception as e:
+                logger.error(f"事件循环监控回调失败: {str(e)}")
+        if lag < self.threshold:
+            return
+        with self._lock:
+            captured, self._captured = self._captured, None
+        captured = captured or {}
+        stall = {
+            "time": time.time() - lag,
+            "duration_ms": round(lag * 1000, 1),
+            "request": captured.get("request"),
+            "stack": captured.get("stack", []),
+        }
+        self.stalls.append(stall)
+        self.stalls_total += 1
+        where = stall["stack"][-1] if stall["stack"] else "未抓到调用栈"
+        logger.warning(f"事件循环阻塞了{stall['duration_ms']:.0f}ms"
+                       f"{'（' + stall['request'] + '）' if stall['request'] else ''}: {where}")
+
+    def _watch(self):
+        captured_beat = None
+        while not self._stop.wait(max(self.threshold / 4, 0.005)):
+            beat = self._beat
+            if beat == captured_beat or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            # 打点逾期，事件循环线程此刻执行的代码就是阻塞的原因
+            captured_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            request = None
+            if self.describe_task is not None and self._loop is not None:
+                try:
+                    task = asyncio.current_task(self._loop)
+                    request = self.describe_task(task) if task is not None else None
+                except Exception:
+                    request = None
+            with self._lock:
+                self._captured = {"stack": frame_stack(frame) if frame is not None else [], "request": request}
+            del frame
+
+    def start(self):
+        """在当前事件循环中启动打点，并启动看门狗线程"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._stop.set()
+            await asyncio.to_thread(self._thread.join, 5)
+            self._thread = None
+
+    def report(self) -> Dict[str, Any]:
+        """当前延迟、历史最大延迟和最近的阻塞记录（新的在前）"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "interval_ms": round(self.interval * 1000, 1),
+            "lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls_total": self.stalls_total,
+            "stalls": list(reversed(self.stalls)),
+        }
+
+class ProfilerBusy(Exception):
+    """已有CPU分析正在进行"""
+
+class Profiler:
+    """采样式CPU分析器：定时读取各线程的调用栈并按调用栈计数"""
+
+    def __init__(self, monitor: Optional[LoopMonitor] = None):
+        self.monitor = monitor
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, hz: int = 100, idle: bool = False) -> Dict[str, Any]:
+        """采样seconds秒，返回折叠栈文本（每行"线程;外层帧;...;内层帧 次数"）和采样统计
+
+        idle为False时跳过在锁、队列、select上空闲等待的线程。
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            seconds = min(max(seconds, 0.01), MAX_PROFILE_SECONDS)
+            interval = 1.0 / min(max(hz, 1), MAX_PROFILE_HZ)
+            skip = {threading.get_ident()}
+            if self.monitor is not None and self.monitor.watchdog_ident is not None:
+                skip.add(self.monitor.watchdog_ident)
+            stacks: Counter = Counter()
+            samples = 0
+            started = time.perf_counter()
+            scheduled = started
+            frame = None
+            while scheduled - started < seconds:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident in skip or (not idle and is_idle(frame)):
+                        continue
+                    name = names.get(ident, f"thread-{ident}").replace(";", ":").replace(" ", "_")
+                    stacks[";".join([name] + frame_stack(frame))] += 1
+                del frame
+                samples += 1
+                scheduled += interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # 采样跟不上时从当前时刻重新计划
+                    scheduled = time.perf_counter()
+            elapsed = time.perf_counter() - started
+        finally:
+            self._lock.release()
+        text = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return {"folded": text, "samples": samples, "seconds": round(elapsed, 3), "stacks": len(stacks)}
+
+# 全局事件循环监控和CPU分析器
+loop_monitor = LoopMonitor()
+profiler = Profiler(loop_monitor)
@@ -0,0 +1,285 @@
+# -- coding: utf-8 --
+import json
+import asyncio
+import logging
+from urllib.parse import urlparse
+from typing import Dict, Any, List, Optional, Set, Tuple, FrozenSet
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from .monitor import resource_sampler, process_table, format_resources, PROCESS_SORT_KEYS
+from .logindex import log_store
+from .logstream import log_follower, LogFilter, Subscription
+from .supervisor import supervisor
+
+logger = logging.getLogger("realtime")
+
+# 可订阅的主题
+TOPICS = ("resources", "processes", "logs", "services")
+# 单个连接积压的日志条数上限
+LOG_BACKLOG = 200
+# 进程列表最多推送的条数
+MAX_PROCESS_LIMIT = 100
+
+# 编码一条推送消息
+def encode(topic: str, data: Any, **extra) -> str:
+    return json.dumps({"topic": topic, "data": data, **extra}, ensure_ascii=False)
+
+# 检查WebSocket请求来源，防止其他站点借用登录Cookie建立连接
+def check_origin(websocket: WebSocket) -> bool:
+    origin = websocket.headers.get("origin")
+    if not origin:
+        return True
+    return urlparse(origin).netloc == websocket.headers.get("host")
+
+class Connection:
+    """一个浏览器标签页的WebSocket连接
+
+    资源、进程和服务状态只保留最新一条待发消息，客户端处理慢时旧状态直接被覆盖；
+    日志按条积压，超过上限时丢弃最旧的条目并告知客户端丢弃数量。
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        self.process_key: Tuple[str, int] = ("memory", 5)
+        self._log_subscription: Optional[Subscription] = None
+        self._log_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, str] = {}
+        self._logs: List[Dict[str, Any]] = []
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+
+    def push(self, topic: str, message: str):
+        """放入待发送消息，同一主题只保留最新一条"""
+        self._pending[topic] = message
+        self._wakeup.set()
+
+    def offer(self, topic: str, message: str):
+        """已订阅该主题时才放入"""
+        if topic in self.topics:
+            self.push(topic, message)
+
+    def offer_logs(self, entries: List[Dict[str, Any]], dropped: int = 0):
+        self._logs.extend(entries)
+        overflow = len(self._logs) - LOG_BACKLOG
+        if overflow > 0:
+            del self._logs[:overflow]
+            dropped += overflow
+        self._dropped += dropped
+        self._wakeup.set()
+
+    async def send_loop(self):
+        """唯一的写入任务，合并积压的消息后写入WebSocket"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, {}
+            for message in pending.values():
+                await self.websocket.send_text(message)
+            if self._logs or self._dropped:
+                logs, self._logs = self._logs, []
+                dropped, self._dropped = self._dropped, 0
+                await self.websocket.send_text(encode("logs", logs, dropped=dropped))
+
+    async def _pump_logs(self, subscription: Subscription):
+        while True:
+            entries = [await subscription.queue.get()]
+            while not subscription.queue.empty():
+                entries.append(subscription.queue.get_nowait())
+            self.offer_logs(entries, subscription.take_dropped())
+
+    async def follow_logs(self, log_filter: LogFilter, resume: Optional[str] = None) -> List[Dict[str, Any]]:
+        """订阅新日志，返回断线期间需要补发的条目"""
+        await self.stop_logs()
+        subscription, replay = await log_follower.subscribe(log_filter, resume)
+        self._log_subscription = subscription
+        self._log_task = asyncio.create_task(self._pump_logs(subscription))
+        return replay
+
+    async def stop_logs(self):
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
+        if self._log_subscription is not None:
+            log_follower.unsubscribe(self._log_subscription)
+            self._log_subscription = None
+        self._logs = []
+        self._dropped = 0
+
+class RealtimeHub:
+    """WebSocket推送中心
+
+    资源采样器和进程表每次tick只产出一份数据，在采样线程中编码一次后分发给所有连接，
+    打开多少个仪表盘都不会增加采样次数。没有连接时不注册任何回调。
+    """
+
+    def __init__(self):
+        self.connections: Set[Connection] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._services: Optional[str] = None
+        # 各连接请求的(排序, 条数)组合，在事件循环中整体替换，采样线程只读
+        self._process_keys: FrozenSet[Tuple[str, int]] = frozenset()
+
+    def _attach(self):
+        self._loop = asyncio.get_running_loop()
+        resource_sampler.add_listener(self._on_resources)
+        process_table.add_listener(self._on_processes)
+
+    def _detach(self):
+        resource_sampler.remove_listener(self._on_resources)
+        process_table.remove_listener(self._on_processes)
+        self._services = None
+
+    def _refresh_process_keys(self):
+        self._process_keys = frozenset(conn.process_key for conn in self.connections
+                                       if "processes" in conn.topics)
+
+    def _broadcast(self, topic: str, message: str):
+        for conn in self.connections:
+            conn.offer(topic, message)
+
+    # 以下两个回调在采样线程中执行
+    def _on_resources(self, snapshot: Dict[str, Any]):
+        message = encode("resources", format_resources(snapshot))
+        self._loop.call_soon_threadsafe(self._publish_resources, message)
+
+    def _on_processes(self, version: int):
+        messages = {key: encode("processes", process_table.top(key[1], key[0]), version=version)
+                    for key in self._process_keys}
+        if messages:
+            self._loop.call_soon_threadsafe(self._publish_processes, messages)
+
+    def _publish_resources(self, message: str):
+        self._broadcast("resources", message)
+        # 服务状态变化不频繁，随资源采样一起检查，有变化才推送
+        self._publish_services()
+
+    def _publish_processes(self, messages: Dict[Tuple[str, int], str]):
+        for conn in self.connections:
+            message = messages.get(conn.process_key)
+            if message is not None:
+                conn.offer("processes", message)
+
+    def _publish_services(self):
+        message = encode("services", supervisor.status())
+        if message != self._services:
+            self._services = message
+            self._broadcast("services", message)
+
+    async def _subscribe(self, conn: Connection, topic: str, options: Dict[str, Any]):
+        conn.topics.add(topic)
+        # 订阅后立即发送当前状态，不必等待下一次采样
+        if topic == "resources":
+            snapshot = await asyncio.to_thread(resource_sampler.snapshot)
+            conn.push(topic, encode(topic, format_resources(snapshot)))
+        elif topic == "processes":
+            sort = options.get("sort", "memory")
+            sort = sort if sort in PROCESS_SORT_KEYS else "memory"
+            limit = min(max(int(options.get("limit", 5)), 1), MAX_PROCESS_LIMIT)
+            conn.process_key = (sort, limit)
+            self._refresh_process_keys()
+            rows = await asyncio.to_thread(process_table.top, limit, sort)
+            conn.push(topic, encode(topic, rows, version=process_table.version))
+        elif topic == "services":
+            conn.push(topic, encode(topic, supervisor.status()))
+        elif topic == "logs":
+            type_ = options.get("type", "all")
+            levels = None if type_ == "all" else [t.strip().lower() for t in type_.split(",")]
+            log_filter = LogFilter(levels, options.get("source"), options.get("search"))
+            resume = options.get("resume")
+            recent = min(max(int(options.get("recent", 0)), 0), LOG_BACKLOG)
+            initial: List[Dict[str, Any]] = []
+            if recent and not resume:
+                result = await asyncio.to_thread(log_store.query, 1, recent, levels,
+                                                 log_filter.source, None, None, options.get("search"))
+                initial = list(reversed(result["logs"]))
+            initial += await conn.follow_logs(log_filter, resume)
+            conn.push("logs:initial", encode(topic, initial, initial=True))
+
+    async def _unsubscribe(self, conn: Connection, topic: str):
+        conn.topics.discard(topic)
+        if topic == "logs":
+            await conn.stop_logs()
+        elif topic == "processes":
+            self._refresh_process_keys()
+
+    @staticmethod
+    def _topic_options(topics: List[str], options: Any) -> Dict[str, Dict[str, Any]]:
+        """校验订阅选项，格式不对时抛出ValueError，在订阅任何主题之前完成"""
+        if not isinstance(options, dict):
+            raise ValueError("options必须是JSON对象")
+        result = {}
+        for topic in topics:
+            value = options.get(topic) or {}
+            if not isinstance(value, dict):
+                raise ValueError(f"{topic}的选项必须是JSON对象")
+            if topic == "logs":
+                for key in ("type", "source", "search", "resume"):
+                    if value.get(key) is not None and not isinstance(value[key], str):
+                        raise ValueError(f"logs的{key}选项必须是字符串")
+            elif topic == "processes" and not isinstance(value.get("sort", "memory"), str):
+                raise ValueError("processes的sort选项必须是字符串")
+            result[topic] = value
+        return result
+
+    async def _handle(self, conn: Connection, message: Dict[str, Any]):
+        action = message.get("action")
+        topics = message.get("topics") or []
+        if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+            raise ValueError("topics必须是字符串数组")
+        unknown = [topic for topic in topics if topic not in TOPICS]
+        if unknown:
+            conn.push("error", encode("error", f"未知主题: {', '.join(unknown)}"))
+            return
+        if action == "subscribe":
+            options = self._topic_options(topics, message.get("options") or {})
+            for topic in topics:
+                await self._subscribe(conn, topic, options[topic])
+        elif action == "unsubscribe":
+            for topic in topics:
+                await self._unsubscribe(conn, topic)
+        elif action == "ping":
+            conn.push("pong", encode("pong", None))
+        else:
+            conn.push("error", encode("error", f"未知操作: {action}"))
+
+    async def _receive_loop(self, conn: Connection):
+        while True:
+            text = await conn.websocket.receive_text()
+            try:
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise ValueError("消息必须是JSON对象")
+                await self._handle(conn, message)
+            except (ValueError, TypeError) as e:
+                conn.push("error", encode("error", f"无效的消息: {str(e)}"))
+
+    async def serve(self, websocket: WebSocket):
+        """处理一个已认证的WebSocket连接，直到客户端断开"""
+        await websocket.accept()
+        conn = Connection(websocket)
+        if not self.connections:
+            self._attach()
+        self.connections.add(conn)
+        receiver = asyncio.create_task(self._receive_loop(conn))
+        sender = asyncio.create_task(conn.send_loop())
+        tasks = [receiver, sender]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # 发送失败通常只是连接已关闭，只记录接收端的意外错误
+            if receiver in done:
+                error = receiver.exception()
+                if error is not None and not isinstance(error, WebSocketDisconnect):
+                    logger.error(f"实时推送连接异常: {str(error)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await conn.stop_logs()
+            self.connections.discard(conn)
+            self._refresh_process_keys()
+            if not self.connections:
+                self._detach()
+
+# 全局推送中心
+realtime_hub = RealtimeHub()
@@ -0,0 +1,267 @@
+# -- coding: utf-8 --
+import os
+import time
+import logging
+import psutil
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+
+from .monitor import PeriodicTask
+from .supervisor import supervisor, RUNNING
+from .utils import read_config
+
+logger = logging.getLogger("servicemon")
+
+# 环形缓冲区中记录的指标
+SERVICE_METRICS = ("rss", "uss", "cpu_percent", "threads", "fds", "children")
+
+# 解析服务监控配置
+def parse_service_monitor_config(section: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "interval": float(section.get("interval", 5.0)),
+        "history": int(section.get("history", 720)),
+        "leak_window": int(section.get("leak_window", 60)),
+        "leak_slope_mb_per_min": float(section.get("leak_slope_mb_per_min", 1.0)),
+        "leak_min_r2": float(section.get("leak_min_r2", 0.8)),
+        "memory_limit_mb": float(section.get("memory_limit_mb", 0)),
+        "cpu_limit_percent": float(section.get("cpu_limit_percent", 0)),
+        "limit_samples": int(section.get("limit_samples", 6)),
+        "auto_restart": bool(section.get("auto_restart", False)),
+    }
+
+# 获取服务监控配置
+def get_service_monitor_config() -> Dict[str, Any]:
+    """获取服务监控和泄漏检测配置（monitor.services）"""
+    section = (read_config().get("monitor", {}) or {}).get("services", {}) or {}
+    return parse_service_monitor_config(section)
+
+class RingBuffer:
+    """定长环形缓冲区，每个指标一列定长数组"""
+
+    def __init__(self, capacity: int, columns: Tuple[str, ...]):
+        self.capacity = capacity
+        self.columns = columns
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.pids = array("q", bytes(8 * capacity))
+        self.data = {name: array("d", bytes(8 * capacity)) for name in columns}
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, timestamp: float, pid: int, values: Dict[str, float]):
+        i = self.head
+        self.timestamps[i] = timestamp
+        self.pids[i] = pid
+        for name in self.columns:
+            self.data[name][i] = values.get(name, 0.0)
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _indices(self, n: int) -> List[int]:
+        n = min(n, self.count)
+        start = (self.head - n) % self.capacity
+        return [(start + k) % self.capacity for k in range(n)]
+
+    def tail(self, n: int) -> Dict[str, List[float]]:
+        """按时间顺序返回最近n个样本（列式）"""
+        indices = self._indices(n)
+        result = {"timestamp": [self.timestamps[i] for i in indices]}
+        for name in self.columns:
+            column = self.data[name]
+            result[name] = [column[i] for i in indices]
+        return result
+
+    def tail_for_pid(self, pid: int, n: int) -> Tuple[List[float], Dict[str, List[float]]]:
+        """返回最近n个样本中属于同一进程的连续尾部"""
+        indices = self._indices(n)
+        k = len(indices)
+        while k > 0 and self.pids[indices[k - 1]] == pid:
+            k -= 1
+        indices = indices[k:]
+        return ([self.timestamps[i] for i in indices],
+                {name: [self.data[name][i] for i in indices] for name in self.columns})
+
+# 最小二乘拟合，返回(斜率, 决定系数)
+def linear_fit(xs: List[float], ys: List[float]) -> Tuple[float, float]:
+    n = len(xs)
+    if n < 2:
+        return 0.0, 0.0
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    if sxx == 0:
+        return 0.0, 0.0
+    slope = sxy / sxx
+    r2 = (sxy * sxy) / (sxx * syy) if syy else 0.0
+    return slope, r2
+
+class ServiceStats:
+    """单个服务进程树的采样历史和泄漏检测状态"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.history = RingBuffer(capacity, SERVICE_METRICS)
+        self.current: Optional[Dict[str, Any]] = None
+        self.leak: Dict[str, Any] = {"suspected": False, "slope_mb_per_min": 0.0, "r2": 0.0, "samples": 0}
+        self.over_limit = 0
+        self.pid: Optional[int] = None
+        # pid -> (进程对象, 上次CPU时间, 上次采样时间)
+        self._procs: Dict[int, Tuple[psutil.Process, float, float]] = {}
+
+    def reset(self, pid: Optional[int]):
+        self.pid = pid
+        self._procs.clear()
+        self.over_limit = 0
+        self.leak = {"suspected": False, "slope_mb_per_min": 0.0, "r2": 0.0, "samples": 0}
+
+    def _process(self, pid: int) -> psutil.Process:
+        cached = self._procs.get(pid)
+        return cached[0] if cached else psutil.Process(pid)
+
+    def sample(self, now: float) -> Optional[Dict[str, Any]]:
+        """采样整棵进程树"""
+        try:
+            root = self._process(self.pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+
+        totals = {name: 0.0 for name in SERVICE_METRICS}
+        totals["children"] = len(tree) - 1
+        seen: Dict[int, Tuple[psutil.Process, float, float]] = {}
+        for proc in tree:
+            # 复用上次的进程对象，保留其缓存的信息
+            cached = self._procs.get(proc.pid)
+            if cached is not None:
+                proc = cached[0]
+            # 先读取全部字段，中途失败的进程整个不计入，避免只加了一部分
+            try:
+                with proc.oneshot():
+                    try:
+                        memory = proc.memory_full_info()
+                        uss = memory.uss
+                    except psutil.AccessDenied:
+                        memory = proc.memory_info()
+                        uss = 0
+                    threads = proc.num_threads()
+                    fds = proc.num_handles() if os.name == "nt" else proc.num_fds()
+                    times = proc.cpu_times()
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                continue
+            totals["uss"] += uss
+            totals["rss"] += memory.rss
+            totals["threads"] += threads
+            totals["fds"] += fds
+            cpu_time = times.user + times.system
+            previous = self._procs.get(proc.pid)
+            if previous is not None and now > previous[2] and cpu_time >= previous[1]:
+                totals["cpu_percent"] += (cpu_time - previous[1]) / (now - previous[2]) * 100
+            seen[proc.pid] = (proc, cpu_time, now)
+        self._procs = seen
+        return totals
+
+    def detect_leak(self, window: int, min_slope: float, min_r2: float):
+        """对滑动窗口内的RSS做线性拟合，持续增长时标记疑似泄漏"""
+        timestamps, columns = self.history.tail_for_pid(self.pid or 0, window)
+        rss_mb = [value / (1024 * 1024) for value in columns["rss"]]
+        minutes = [(t - timestamps[0]) / 60 for t in timestamps] if timestamps else []
+        slope, r2 = linear_fit(minutes, rss_mb)
+        self.leak = {
+            "suspected": len(timestamps) >= window and slope >= min_slope and r2 >= min_r2,
+            "slope_mb_per_min": round(slope, 3),
+            "r2": round(r2, 3),
+            "samples": len(timestamps),
+        }
+
+class ServiceMonitor(PeriodicTask):
+    """按间隔采样受管服务的进程树资源，并检测内存泄漏和失控进程"""
+
+    name = "服务资源"
+
+    def __init__(self, interval: float = 5.0):
+        super().__init__(interval)
+        self.config = parse_service_monitor_config({})
+        self.stats: Dict[str, ServiceStats] = {}
+        self._pending_restarts: List[str] = []
+        # 多进程模式下worker从管理进程读取（见cluster.Replica）
+        self.remote = None
+
+    def configure(self, config: Dict[str, Any]):
+        self.config = config
+        self.interval = config["interval"]
+
+    def _stats(self, name: str) -> ServiceStats:
+        stats = self.stats.get(name)
+        if stats is None or stats.history.capacity != self.config["history"]:
+            stats = ServiceStats(name, self.config["history"])
+            self.stats[name] = stats
+        return stats
+
+    def tick(self):
+        config = self.config
+        now = time.monotonic()
+        for name, service in list(supervisor.services.items()):
+            stats = self._stats(name)
+            pid = service.pid if service.state == RUNNING else None
+            if pid != stats.pid:
+                stats.reset(pid)
+            if pid is None:
+                stats.current = None
+                continue
+            totals = stats.sample(now)
+            if totals is None:
+                continue
+            timestamp = time.time()
+            stats.history.append(timestamp, pid, totals)
+            stats.current = {"timestamp": timestamp, "pid": pid, **totals}
+            suspected = stats.leak["suspected"]
+            stats.detect_leak(config["leak_window"], config["leak_slope_mb_per_min"], config["leak_min_r2"])
+
+            # 连续N个样本超过内存或CPU阈值
+            over_memory = config["memory_limit_mb"] and totals["rss"] / (1024 * 1024) > config["memory_limit_mb"]
+            over_cpu = config["cpu_limit_percent"] and totals["cpu_percent"] > config["cpu_limit_percent"]
+            stats.over_limit = stats.over_limit + 1 if (over_memory or over_cpu) else 0
+            if stats.over_limit >= config["limit_samples"]:
+                logger.warning(f"服务{name}连续{stats.over_limit}次超过资源阈值, "
+                               f"RSS={totals['rss'] / (1024 * 1024):.1f}MB CPU={totals['cpu_percent']:.1f}%")
+                if config["auto_restart"]:
+                    self._pending_restarts.append(name)
+                stats.over_limit = 0
+            if stats.leak["suspected"] and not suspected:
+                logger.warning(f"服务{name}疑似内存泄漏, 增长{stats.leak['slope_mb_per_min']}MB/分钟")
+
+    async def after_tick(self):
+        # 重启需要在事件循环中执行
+        while self._pending_restarts:
+            name = self._pending_restarts.pop()
+            service = supervisor.get(name)
+            if service is not None:
+                logger.warning(f"服务{name}超过资源阈值，自动重启")
+                await service.restart()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """各服务的当前资源和泄漏检测结果"""
+        if self.remote is not None:
+            return self.remote.service_stats()
+        return {name: {"current": stats.current, "leak": stats.leak} for name, stats in self.stats.items()}
+
+    def report(self, name: str, limit: int = 120) -> Optional[Dict[str, Any]]:
+        """获取服务的当前资源、历史和泄漏检测结果"""
+        if self.remote is not None:
+            return self.remote.service_report(name, limit)
+        stats = self.stats.get(name)
+        if stats is None:
+            return None
+        return {
+            "name": name,
+            "current": stats.current,
+            "history": stats.history.tail(limit),
+            "leak": stats.leak,
+        }
+
+# 全局服务监控
+service_monitor = ServiceMonitor()
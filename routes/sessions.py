@@ -0,0 +1,337 @@
+# -- coding: utf-8 --
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from .utils import read_config, get_data_dir
+from .monitor import PeriodicTask
+
+logger = logging.getLogger("sessions")
+
+# 获取会话配置
+def get_session_config() -> Dict[str, Any]:
+    """获取会话存储配置（server.session）"""
+    section = (read_config().get("server", {}) or {}).get("session", {}) or {}
+    return {
+        "backend": str(section.get("backend", "sqlite")).lower(),
+        "ttl": float(section.get("ttl", 7 * 24 * 3600)),
+        "cleanup_interval": float(section.get("cleanup_interval", 600)),
+        "cache_size": int(section.get("cache_size", 1024)),
+        "cache_ttl": float(section.get("cache_ttl", 5)),
+        "secret": str(section.get("secret", "") or ""),
+    }
+
+class SessionBackend:
+    """会话存储后端"""
+
+    # 读写是否涉及文件或数据库，是则在事件循环中要放到线程里执行
+    blocking = False
+
+    def create(self, data: Dict[str, Any], ttl: float) -> str:
+        raise NotImplementedError
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """返回(会话数据, 过期时间)，不存在或已过期时返回None"""
+        raise NotImplementedError
+
+    def delete(self, token: str):
+        raise NotImplementedError
+
+    def cleanup(self) -> int:
+        """删除过期会话，返回删除数量"""
+        return 0
+
+    def close(self):
+        pass
+
+class MemorySessionBackend(SessionBackend):
+    """进程内存储，只适用于单进程，重启后会话丢失"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, data: Dict[str, Any], ttl: float) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (dict(data), time.time() + ttl)
+        return token
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        item = self._sessions.get(token)
+        if item is None or item[1] <= time.time():
+            return None
+        return item
+
+    def delete(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def cleanup(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [token for token, (_, expires) in self._sessions.items() if expires <= now]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+class SqliteSessionBackend(SessionBackend):
+    """SQLite存储，多个worker进程共享同一个数据库文件，重启后会话仍然有效"""
+
+    blocking = True
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(get_data_dir(), "sessions.db")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        # WAL模式下读写互不阻塞，适合多进程并发访问
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # 只保存令牌的摘要，数据库泄露时令牌本身仍不可用
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def create(self, data: Dict[str, Any], ttl: float) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._conn.execute("INSERT INTO sessions (token, data, expires) VALUES (?, ?, ?)",
+                               (self._key(token), json.dumps(data, ensure_ascii=False), time.time() + ttl))
+        return token
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data, expires FROM sessions WHERE token = ? AND expires > ?",
+                                     (self._key(token), time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def delete(self, token: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (self._key(token),))
+
+    def cleanup(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# 获取签名密钥，未配置时生成一个保存到数据目录，所有worker共用
+def load_secret(configured: str = "") -> bytes:
+    if configured:
+        return configured.encode()
+    path = os.path.join(get_data_dir(), "session_secret")
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32).encode()
+    try:
+        # O_EXCL保证多个进程同时启动时只有一个写入成功
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+        return secret
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read().strip()
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class SignedTokenBackend(SessionBackend):
+    """无状态签名令牌，会话数据和过期时间保存在令牌内
+
+    不需要共享存储，但令牌在过期前无法单独吊销，登出只会删除浏览器中的Cookie；
+    需要让所有令牌失效时更换密钥即可。
+    """
+
+    def __init__(self, secret: bytes):
+        self.secret = secret
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def create(self, data: Dict[str, Any], ttl: float) -> str:
+        body = {"data": data, "exp": int(time.time() + ttl), "nonce": secrets.token_urlsafe(8)}
+        payload = _b64encode(json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode())
+        return f"{payload}.{self._sign(payload)}"
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        payload, _, signature = token.partition(".")
+        try:
+            # compare_digest不接受含非ASCII字符的str，按字节比较
+            valid = hmac.compare_digest(signature.encode(), self._sign(payload).encode())
+        except UnicodeError:
+            return None
+        if not signature or not valid:
+            return None
+        try:
+            body = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if body.get("exp", 0) <= time.time():
+            return None
+        return body["data"], float(body["exp"])
+
+    def delete(self, token: str):
+        pass
+
+# 创建会话后端
+def create_backend(config: Dict[str, Any]) -> SessionBackend:
+    backend = config["backend"]
+    if backend == "memory":
+        return MemorySessionBackend()
+    if backend == "signed":
+        return SignedTokenBackend(load_secret(config["secret"]))
+    if backend != "sqlite":
+        logger.warning(f"未知的会话后端{backend}，使用sqlite")
+    return SqliteSessionBackend()
+
+class SessionManager:
+    """会话管理，在后端之前加一层LRU缓存
+
+    认证在每个请求上都会执行，命中缓存时只是一次字典查找。缓存条目最多信任cache_ttl秒，
+    之后重新查询后端，因此其他worker进程中的登出最迟在cache_ttl秒后生效。
+    """
+
+    def __init__(self):
+        self.config: Optional[Dict[str, Any]] = None
+        self._backend: Optional[SessionBackend] = None
+        # 令牌 -> (会话数据, 会话过期时间, 缓存过期时间)
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> SessionBackend:
+        if self._backend is None:
+            self.configure(get_session_config())
+        return self._backend
+
+    @property
+    def ttl(self) -> float:
+        """会话有效期（秒）"""
+        return self.config["ttl"] if self._backend is not None else get_session_config()["ttl"]
+
+    def configure(self, config: Dict[str, Any]):
+        """按配置创建后端，已有后端时先关闭"""
+        with self._lock:
+            if self._backend is not None:
+                self._backend.close()
+            self.config = config
+            self._backend = create_backend(config)
+            self._cache.clear()
+
+    def _remember(self, token: str, data: Dict[str, Any], expires: float):
+        cache_until = min(expires, time.time() + self.config["cache_ttl"])
+        with self._lock:
+            self._cache[token] = (data, expires, cache_until)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.config["cache_size"]:
+                self._cache.popitem(last=False)
+
+    def create(self, data: Dict[str, Any]) -> str:
+        backend = self.backend
+        token = backend.create(data, self.config["ttl"])
+        self._remember(token, dict(data), time.time() + self.config["ttl"])
+        return token
+
+    def _cached(self, token: str) -> Optional[Dict[str, Any]]:
+        cached = self._cache.get(token)
+        if cached is not None and cached[2] > time.time():
+            with self._lock:
+                if token in self._cache:
+                    self._cache.move_to_end(token)
+            return cached[0]
+        return None
+
+    def get(self, token: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not token:
+            return None
+        data = self._cached(token)
+        if data is not None:
+            return data
+        return self._load(token)
+
+    async def aget(self, token: Optional[str]) -> Optional[Dict[str, Any]]:
+        """在事件循环中获取会话：命中缓存时直接返回，未命中且后端需要查询数据库时在线程中查询"""
+        if not token:
+            return None
+        data = self._cached(token)
+        if data is not None:
+            return data
+        if self.backend.blocking:
+            return await asyncio.to_thread(self._load, token)
+        return self._load(token)
+
+    def _load(self, token: str) -> Optional[Dict[str, Any]]:
+        item = self.backend.get(token)
+        if item is None:
+            with self._lock:
+                self._cache.pop(token, None)
+            return None
+        self._remember(token, item[0], item[1])
+        return item[0]
+
+    def delete(self, token: Optional[str]):
+        if not token:
+            return
+        with self._lock:
+            self._cache.pop(token, None)
+        self.backend.delete(token)
+
+    def cleanup(self) -> int:
+        now = time.time()
+        with self._lock:
+            for token in [t for t, (_, expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[token]
+        return self.backend.cleanup()
+
+    def close(self):
+        with self._lock:
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+            self._cache.clear()
+
+class SessionCleaner(PeriodicTask):
+    """定期清理过期会话"""
+
+    name = "会话清理"
+
+    def __init__(self, manager: SessionManager, interval: float = 600):
+        super().__init__(interval)
+        self.manager = manager
+
+    def tick(self):
+        removed = self.manager.cleanup()
+        if removed:
+            logger.info(f"已清理{removed}个过期会话")
+
+# 全局会话管理
+session_manager = SessionManager()
+session_cleaner = SessionCleaner(session_manager)
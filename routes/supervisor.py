@@ -0,0 +1,365 @@
+# -- coding: utf-8 --
+import os
+import time
+import shlex
+import signal
+import asyncio
+import inspect
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from .utils import read_config, get_data_dir
+
+logger = logging.getLogger("supervisor")
+
+# 服务状态
+STOPPED = "stopped"
+STARTING = "starting"
+RUNNING = "running"
+STOPPING = "stopping"
+BACKOFF = "backoff"
+FAILED = "failed"
+
+# 单行输出的最大长度
+OUTPUT_LIMIT = 1024 * 1024
+# 子进程退出后等待输出读完的时间，超时后不再读取（孙进程可能仍持有管道）
+DRAIN_TIMEOUT = 1.0
+# 检查进程组是否已全部退出的间隔
+GROUP_POLL_INTERVAL = 0.1
+
+class _ServiceProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    """子进程本身退出时立即通知
+
+    asyncio的Process.wait()要等输出管道全部关闭才返回，子进程留下的孙进程（如浏览器、辅助进程）
+    继承了管道时，主进程崩溃后wait()会一直不返回。这里在事件循环收到子进程退出（按PID回收）时就完成exited。
+    """
+
+    def __init__(self, limit: int, loop: asyncio.AbstractEventLoop):
+        super().__init__(limit=limit, loop=loop)
+        self.exited: asyncio.Future = loop.create_future()
+        # 自己保留传输对象，父类在管道都已关闭时会清除它的引用
+        self.transport: Optional[asyncio.SubprocessTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        super().connection_made(transport)
+
+    def process_exited(self):
+        returncode = self.transport.get_returncode()
+        super().process_exited()
+        if not self.exited.done():
+            self.exited.set_result(returncode)
+
+class ServiceSpec:
+    """服务启动参数，来自config.yaml的services段"""
+
+    def __init__(self, name: str, command: List[str], cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None, autostart: bool = False,
+                 stop_timeout: float = 10.0, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 stable_seconds: float = 30.0, max_retries: int = 0):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.env = env or {}
+        self.autostart = autostart
+        self.stop_timeout = stop_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_seconds = stable_seconds
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_config(cls, name: str, section: Dict[str, Any]) -> "ServiceSpec":
+        command = section.get("command") or []
+        if isinstance(command, str):
+            command = shlex.split(command, posix=os.name != "nt")
+        cwd = section.get("cwd") or None
+        if cwd and not os.path.isabs(cwd):
+            cwd = os.path.join(os.path.dirname(get_data_dir()), cwd)
+        return cls(
+            name=name,
+            command=[str(part) for part in command],
+            cwd=cwd,
+            env={str(k): str(v) for k, v in (section.get("env") or {}).items()},
+            autostart=bool(section.get("autostart", False)),
+            stop_timeout=float(section.get("stop_timeout", 10.0)),
+            backoff_base=float(section.get("backoff_base", 1.0)),
+            backoff_max=float(section.get("backoff_max", 60.0)),
+            stable_seconds=float(section.get("stable_seconds", 30.0)),
+            max_retries=int(section.get("max_retries", 0)),
+        )
+
+class ManagedService:
+    """受管子进程：崩溃后按指数退避重启，停止时先优雅终止再强制结束"""
+
+    def __init__(self, spec: ServiceSpec):
+        self.spec = spec
+        self.name = spec.name
+        self.state = STOPPED
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.exit_code: Optional[int] = None
+        self.started_at: Optional[float] = None
+        # 当前进程组（POSIX下等于子进程PID），子进程退出后仍用于清理遗留的孙进程
+        self._pgid: Optional[int] = None
+        self._retries = 0
+        self._desired = False
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.output_logger = logging.getLogger(f"bot.{spec.name}")
+
+    @property
+    def pid(self) -> Optional[int]:
+        if self.process is not None and self.process.returncode is None:
+            return self.process.pid
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        uptime = time.time() - self.started_at if self.started_at and self.state == RUNNING else 0
+        return {
+            "name": self.name,
+            "state": self.state,
+            "pid": self.pid,
+            "restarts": self.restarts,
+            "exit_code": self.exit_code,
+            "started_at": self.started_at,
+            "uptime": round(uptime, 1),
+            "configured": bool(self.spec.command),
+        }
+
+    async def _launch(self) -> Tuple[asyncio.subprocess.Process, asyncio.SubprocessTransport, asyncio.Future]:
+        """启动子进程，返回进程对象、传输对象和子进程退出时完成的future（结果为退出码）"""
+        kwargs: Dict[str, Any] = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = 0x00000200  # CREATE_NEW_PROCESS_GROUP
+        else:
+            # 独立的进程组，停止时可以连同其子进程一起结束
+            kwargs["start_new_session"] = True
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.subprocess_exec(
+            lambda: _ServiceProtocol(OUTPUT_LIMIT, loop),
+            *self.spec.command,
+            cwd=self.spec.cwd,
+            env={**os.environ, **self.spec.env},
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs,
+        )
+        return asyncio.subprocess.Process(transport, protocol, loop), transport, protocol.exited
+
+    async def _pump(self, stream: asyncio.StreamReader, level: int):
+        """将子进程输出逐行写入日志"""
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # 超长行，直接读取一块
+                line = await stream.read(OUTPUT_LIMIT)
+            if not line:
+                break
+            text = line.decode("utf-8", "replace").rstrip("\r\n")
+            if text:
+                self.output_logger.log(level, text)
+
+    def _backoff(self) -> float:
+        return min(self.spec.backoff_base * (2 ** max(self._retries - 1, 0)), self.spec.backoff_max)
+
+    def _group_alive(self) -> bool:
+        """进程组中是否还有进程（子进程退出后可能留下孙进程）"""
+        if self._pgid is None or os.name == "nt":
+            return False
+        try:
+            os.killpg(self._pgid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    async def _reap(self, transport: asyncio.SubprocessTransport, pumps: List[asyncio.Task]):
+        """子进程退出后结束遗留的孙进程：先SIGTERM，超时后SIGKILL；输出只在短时间内读完"""
+        if self._group_alive():
+            self._signal(signal.SIGTERM)
+            deadline = time.monotonic() + self.spec.stop_timeout
+            while self._group_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(GROUP_POLL_INTERVAL)
+            if self._group_alive():
+                logger.warning(f"服务{self.name}遗留的子进程未在{self.spec.stop_timeout}秒内退出，强制结束")
+                self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+        done, pending = await asyncio.wait(pumps, timeout=DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # 管道仍被占用，主动关闭
+            transport.close()
+        self._pgid = None
+
+    async def _supervise(self):
+        while self._desired:
+            self.state = STARTING
+            try:
+                process, transport, exited = await self._launch()
+            except Exception as e:
+                logger.error(f"启动服务{self.name}失败: {str(e)}")
+                self.process = None
+                self.exit_code = None
+            else:
+                self.process = process
+                self._pgid = process.pid if os.name != "nt" else None
+                self.started_at = time.time()
+                self.exit_code = None
+                logger.info(f"服务{self.name}已启动, pid={process.pid}")
+                pumps = [
+                    asyncio.create_task(self._pump(process.stdout, logging.INFO)),
+                    asyncio.create_task(self._pump(process.stderr, logging.WARNING)),
+                ]
+                if self._desired:
+                    self.state = RUNNING
+                    self.exit_code = await exited
+                else:
+                    # 启动期间调用了stop()，那时还没有可以发信号的进程
+                    self.state = STOPPING
+                    self.exit_code = await self._terminate(exited)
+                await self._reap(transport, pumps)
+                if not self._desired:
+                    break
+                logger.warning(f"服务{self.name}意外退出, 退出码={self.exit_code}")
+                if time.time() - self.started_at >= self.spec.stable_seconds:
+                    # 稳定运行过一段时间，重置退避
+                    self._retries = 0
+
+            self._retries += 1
+            if self.spec.max_retries and self._retries > self.spec.max_retries:
+                self.state = FAILED
+                logger.error(f"服务{self.name}重启次数过多，已放弃")
+                self._desired = False
+                return
+            delay = self._backoff()
+            self.state = BACKOFF
+            logger.info(f"服务{self.name}将在{delay:.1f}秒后重启")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            if self._desired:
+                self.restarts += 1
+        self.state = STOPPED
+
+    def start(self) -> bool:
+        """启动服务，未配置启动命令时返回False"""
+        if not self.spec.command:
+            return False
+        self._desired = True
+        if self._task is None or self._task.done():
+            self._retries = 0
+            self._task = asyncio.create_task(self._supervise())
+        return True
+
+    def _signal(self, sig: int):
+        """向整个进程组发送信号；子进程已退出时仍会发给遗留的孙进程"""
+        if os.name == "nt":
+            process = self.process
+            if process is not None and process.returncode is None:
+                if sig == signal.SIGTERM:
+                    process.terminate()
+                else:
+                    process.kill()
+            return
+        if self._pgid is None:
+            return
+        try:
+            os.killpg(self._pgid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def _terminate(self, exited: asyncio.Future) -> int:
+        """发送SIGTERM，超时后强制结束，返回退出码"""
+        self._signal(signal.SIGTERM)
+        try:
+            return await asyncio.wait_for(asyncio.shield(exited), timeout=self.spec.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"服务{self.name}未在{self.spec.stop_timeout}秒内退出，强制结束")
+            self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+            return await exited
+
+    async def stop(self):
+        """停止服务：先发送SIGTERM，超时后强制结束；启动中或等待重启时也能停止"""
+        self._desired = False
+        self._wakeup.set()
+        task = self._task
+        if task is not None and not task.done():
+            if self.state == RUNNING:
+                self.state = STOPPING
+                self._signal(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(asyncio.shield(task), timeout=self.spec.stop_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"服务{self.name}未在{self.spec.stop_timeout}秒内退出，强制结束")
+                    self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+            # 启动中时进程还不存在，由_supervise在启动完成后终止；等待重启时直接结束
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+            self._task = None
+        self.state = STOPPED
+
+    async def restart(self) -> bool:
+        await self.stop()
+        return self.start()
+
+# 启动服务：本地服务的start是同步的，worker中的远程代理需要等待管理进程的回复
+async def start_service(service) -> bool:
+    """启动本地或远程服务，未配置启动命令时返回False"""
+    result = service.start()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+class Supervisor:
+    """协议端和bot端子进程的管理器"""
+
+    SERVICE_NAMES = ("protocol", "bot")
+
+    def __init__(self):
+        self.services: Dict[str, ManagedService] = {}
+        # 多进程模式下worker不直接管理子进程，状态和操作都通过管理进程（见cluster.Replica）
+        self.remote = None
+
+    def load(self):
+        """从配置加载服务定义，已存在的服务在下次启动时使用新参数"""
+        if self.remote is not None:
+            return
+        sections = read_config().get("services", {}) or {}
+        names = list(self.SERVICE_NAMES) + [n for n in sections if n not in self.SERVICE_NAMES]
+        for name in names:
+            spec = ServiceSpec.from_config(name, sections.get(name, {}) or {})
+            if name in self.services:
+                self.services[name].spec = spec
+            else:
+                self.services[name] = ManagedService(spec)
+
+    def get(self, name: str) -> Optional[ManagedService]:
+        if self.remote is not None:
+            return self.remote.service(name)
+        if name not in self.services:
+            self.load()
+        return self.services.get(name)
+
+    def status(self) -> List[Dict[str, Any]]:
+        if self.remote is not None:
+            return self.remote.services()
+        return [service.status() for service in self.services.values()]
+
+    async def start(self):
+        self.load()
+        for service in self.services.values():
+            if service.spec.autostart:
+                service.start()
+
+    async def stop(self):
+        await asyncio.gather(*(service.stop() for service in self.services.values()),
+                             return_exceptions=True)
+
+# 全局管理器
+supervisor = Supervisor()
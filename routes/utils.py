@@ -1,11 +1,44 @@
 import os
 import yaml
+import queue
+import atexit
 import logging
 import logging.handlers
-from typing import Dict, Any, Optional
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .logqueue import BoundedQueueHandler, BatchingQueueListener, JsonFormatter, DROP, BLOCK
+
+# 当前的日志写入线程
+log_listener: Optional[BatchingQueueListener] = None
+
+# 获取日志配置
+def get_logging_config() -> Dict[str, Any]:
+    """获取日志队列配置（logging段）"""
+    section = read_config().get("logging", {}) or {}
+    policy = str(section.get("policy", DROP)).lower()
+    return {
+        "queue_size": int(section.get("queue_size", 10000)),
+        "policy": policy if policy in (DROP, BLOCK) else DROP,
+        "batch_size": int(section.get("batch_size", 512)),
+        "format": str(section.get("format", "text")).lower(),
+        "archive": bool((section.get("archive", {}) or {}).get("enabled", True)),
+    }
 
 # 配置日志
-def setup_logging():
+# rotate为False时（多worker模式的worker）由管理进程负责按日期轮换，worker在文件被轮换后重新打开
+# 所有日志先进入有界队列，由后台线程批量写入控制台和文件，调用logger不会阻塞在磁盘I/O上
+def setup_logging(rotate: bool = True):
+    global log_listener
+    config = get_logging_config()
+
     # 确保日志目录存在
     log_dir = os.path.join(get_data_dir(), "logs")
     os.makedirs(log_dir, exist_ok=True)
@@ -13,24 +46,44 @@ def setup_logging():
     # 配置根日志记录器
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
+    if log_listener is not None:
+        # 重复调用时替换之前的队列
+        for handler in [h for h in root_logger.handlers if isinstance(h, BoundedQueueHandler)]:
+            root_logger.removeHandler(handler)
+        log_listener.stop()
     
     # 控制台处理器
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(console_formatter)
-    root_logger.addHandler(console_handler)
     
     # 文件处理器 - 按日期轮换
-    file_handler = logging.handlers.TimedRotatingFileHandler(
-        os.path.join(log_dir, 'app.log'),
-        when='midnight',
-        backupCount=7
-    )
+    if rotate:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            os.path.join(log_dir, 'app.log'),
+            when='midnight',
+            # 启用归档时轮换出的文件由日志归档压缩和清理
+            backupCount=0 if config["archive"] else 7
+        )
+    else:
+        file_handler = logging.handlers.WatchedFileHandler(os.path.join(log_dir, 'app.log'))
     file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if config["format"] == "json":
+        # 结构化的JSON行，日志查询不需要正则解析
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     file_handler.setFormatter(file_formatter)
-    root_logger.addHandler(file_handler)
+
+    # 队列处理器和后台写入线程
+    log_queue: "queue.Queue" = queue.Queue(maxsize=config["queue_size"])
+    queue_handler = BoundedQueueHandler(log_queue, config["policy"])
+    log_listener = BatchingQueueListener(log_queue, [console_handler, file_handler], queue_handler,
+                                         config["batch_size"])
+    log_listener.start()
+    root_logger.addHandler(queue_handler)
+    atexit.register(log_listener.stop)
     
     # 为各个模块创建日志记录器
     for module in ["api", "auth", "pages", "utils"]:
@@ -51,29 +104,174 @@ def get_config_path() -> str:
     """获取配置文件路径"""
     return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml")
 
+# 原子地写入文本文件：先写同目录下的临时文件，再重命名覆盖
+def atomic_write(path: str, text: str, mode: int = 0o644):
+    """写入失败时原文件保持不变；已存在的文件保留原有权限"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + "-", suffix=".tmp", dir=directory)
+    try:
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class ReadOnlyDict(dict):
+    """只读字典，防止处理函数修改缓存中的配置"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置为只读视图，请使用modify_config修改配置")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+# 转换为只读结构
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+# 转换为可修改的普通结构（深拷贝）
+def thaw(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+class ConfigStore:
+    """进程内共享的配置缓存
+
+    只在文件的mtime或大小变化时重新解析，写入时先写临时文件再重命名，
+    读改写在同一把锁内完成，避免并发更新互相覆盖；多worker时另用文件锁在进程间串行。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._lock = threading.RLock()
+        self._data: Optional[ReadOnlyDict] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        """配置版本号，每次重新加载或写入后加一"""
+        return self._version
+
+    @property
+    def stamp(self) -> str:
+        """配置文件的mtime和大小，各进程一致，可用作ETag的一部分"""
+        self.get()
+        mtime_ns, size = self._stat or (0, 0)
+        return f"{mtime_ns:x}.{size:x}"
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的写锁，多个worker同时修改配置时串行执行"""
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _reload(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        self._data = freeze(data)
+        self._stat = self._file_stat()
+        self._version += 1
+
+    def get(self) -> ReadOnlyDict:
+        """获取配置的只读视图"""
+        stat = self._file_stat()
+        if stat is not None and stat == self._stat:
+            return self._data
+        with self._lock:
+            stat = self._file_stat()
+            if stat is None:
+                # 如果配置文件不存在，使用默认配置并创建文件
+                self._write(get_default_config())
+                return self._data
+            if stat != self._stat:
+                self._reload()
+            return self._data
+
+    def _write(self, config: Dict[str, Any]):
+        atomic_write(self.path, yaml.dump(thaw(config), default_flow_style=False, allow_unicode=True))
+        self._data = freeze(config)
+        self._stat = self._file_stat()
+        self._version += 1
+
+    def write(self, config: Dict[str, Any]):
+        """原子地写入整个配置"""
+        with self._lock, self._file_lock():
+            self._write(config)
+
+    def modify(self, mutator: Callable[[Dict[str, Any]], None]) -> ReadOnlyDict:
+        """在锁内读取、修改并写回配置"""
+        with self._lock, self._file_lock():
+            # 加锁后重新读取文件：其他worker可能刚写入，而mtime和大小未必能区分两次写入
+            if os.path.exists(self.path):
+                self._reload()
+                config = thaw(self._data)
+            else:
+                config = get_default_config()
+            mutator(config)
+            self._write(config)
+            return self._data
+
+# 全局配置存储
+config_store = ConfigStore(get_config_path())
+
 # 读取配置文件
 def read_config() -> Dict[str, Any]:
-    """读取配置文件"""
-    config_path = get_config_path()
+    """读取配置文件（只读视图，需要修改时使用thaw复制或modify_config）"""
     try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f) or {}
-    except FileNotFoundError:
-        # 如果配置文件不存在，返回默认配置并创建文件
-        default_config = get_default_config()
-        update_config(default_config)
-        return default_config
+        return config_store.get()
     except Exception as e:
         logging.error(f"读取配置文件失败: {str(e)}")
-        return {}
+        return ReadOnlyDict()
 
 # 更新配置文件
 def update_config(config: Dict[str, Any]) -> bool:
     """更新配置文件"""
-    config_path = get_config_path()
     try:
-        with open(config_path, "w", encoding="utf-8") as f:
-            yaml.dump(config, f, default_flow_style=False, allow_unicode=True)
+        config_store.write(config)
+        return True
+    except Exception as e:
+        logging.error(f"更新配置文件失败: {str(e)}")
+        return False
+
+# 读改写配置文件
+def modify_config(mutator: Callable[[Dict[str, Any]], None]) -> bool:
+    """在锁内修改配置并原子写回，并发修改不会互相覆盖"""
+    try:
+        config_store.modify(mutator)
         return True
     except Exception as e:
         logging.error(f"更新配置文件失败: {str(e)}")
@@ -91,14 +289,87 @@ def get_default_config() -> Dict[str, Any]:
             "host": "0.0.0.0",
             "port": 8000,
             "username": "ilovefirefly",
-            "password": "ilovefirefly",
-            "is_new": True
+            "is_new": True,
+            "workers": 1,
+            "graceful_timeout": 30,
+            "compression": {
+                "enabled": True,
+                "min_size": 1024
+            },
+            "page_cache": {
+                "enabled": True
+            },
+            "session": {
+                "backend": "sqlite",
+                "ttl": 604800,
+                "cleanup_interval": 600,
+                "cache_size": 1024,
+                "cache_ttl": 5
+            }
+        },
+        "logging": {
+            "queue_size": 10000,
+            "policy": "drop",
+            "batch_size": 512,
+            "format": "text",
+            "archive": {
+                "enabled": True,
+                "block_kb": 256,
+                "level": 6,
+                "max_total_mb": 1024,
+                "max_age_days": 90,
+                "interval": 60
+            }
         },
         "bot": {
             "type": "onebot",
             "protocol": "ws",
             "enabled": False
         },
+        "monitor": {
+            "interval": 1.0,
+            "disk_path": "/",
+            "services": {
+                "interval": 5.0,
+                "history": 720,
+                "leak_window": 60,
+                "leak_slope_mb_per_min": 1.0,
+                "memory_limit_mb": 0,
+                "cpu_limit_percent": 0,
+                "limit_samples": 6,
+                "auto_restart": False
+            },
+            "metrics": {
+                "enabled": True,
+                "token": ""
+            },
+            "loop_lag": {
+                "enabled": True,
+                "threshold_ms": 100,
+                "interval_ms": 50,
+                "history": 50
+            },
+            "memory_trace": {
+                "periodic": False,
+                "interval": 600,
+                "window": 30,
+                "frames": 1,
+                "windows": 24,
+                "max_snapshots": 10
+            }
+        },
+        "services": {
+            "protocol": {
+                "command": [],
+                "cwd": "",
+                "autostart": False
+            },
+            "bot": {
+                "command": [],
+                "cwd": "",
+                "autostart": False
+            }
+        },
         "ui": {
             "background": {
                 "type": "RINGS",
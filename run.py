@@ -1,16 +1,21 @@
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 
-from routes import init_routes
+from routes import init_routes, start_services, stop_services
+from routes.metrics import MetricsMiddleware
+from routes.httpcache import CompressionMiddleware
+from routes.assets import AssetFiles, asset_pipeline
+from routes.cluster import get_role, get_cluster_config, run_manager, WORKER
 from routes.utils import get_data_dir, setup_logging, read_config
 
 # 设置日志
-logger = setup_logging()
+logger = setup_logging(rotate=get_role() != WORKER)
 
 # 确保数据目录存在
 data_dir = get_data_dir()
@@ -18,8 +23,15 @@ data_dir = get_data_dir()
 # 读取配置
 config = read_config()
 
+# 应用生命周期：启动和停止后台任务
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_services()
+    yield
+    await stop_services()
+
 # 创建FastAPI应用
-app = FastAPI(title="All-in-One Scripts")
+app = FastAPI(title="All-in-One Scripts", lifespan=lifespan)
 
 # 配置CORS
 app.add_middleware(
@@ -30,8 +42,16 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
+# 记录请求耗时，供/metrics导出
+app.add_middleware(MetricsMiddleware)
+
+# 压缩JSON和页面响应，并处理ETag/If-None-Match
+app.add_middleware(CompressionMiddleware)
+
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# 带指纹的预压缩静态资源，长期缓存
+app.mount("/assets", AssetFiles(asset_pipeline), name="assets")
 
 # 初始化模板
 templates = Jinja2Templates(directory="templates")
@@ -47,4 +67,12 @@ if __name__ == "__main__":
     
     print(f"启动服务器于 http://{host}:{port}")
     print(f"本地访问请前往 http://localhost:{port}")
-    uvicorn.run("run:app", host=host, port=port, reload=False)
\ No newline at end of file
+    workers = get_cluster_config()["workers"]
+    if workers > 1 and os.name != "nt":
+        # 多worker模式：后台任务只在管理进程中运行，修改配置后逐个重启worker
+        print(f"以{workers}个worker运行")
+        run_manager(host, port)
+    else:
+        if workers > 1:
+            logger.warning("Windows下不支持多worker模式，以单进程运行")
+        uvicorn.run("run:app", host=host, port=port, reload=False)
\ No newline at end of file
@@ -0,0 +1,56 @@
+# -- coding: utf-8 --
+"""worker中远程服务代理的测试，管理进程用假的控制客户端代替"""
+import asyncio
+
+from routes.cluster import RemoteService, config_fingerprint
+from routes.supervisor import start_service
+from routes.utils import freeze
+
+class FakeClient:
+    """只允许异步调用，同步调用会阻塞事件循环"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, method, **params):
+        raise AssertionError("在事件循环中使用了同步调用")
+
+    async def acall(self, method, **params):
+        self.calls.append((method, params))
+        await asyncio.sleep(0)
+        status = {"name": params["name"], "state": "running", "pid": 1234}
+        return {"ok": True, "service": status}
+
+def test_remote_start_is_async():
+    client = FakeClient()
+    service = RemoteService(client, {"name": "bot", "state": "stopped", "pid": None})
+
+    async def main():
+        assert await start_service(service)
+        await service.stop()
+        assert await service.restart()
+
+    asyncio.run(main())
+    assert [params["action"] for _, params in client.calls] == ["start", "stop", "restart"]
+    assert service.state == "running" and service.pid == 1234
+
+def test_fingerprint_ignores_settings_read_on_demand():
+    config = {
+        "server": {"port": 8000, "workers": 2, "session": {"ttl": 3600}},
+        "logging": {"level": "INFO"},
+        "monitor": {"interval": 2, "history": {"retention": 7}},
+        "ui": {"theme": "dark"},
+        "services": {"bot": {"command": "python bot.py"}},
+    }
+    base = config_fingerprint(freeze(config))
+    for path, value in ((("ui", "theme"), "light"), (("services", "bot", "command"), "node app.js"),
+                        (("monitor", "interval"), 5)):
+        changed = {**config}
+        section = changed[path[0]] = dict(config[path[0]])
+        for key in path[1:-1]:
+            section = section[key] = dict(section[key])
+        section[path[-1]] = value
+        assert config_fingerprint(freeze(changed)) == base
+    for section, value in (("server", {"port": 8000, "workers": 3}), ("logging", {"level": "DEBUG"}),
+                           ("monitor", {"history": {"retention": 30}})):
+        assert config_fingerprint(freeze({**config, section: value})) != base
@@ -0,0 +1,31 @@
+# -- coding: utf-8 --
+"""配置存储的测试，配置文件放在临时目录中"""
+import os
+import multiprocessing
+
+import pytest
+import yaml
+
+from routes.utils import ConfigStore
+
+def increment(path: str, key: str, times: int):
+    store = ConfigStore(path)
+    for _ in range(times):
+        store.modify(lambda config: config.update({key: config.get(key, 0) + 1, "total": config.get("total", 0) + 1}))
+
+@pytest.mark.skipif(os.name == "nt", reason="依赖fcntl文件锁")
+def test_concurrent_modify_across_processes(tmp_path):
+    path = str(tmp_path / "config.yaml")
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.dump({"total": 0}, f)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=increment, args=(path, f"worker{i}", 50)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    # 没有丢失任何一次修改
+    assert config["total"] == 200
+    assert all(config[f"worker{i}"] == 50 for i in range(4))
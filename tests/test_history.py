@@ -0,0 +1,60 @@
+# -- coding: utf-8 --
+"""指标历史的测试，历史文件放在临时目录中"""
+import time
+
+from routes.history import MetricsHistory
+
+def make_history(tmp_path) -> MetricsHistory:
+    history = MetricsHistory(str(tmp_path / "history.bin"), archives=((1, 60), (10, 60)),
+                             metrics=("cpu_percent", "memory_percent"))
+    history.open()
+    return history
+
+def test_tag_follows_current_bucket(tmp_path):
+    history = make_history(tmp_path)
+    now = int(time.time()) - 10.5
+    history.record({"cpu_percent": 1.0}, now - 5)
+    tag = history.tag(now - 30, now)
+    assert history.tag(now - 30, now) == tag
+    # 当前桶写入新样本
+    history.record({"cpu_percent": 2.0}, now)
+    current = history.tag(now - 30, now)
+    assert current != tag
+    # 范围之外的桶不影响版本
+    history.record({"cpu_percent": 3.0}, now + 5)
+    assert history.tag(now - 30, now) == current
+    history.close()
+
+def test_query_uses_same_buckets_as_tag(tmp_path):
+    history = make_history(tmp_path)
+    now = int(time.time()) - 10.5
+    for k in range(5):
+        history.record({"cpu_percent": float(k)}, now - k)
+    result = history.query(["cpu_percent"], now - 30, now)
+    step, first, last, _ = history.tag(now - 30, now).split("-")
+    assert result["step"] == int(step)
+    assert result["timestamps"][0] == int(first) and result["timestamps"][-1] == int(last)
+    assert result["series"]["cpu_percent"]["max"][-5:] == [4.0, 3.0, 2.0, 1.0, 0.0]
+    history.close()
+
+def test_read_only_open_never_touches_file(tmp_path):
+    history = make_history(tmp_path)
+    now = int(time.time()) - 10.5
+    history.record({"cpu_percent": 5.0}, now)
+    worker = MetricsHistory(history.path, archives=history.archives, metrics=history.metrics)
+    worker.open(writable=False)
+    assert worker.query(["cpu_percent"], now - 30, now)["series"]["cpu_percent"]["max"][-1] == 5.0
+    # worker不写入
+    worker.record({"cpu_percent": 9.0}, now)
+    assert history.query(["cpu_percent"], now - 30, now)["series"]["cpu_percent"]["max"][-1] == 5.0
+    # 布局不符时worker不提供数据，也不重建文件
+    stale = MetricsHistory(history.path, archives=((1, 30),), metrics=history.metrics)
+    stale.open(writable=False)
+    assert stale.query(["cpu_percent"], now - 30, now)["series"]["cpu_percent"]["max"][-1] is None
+    assert history.query(["cpu_percent"], now - 30, now)["series"]["cpu_percent"]["max"][-1] == 5.0
+    # 管理进程按新布局重建时替换文件，正在映射旧文件的worker仍可读取
+    rebuilt = MetricsHistory(history.path, archives=((1, 30),), metrics=history.metrics)
+    rebuilt.open()
+    assert worker.query(["cpu_percent"], now - 30, now)["series"]["cpu_percent"]["max"][-1] == 5.0
+    for item in (history, worker, stale, rebuilt):
+        item.close()
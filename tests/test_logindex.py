@@ -0,0 +1,122 @@
+# -- coding: utf-8 --
+"""日志索引的测试，日志文件写在临时目录中"""
+import os
+import json
+import random
+import multiprocessing
+from itertools import accumulate
+
+import pytest
+
+from routes.logindex import FileIndex, LogStore
+
+BASE = 1_700_000_000.0
+
+def write_log(tmp_path, timestamps):
+    """按给定顺序写入JSON格式的日志，第i条的内容为"entry i"（偶数条带搜索词）"""
+    lines = []
+    for i, ts in enumerate(timestamps):
+        msg = f"entry {i}" + (" timeout" if i % 2 == 0 else "")
+        level = "error" if i % 3 == 0 else "info"
+        lines.append(json.dumps({"ts": ts, "level": level, "source": f"worker{i % 2}", "msg": msg}))
+    (tmp_path / "app.log").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def query_all(store, **filters):
+    result = store.query(page=1, page_size=10000, **filters)
+    return [entry["message"].split()[1] for entry in result["logs"]], result["pagination"]["total_items"]
+
+def expected(timestamps, start, end, level=None, search=False):
+    return [str(i) for i in range(len(timestamps) - 1, -1, -1)
+            if start <= timestamps[i] < end
+            and (level is None or (level == "error") == (i % 3 == 0))
+            and (not search or i % 2 == 0)]
+
+@pytest.fixture
+def skewed(tmp_path):
+    # 两个worker交替写入，其中一个的时间戳最多晚到0.5秒
+    rng = random.Random(1)
+    timestamps = [BASE + i * 0.1 - (rng.random() * 0.5 if i % 2 else 0) for i in range(400)]
+    write_log(tmp_path, timestamps)
+    store = LogStore(str(tmp_path))
+    yield store, timestamps
+    for index in store._indexes.values():
+        index.terms.close()
+
+@pytest.mark.parametrize("start, end", [(BASE + 5, BASE + 12.34), (BASE + 0.05, BASE + 0.3), (BASE + 39.7, BASE + 50),
+                                        (BASE - 10, BASE + 100), (BASE + 20.01, BASE + 20.02)])
+def test_time_range_with_skewed_timestamps(skewed, start, end):
+    store, timestamps = skewed
+    messages, total = query_all(store, start=start, end=end)
+    assert messages == expected(timestamps, start, end)
+    assert total == len(messages)
+    messages, _ = query_all(store, start=start, end=end, levels=["error"])
+    assert messages == expected(timestamps, start, end, level="error")
+    messages, _ = query_all(store, start=start, end=end, search="timeout")
+    assert messages == expected(timestamps, start, end, search=True)
+
+def test_time_range_monotonic(tmp_path):
+    timestamps = [BASE + i for i in range(100)]
+    write_log(tmp_path, timestamps)
+    store = LogStore(str(tmp_path))
+    index = store.refresh()[0]
+    assert index.skew == 0
+    assert index.time_range(BASE + 10, BASE + 20) == (10, 20)
+    assert query_all(store, start=BASE + 10, end=BASE + 20)[0] == expected(timestamps, BASE + 10, BASE + 20)
+    index.terms.close()
+
+def test_reloaded_index_keeps_skew(skewed, tmp_path):
+    store, timestamps = skewed
+    built = store.refresh()[0]
+    assert built.skew > 0
+    reloaded = LogStore(str(tmp_path))
+    index = reloaded.refresh()[0]
+    assert index.skew == built.skew
+    assert index.peaks == built.peaks
+    assert query_all(reloaded, start=BASE + 5, end=BASE + 6)[0] == expected(timestamps, BASE + 5, BASE + 6)
+    index.terms.close()
+
+def test_long_first_line_is_indexed(tmp_path):
+    first = json.dumps({"ts": BASE, "level": "info", "source": "bot", "msg": "x" * 300})
+    second = json.dumps({"ts": BASE + 1, "level": "info", "source": "bot", "msg": "entry 1"})
+    (tmp_path / "app.log").write_text(first + "\n" + second + "\n", encoding="utf-8")
+    store = LogStore(str(tmp_path))
+    result = store.query(page=1, page_size=10)
+    assert result["pagination"]["total_items"] == 2
+    for index in store._indexes.values():
+        index.terms.close()
+
+def append_and_refresh(log_dir: str, worker: int, times: int):
+    store = LogStore(log_dir)
+    with open(os.path.join(log_dir, "app.log"), "ab", buffering=0) as f:
+        for i in range(times):
+            lines = [json.dumps({"ts": BASE + i, "level": "info", "source": f"worker{worker}", "msg": f"entry {i}"})
+                     for _ in range(5)]
+            f.write(("\n".join(lines) + "\n").encode())
+            store.refresh()
+    for index in store._indexes.values():
+        index.terms.close()
+
+@pytest.mark.skipif(os.name == "nt", reason="依赖fcntl文件锁")
+def test_workers_share_index_files(tmp_path):
+    # 多个worker同时追加日志并更新同一个索引，重启后加载的索引应与日志文件一致
+    log_dir = str(tmp_path)
+    header = json.dumps({"ts": BASE, "level": "info", "source": "main", "msg": "start"}) + "\n"
+    (tmp_path / "app.log").write_text(header, encoding="utf-8")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=append_and_refresh, args=(log_dir, i, 40)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    lines = (tmp_path / "app.log").read_bytes().splitlines(keepends=True)
+    store = LogStore(log_dir)
+    signature = LogStore._signature(str(tmp_path / "app.log"))
+    index = FileIndex(str(tmp_path / "app.log"), store.index_dir, signature)
+    # 只加载磁盘上的索引，不补齐
+    offsets = list(accumulate(map(len, lines), initial=0))
+    assert list(index.offsets) == offsets[:len(index.offsets)]
+    assert len(index.offsets) == len(lines)
+    index.terms.close()
+    store._indexes[signature] = FileIndex(str(tmp_path / "app.log"), store.index_dir, signature)
+    assert query_all(store, search="entry")[1] == len(lines) - 1
+    store._indexes[signature].terms.close()
@@ -0,0 +1,31 @@
+# -- coding: utf-8 --
+"""日志跟踪的测试，日志文件写在临时目录中"""
+import json
+
+from routes.logstream import LogFollower, READ_CHUNK, TRUNCATED_MARK
+
+def log_line(i: int, msg: str) -> bytes:
+    return (json.dumps({"ts": 1_700_000_000.0 + i, "level": "info", "source": "bot", "msg": msg}) + "\n").encode()
+
+def test_oversized_line_does_not_stall(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_bytes(log_line(0, "start"))
+    follower = LogFollower(str(path))
+    follower.generation, follower.position = follower._identify()
+    long_line = log_line(1, "x" * (READ_CHUNK + 1000))
+    # 超长的行还没有写完时等待
+    with open(path, "ab") as f:
+        f.write(long_line[:-1])
+    assert follower._poll() == []
+    with open(path, "ab") as f:
+        f.write(long_line[-1:] + log_line(2, "after"))
+    truncated = follower._poll()
+    assert truncated[-1]["message"].endswith(TRUNCATED_MARK.decode())
+    assert follower.position == len(log_line(0, "start")) + len(long_line)
+    assert truncated[-1]["offset"] == follower.position
+    assert [entry["message"] for entry in follower._poll()] == ["after"]
+    assert follower.position == path.stat().st_size
+    # 断线续传同样跳过超长的行
+    replay = follower._replay(0, follower.position)
+    assert [entry["message"] for entry in replay][-1] == "after"
+    assert replay[-1]["offset"] == follower.position
@@ -0,0 +1,35 @@
+# -- coding: utf-8 --
+"""/metrics导出的测试，请求直接构造ASGI scope"""
+import os
+import asyncio
+
+from starlette.requests import Request
+
+from routes import metrics
+
+def call(monkeypatch, config, host="127.0.0.1", authorization=None):
+    monkeypatch.setattr(metrics, "get_metrics_config", lambda: {"enabled": True, "allow_remote": False, **config})
+    monkeypatch.setattr(metrics, "render_metrics", lambda: "ok\n")
+    headers = [(b"authorization", authorization.encode("latin-1"))] if authorization is not None else []
+    scope = {"type": "http", "method": "GET", "path": "/metrics", "headers": headers, "client": (host, 50000)}
+    return asyncio.run(metrics.metrics(Request(scope))).status_code
+
+def test_token_compared_as_bytes(monkeypatch):
+    assert call(monkeypatch, {"token": "secret"}, authorization="Bearer secret") == 200
+    assert call(monkeypatch, {"token": "secret"}, authorization="Bearer sécret") == 401
+    assert call(monkeypatch, {"token": "secret"}, host="10.0.0.2") == 401
+
+def test_without_token_only_local(monkeypatch):
+    assert call(monkeypatch, {"token": ""}) == 200
+    assert call(monkeypatch, {"token": ""}, host="::1") == 200
+    assert call(monkeypatch, {"token": ""}, host="10.0.0.2") == 403
+    assert call(monkeypatch, {"token": "", "allow_remote": True}, host="10.0.0.2") == 200
+
+def test_process_metrics_labelled_by_worker():
+    metrics.http_metrics.record("GET", "/api/test", 200, 0.01)
+    out = metrics.Exposition()
+    metrics.collect_http(out)
+    metrics.collect_loop(out)
+    worker = f'worker="{os.getpid()}"'
+    samples = [line for line in out.lines if not line.startswith("#")]
+    assert samples and all(worker in line for line in samples)
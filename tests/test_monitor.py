@@ -0,0 +1,103 @@
+# -- coding: utf-8 --
+"""进程表的测试，进程用假的psutil.Process代替"""
+import contextlib
+from collections import namedtuple
+
+import psutil
+
+from routes.monitor import ProcessTable
+
+CpuTimes = namedtuple("CpuTimes", ["user", "system"])
+MemInfo = namedtuple("MemInfo", ["rss", "vms"])
+
+class FakeProcess:
+    """按PID读取主机上当前的进程，与psutil.Process一样不会发现PID已被复用"""
+
+    def __init__(self, pid: int, host: "FakeHost"):
+        self.pid = pid
+        self._host = host
+        if pid not in host.procs:
+            raise psutil.NoSuchProcess(pid)
+
+    def _info(self):
+        info = self._host.procs.get(self.pid)
+        if info is None:
+            raise psutil.NoSuchProcess(self.pid)
+        return info
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+    def is_running(self):
+        return self.pid in self._host.procs
+
+    def create_time(self):
+        return self._info()["created"]
+
+    def name(self):
+        return self._info()["name"]
+
+    def ppid(self):
+        return 1
+
+    def cpu_times(self):
+        return CpuTimes(self._info()["cpu"], 0.0)
+
+    def memory_info(self):
+        return MemInfo(4096, 0)
+
+    def username(self):
+        return self._info()["user"]
+
+    def cmdline(self):
+        return [self._info()["name"], "--serve"]
+
+class FakeHost:
+    def __init__(self):
+        self.procs = {}
+        self.now = 0.0
+        self.created = 0
+
+    def spawn(self, pid: int, name: str, user: str, cpu: float = 0.0):
+        self.created += 1
+        self.procs[pid] = {"name": name, "user": user, "cpu": cpu, "created": float(self.created)}
+
+    def table(self) -> ProcessTable:
+        return ProcessTable(pids=lambda: list(self.procs), process_factory=lambda pid: FakeProcess(pid, self),
+                            clock=lambda: self.now)
+
+def rows(table: ProcessTable):
+    result = table.query(sort="pid", limit=None, fields=("pid", "name", "user", "cmdline", "cpu_percent"))
+    return {row["pid"]: row for row in result["processes"]}
+
+def test_cpu_percent_from_cpu_time_delta():
+    host = FakeHost()
+    host.spawn(100, "bot", "firefly")
+    table = host.table()
+    table.tick()
+    host.now += 2
+    host.procs[100]["cpu"] += 1.0
+    table.tick()
+    assert rows(table)[100]["cpu_percent"] == 50.0
+
+def test_pid_reuse_rebuilds_entry():
+    host = FakeHost()
+    host.spawn(100, "bot", "firefly", cpu=500.0)
+    table = host.table()
+    table.tick()
+    # 两次采样之间旧进程退出，新进程拿到了同一个PID
+    del host.procs[100]
+    host.spawn(100, "sh", "root", cpu=0.5)
+    host.now += 2
+    table.tick()
+    row = rows(table)[100]
+    assert row["name"] == "sh"
+    assert row["user"] == "root"
+    assert row["cmdline"] == "sh --serve"
+    # 不会用旧进程的CPU时间计算使用率
+    assert row["cpu_percent"] == 0.0
+    host.now += 2
+    host.procs[100]["cpu"] += 0.5
+    table.tick()
+    assert rows(table)[100]["cpu_percent"] == 25.0
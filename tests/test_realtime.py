@@ -0,0 +1,50 @@
+# -- coding: utf-8 --
+"""实时推送消息处理的测试，WebSocket用按顺序返回消息的假对象代替"""
+import json
+import asyncio
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from routes.realtime import Connection, RealtimeHub
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def receive_text(self) -> str:
+        if not self.messages:
+            raise WebSocketDisconnect()
+        return self.messages.pop(0)
+
+def receive(message) -> Connection:
+    """处理一条消息，返回连接（待发送的消息在_pending中）"""
+    conn = Connection(FakeWebSocket([json.dumps(message)]))
+
+    async def main():
+        with pytest.raises(WebSocketDisconnect):
+            await RealtimeHub()._receive_loop(conn)
+
+    asyncio.run(main())
+    return conn
+
+@pytest.mark.parametrize("message", [
+    {"action": "subscribe", "topics": ["logs"], "options": ["logs"]},
+    {"action": "subscribe", "topics": ["logs"], "options": {"logs": "error"}},
+    {"action": "subscribe", "topics": ["logs"], "options": {"logs": {"type": ["error"]}}},
+    {"action": "subscribe", "topics": ["processes"], "options": {"processes": {"sort": ["cpu"]}}},
+    {"action": "subscribe", "topics": "logs"},
+    {"action": "subscribe", "topics": [["logs"]]},
+    {"action": "subscribe", "topics": 1},
+])
+def test_malformed_message_reports_error(message):
+    conn = receive(message)
+    error = json.loads(conn._pending["error"])
+    assert error["topic"] == "error"
+    # 校验在订阅之前完成，不会留下半订阅的主题
+    assert not conn.topics
+
+def test_valid_subscription():
+    conn = receive({"action": "subscribe", "topics": ["services"], "options": {"services": None}})
+    assert "error" not in conn._pending
+    assert conn.topics == {"services"}
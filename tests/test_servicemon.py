@@ -0,0 +1,57 @@
+# -- coding: utf-8 --
+"""服务进程树采样的测试，进程用假的psutil.Process代替"""
+import contextlib
+from collections import namedtuple
+
+import psutil
+
+from routes.servicemon import ServiceStats
+
+MemInfo = namedtuple("MemInfo", ["rss", "vms", "uss"])
+CpuTimes = namedtuple("CpuTimes", ["user", "system"])
+
+class FakeProcess:
+    def __init__(self, pid: int, children=(), denied=()):
+        self.pid = pid
+        self._children = list(children)
+        self._denied = set(denied)
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+    def _read(self, field, value):
+        if field in self._denied:
+            raise psutil.AccessDenied(self.pid)
+        return value
+
+    def children(self, recursive=False):
+        return self._children
+
+    def memory_full_info(self):
+        return self._read("memory_full_info", MemInfo(1000, 0, 600))
+
+    def memory_info(self):
+        return MemInfo(1000, 0, 0)
+
+    def num_threads(self):
+        return self._read("num_threads", 2)
+
+    def num_fds(self):
+        return self._read("num_fds", 10)
+
+    def cpu_times(self):
+        return CpuTimes(1.0, 0.0)
+
+def test_partially_denied_process_not_counted(monkeypatch):
+    root = FakeProcess(1, children=[FakeProcess(2, denied={"num_fds"}), FakeProcess(3, denied={"memory_full_info"})])
+    stats = ServiceStats("bot", 10)
+    stats.pid = 1
+    monkeypatch.setattr(stats, "_process", lambda pid: root)
+    totals = stats.sample(100.0)
+    # 进程2读取fds失败，整个不计入；进程3只是没有uss
+    assert totals["rss"] == 2000
+    assert totals["uss"] == 600
+    assert totals["threads"] == 4
+    assert totals["fds"] == 20
+    assert set(stats._procs) == {1, 3}
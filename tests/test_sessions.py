@@ -0,0 +1,62 @@
+# -- coding: utf-8 --
+"""会话管理的测试，SQLite数据库放在临时目录中"""
+import asyncio
+import threading
+
+from routes.sessions import SessionManager, SignedTokenBackend, SqliteSessionBackend
+
+CONFIG = {"backend": "sqlite", "ttl": 3600, "cleanup_interval": 600, "cache_size": 16, "cache_ttl": 5, "secret": ""}
+
+class RecordingBackend(SqliteSessionBackend):
+    """记录每次查询所在的线程"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.threads = []
+
+    def get(self, token):
+        self.threads.append(threading.current_thread())
+        return super().get(token)
+
+def make_manager(tmp_path) -> SessionManager:
+    manager = SessionManager()
+    manager.config = CONFIG
+    manager._backend = RecordingBackend(str(tmp_path / "sessions.db"))
+    return manager
+
+def test_cache_miss_queries_backend_off_loop(tmp_path):
+    manager = make_manager(tmp_path)
+    token = manager.create({"username": "firefly"})
+    # 模拟其他worker创建的会话：本进程缓存中没有
+    manager._cache.clear()
+
+    async def main():
+        assert await manager.aget(token) == {"username": "firefly"}
+        # 命中缓存，不再查询后端
+        assert await manager.aget(token) == {"username": "firefly"}
+        assert await manager.aget("missing") is None
+        assert await manager.aget(None) is None
+
+    asyncio.run(main())
+    threads = manager.backend.threads
+    assert len(threads) == 2
+    assert all(thread is not threading.main_thread() for thread in threads)
+    manager.close()
+
+def test_delete_takes_effect_after_cache_expires(tmp_path):
+    manager = make_manager(tmp_path)
+    token = manager.create({"username": "firefly"})
+    other = make_manager(tmp_path)
+    other.delete(token)
+    assert manager.get(token) == {"username": "firefly"}
+    manager._cache.clear()
+    assert asyncio.run(manager.aget(token)) is None
+    manager.close()
+    other.close()
+
+def test_signed_token_rejects_malformed_tokens():
+    backend = SignedTokenBackend(b"secret")
+    token = backend.create({"username": "firefly"}, 60)
+    assert backend.get(token)[0] == {"username": "firefly"}
+    for malformed in ("abc.é", "é.abc", token + "é", "\udcff.abc", "abc", ""):
+        assert backend.get(malformed) is None
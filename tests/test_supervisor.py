@@ -0,0 +1,188 @@
+# -- coding: utf-8 --
+"""受管子进程的测试，子进程用临时目录中的小脚本模拟"""
+import os
+import sys
+import time
+import asyncio
+import textwrap
+
+import psutil
+import pytest
+
+from routes.supervisor import ManagedService, ServiceSpec, RUNNING, BACKOFF, FAILED, STARTING, STOPPED
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="依赖POSIX信号和进程组")
+
+def write_script(tmp_path, name: str, body: str) -> str:
+    path = tmp_path / name
+    path.write_text(textwrap.dedent(body), encoding="utf-8")
+    return str(path)
+
+def make_service(script: str, *args: str, **options) -> ManagedService:
+    options.setdefault("backoff_base", 0.05)
+    options.setdefault("backoff_max", 0.2)
+    options.setdefault("stop_timeout", 2.0)
+    return ManagedService(ServiceSpec("dummy", [sys.executable, script, *args], **options))
+
+async def wait_until(predicate, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        await asyncio.sleep(0.02)
+
+def launches(path) -> int:
+    return len(path.read_text().splitlines()) if path.exists() else 0
+
+def gone(pid: int) -> bool:
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+# 每次启动记一行，然后以指定的退出码退出
+CRASH = """
+    import sys
+    with open(sys.argv[1], "a") as f:
+        f.write("x\\n")
+    sys.exit(int(sys.argv[2]))
+"""
+
+# 写入PID后一直运行；带ignore参数时忽略SIGTERM
+SLEEPER = """
+    import os, sys, time, signal
+    if len(sys.argv) > 2:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    with open(sys.argv[1], "w") as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+"""
+
+# 启动一个继承了标准输出的孙进程，然后退出
+ORPHANING = """
+    import subprocess, sys
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    with open(sys.argv[1], "w") as f:
+        f.write(str(child.pid))
+    print("started helper", flush=True)
+    sys.exit(3)
+"""
+
+def test_crash_backoff_restart(tmp_path):
+    marker = tmp_path / "launches"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "crash.py", CRASH), str(marker), "1")
+        assert service.start()
+        await wait_until(lambda: launches(marker) >= 3)
+        # 新一次启动会清空退出码，在等待重启时检查
+        await wait_until(lambda: service.restarts >= 2 and service.state == BACKOFF)
+        assert service.exit_code == 1
+        await service.stop()
+        assert service.state == STOPPED
+
+    asyncio.run(main())
+
+def test_failed_after_max_retries(tmp_path):
+    marker = tmp_path / "launches"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "crash.py", CRASH), str(marker), "3", max_retries=2)
+        service.start()
+        await wait_until(lambda: service.state == FAILED)
+        # 首次启动加两次重试
+        assert launches(marker) == 3
+        assert service.exit_code == 3
+        await asyncio.sleep(0.3)
+        assert launches(marker) == 3
+
+    asyncio.run(main())
+
+def test_backoff_grows_exponentially():
+    service = make_service("unused", backoff_base=1.0, backoff_max=5.0)
+    delays = []
+    for retries in range(1, 6):
+        service._retries = retries
+        delays.append(service._backoff())
+    assert delays == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+def test_sigterm_escalates_to_sigkill(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "sleeper.py", SLEEPER), str(pidfile), "ignore",
+                               stop_timeout=0.5)
+        service.start()
+        await wait_until(lambda: pidfile.exists() and pidfile.read_text())
+        pid = int(pidfile.read_text())
+        assert service.state == RUNNING
+        started = time.monotonic()
+        await asyncio.wait_for(service.stop(), timeout=5)
+        assert time.monotonic() - started >= 0.5
+        assert service.exit_code == -9
+        assert gone(pid)
+        assert service.state == STOPPED
+
+    asyncio.run(main())
+
+def test_stop_while_starting(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "sleeper.py", SLEEPER), str(pidfile))
+        service.start()
+        # 让任务进入启动流程，此时还没有可以发信号的进程
+        await asyncio.sleep(0)
+        assert service.state == STARTING
+        assert service.pid is None
+        await asyncio.wait_for(service.stop(), timeout=5)
+        assert service.state == STOPPED
+        assert service.process is not None and service.process.returncode is not None
+        assert gone(service.process.pid)
+
+    asyncio.run(main())
+
+def test_stop_during_backoff(tmp_path):
+    marker = tmp_path / "launches"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "crash.py", CRASH), str(marker), "1",
+                               backoff_base=30, backoff_max=30)
+        service.start()
+        await wait_until(lambda: service.state == BACKOFF)
+        started = time.monotonic()
+        await asyncio.wait_for(service.stop(), timeout=5)
+        assert time.monotonic() - started < 1
+        assert service.state == STOPPED
+        assert launches(marker) == 1
+
+    asyncio.run(main())
+
+def test_grandchild_holding_pipe(tmp_path):
+    pidfile = tmp_path / "helper"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "orphaning.py", ORPHANING), str(pidfile),
+                               backoff_base=30, backoff_max=30)
+        service.start()
+        # 主进程退出即视为崩溃，不等待孙进程关闭管道
+        await wait_until(lambda: service.state == BACKOFF, timeout=5)
+        assert service.exit_code == 3
+        # 重启之前结束了遗留的孙进程
+        assert gone(int(pidfile.read_text()))
+        await service.stop()
+        assert service.state == STOPPED
+
+    asyncio.run(main())
+
+def test_grandchild_holding_pipe_restarts(tmp_path):
+    pidfile = tmp_path / "helper"
+
+    async def main():
+        service = make_service(write_script(tmp_path, "orphaning.py", ORPHANING), str(pidfile))
+        service.start()
+        await wait_until(lambda: service.restarts >= 2, timeout=10)
+        await service.stop()
+        assert gone(int(pidfile.read_text()))
+
+    asyncio.run(main())